@@ -144,6 +144,7 @@ class FitWorker(QThread):
                                         fit_fr = fit_fr,
                                         initial = initial,
                                         minimizer = 'leastsq',
+                                        minmethod = 'least_squares',
                                         fit_for = self.fit_for,
                                         plot_science = False,
                                         create_pdf = self.checkbox_dict['create_pdf'],
@@ -441,7 +442,7 @@ class PlotData(FigureCanvas):
             fithelp = [nsources, None, data.bispec_ind, 'numeric', data.wlSC, data.dlambda,
                        None, None, phasemap, None, None, None,
                        None, None, None,
-                       False, data.pm_sources, False]
+                       False, data.pm_sources, False, None, None]
 
             wave_model = data.wlSC
             dlambda_model = data.dlambda
@@ -5,13 +5,15 @@ setup(name='mygravipy',
       author='Felix Widmann',
       description='Package to work with GRAVITY GC data',
       url='https://github.com/widmannf/mygravipy',
-      python_requires='>=3.7',
+      python_requires='>=3.9',
       packages=['mygravipy'],
       package_dir={'':'src'},
       package_data={'mygravipy': ['Phasemaps/*.npy',
                                 'Datafiles/*',
                                 'met_corrections/*.npy']},
       include_package_data=True,
+      entry_points={'console_scripts': [
+          'mygravipy-fit=mygravipy.batchfit:main']},
       install_requires=[
         'matplotlib',
         'numpy',
@@ -21,7 +23,6 @@ setup(name='mygravipy',
         'emcee',
         'corner',
         'mpmath',
-        'joblib',
         'lmfit',
         'numba',
         'p2api',
@@ -1,5 +1,6 @@
 from .gravdata import *
 from .gravmfit import *
+from .batchfit import BatchFit
 from .gcorbits import *
 from .utils import *
 
@@ -0,0 +1,286 @@
+import os
+import ast
+import glob
+import time
+import logging
+import argparse
+import traceback
+import multiprocessing
+import numpy as np
+import pandas as pd
+from collections import deque
+from multiprocessing.connection import wait
+
+from .utils import log_level_mapping
+from .gravmfit import GravMFit, FitResultStore
+
+
+def find_files(paths, pattern='*dualsciviscalibrated.fits'):
+    """
+    Sorted list of all files in paths, which can be directories
+    (searched for pattern), glob patterns or single files
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(glob.glob(os.path.join(path, pattern)))
+        else:
+            files.extend(glob.glob(path))
+    return sorted(set(files))
+
+
+def _fit_file(conn, filename, fit_kwargs, loglevel):
+    """
+    Fit of one file in a worker process of BatchFit, sends back the
+    status and the traceback of a failed fit. The results are in the
+    results store
+    """
+    try:
+        import matplotlib.pyplot as plt
+        plt.switch_backend('Agg')
+        # forked workers would all continue the random state of the parent
+        np.random.seed()
+        data = GravMFit(filename, loglevel=loglevel)
+        data.prep_fit(fit=True, plot=False, **fit_kwargs)
+        conn.send(('done', None))
+    except Exception:
+        conn.send(('failed', traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+class BatchFit():
+    def __init__(self, files, workers=1, timeout=None, retries=1,
+                 save_result='batch', resume=True, pattern=None,
+                 loglevel='INFO', fit_loglevel='WARNING', **fit_kwargs):
+        """
+        BatchFit: Headless fit of many GRAVITY files with GravMFit
+
+        Each file gets its own GravMFit, the initial values of the
+        sources come from prep_fit (GCorbits). The fits run in worker
+        processes, a new one for each file, so that a fit can be stopped
+        after the timeout. The results are saved by fit_stars
+        (save_result) in the results store (FitResultStore) and files
+        with saved results are skipped.
+
+        Main functions:
+        run : fit all files, returns a summary table
+
+        files:        directory, glob pattern, file or a list of them
+        workers:      number of files fitted at the same time [1]
+        timeout:      time limit of a fit in seconds [None]
+        retries:      number of retries of failed or stopped fits [1]
+        save_result:  name of the results in ./fitresults [batch]
+        resume:       skip files with saved results [True]
+        pattern:      file pattern in directories
+                      [*dualsciviscalibrated.fits]
+        loglevel:     level of the batch logger [INFO]
+        fit_loglevel: level of the fits [WARNING]
+        fit_kwargs:   arguments for fit_stars, e.g. nthreads (cores of
+                      each fit), nwalkers or nruns
+        """
+        log_level = log_level_mapping.get(loglevel, logging.INFO)
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(log_level)
+        if pattern is None:
+            self.files = find_files(files)
+        else:
+            self.files = find_files(files, pattern)
+        if not self.files:
+            self.logger.error(f'No files found in {files}')
+            raise ValueError(f'No files found in {files}')
+        if workers < 1:
+            self.logger.error('workers has to be at least 1')
+            raise ValueError('workers has to be at least 1')
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        self.save_result = save_result
+        self.resume = resume and not fit_kwargs.get('refit', False)
+        self.fit_loglevel = fit_loglevel
+        fit_kwargs.setdefault('plot_science', False)
+        self.fit_kwargs = dict(fit_kwargs, save_result=save_result)
+        self.store = FitResultStore('./fitresults/fitresults.db',
+                                    loglevel=loglevel)
+
+    def result_name(self, filename):
+        """
+        Name of the results of a file saved by earlier versions
+        """
+        filename = os.path.basename(filename)
+        return f'./fitresults/{self.save_result}_{filename[:-4]}pd'
+
+    def has_result(self, filename):
+        """
+        Whether results of a file are saved, from the index of the
+        results store
+        """
+        if self.store.lookup(filename, self.save_result) is not None:
+            return True
+        return os.path.exists(self.result_name(filename))
+
+    def run(self):
+        """
+        Fits all files, at most workers at once. Returns a table with
+        status (done, exists, failed, timeout), number of attempts,
+        run time and error of each file
+        """
+        nfiles = len(self.files)
+        pending = deque((filename, 1) for filename in self.files)
+        running = {}
+        summary = []
+        self.logger.info(f'Fit {nfiles} files with {self.workers} workers')
+        ctx = multiprocessing.get_context()
+        try:
+            while pending or running:
+                # only as many fits are started as there are workers,
+                # the others wait in the queue
+                while pending and len(running) < self.workers:
+                    filename, attempt = pending.popleft()
+                    if (attempt == 1 and self.resume
+                            and self.has_result(filename)):
+                        summary.append([filename, 'exists', 0, 0., None])
+                        self.logger.info('[%i/%i] %s: results exist'
+                                         % (len(summary), nfiles,
+                                            os.path.basename(filename)))
+                        continue
+                    recv, send = ctx.Pipe(duplex=False)
+                    proc = ctx.Process(target=_fit_file,
+                                       args=(send, filename, self.fit_kwargs,
+                                             self.fit_loglevel))
+                    proc.start()
+                    send.close()
+                    running[recv] = (filename, attempt, proc, time.time())
+                if not running:
+                    continue
+
+                wait_time = None
+                if self.timeout is not None:
+                    first = min(run[3] for run in running.values())
+                    wait_time = max(0, first + self.timeout - time.time())
+                ready = wait(list(running), timeout=wait_time)
+                now = time.time()
+                for conn in list(running):
+                    filename, attempt, proc, start = running[conn]
+                    if conn in ready:
+                        try:
+                            status, error = conn.recv()
+                        except EOFError:
+                            proc.join()
+                            status = 'failed'
+                            error = ('Worker stopped with exit code %s'
+                                     % proc.exitcode)
+                    elif (self.timeout is not None
+                          and now - start >= self.timeout):
+                        proc.terminate()
+                        status = 'timeout'
+                        error = f'No result after {self.timeout} s'
+                    else:
+                        continue
+                    proc.join()
+                    conn.close()
+                    del running[conn]
+
+                    name = os.path.basename(filename)
+                    if status == 'done':
+                        summary.append([filename, status, attempt,
+                                        now - start, None])
+                        self.logger.info('[%i/%i] %s: done in %.1f s'
+                                         % (len(summary), nfiles, name,
+                                            now - start))
+                    elif attempt <= self.retries:
+                        self.logger.warning(f'{name}: {status}, retry')
+                        self.logger.debug(error)
+                        pending.append((filename, attempt + 1))
+                    else:
+                        summary.append([filename, status, attempt,
+                                        now - start, error])
+                        self.logger.error('[%i/%i] %s: %s'
+                                          % (len(summary), nfiles, name,
+                                             status))
+                        self.logger.debug(error)
+        finally:
+            for conn, (_, _, proc, _) in running.items():
+                proc.terminate()
+                proc.join()
+                conn.close()
+
+        summary = pd.DataFrame(summary, columns=['file', 'status',
+                                                 'attempts', 'time',
+                                                 'error'])
+        counts = summary['status'].value_counts()
+        self.logger.info(', '.join(f'{counts[s]} {s}' for s in counts.index))
+        self.summary = summary
+        return summary
+
+
+def _parse_value(value):
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return value
+
+
+def main(argv=None):
+    """
+    mygravipy-fit: fits all files of a directory with BatchFit
+    """
+    parser = argparse.ArgumentParser(
+        prog='mygravipy-fit',
+        description='Fit GRAVITY files with GravMFit, initial values from '
+                    'the stellar orbits. Results are saved in ./fitresults')
+    parser.add_argument('paths', nargs='+',
+                        help='directories, glob patterns or files')
+    parser.add_argument('--pattern', default='*dualsciviscalibrated.fits',
+                        help='file pattern in directories [%(default)s]')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='files fitted at the same time [%(default)s]')
+    parser.add_argument('-n', '--nthreads', type=int, default=1,
+                        help='cores of each fit [%(default)s]')
+    parser.add_argument('--nwalkers', type=int, help='MCMC walkers')
+    parser.add_argument('--nruns', type=int, help='MCMC steps')
+    parser.add_argument('--minimizer', choices=['emcee', 'leastsq'])
+    parser.add_argument('--timeout', type=float,
+                        help='time limit of a fit in seconds')
+    parser.add_argument('--retries', type=int, default=1,
+                        help='retries of failed fits [%(default)s]')
+    parser.add_argument('--save-result', default='batch',
+                        help='name of the results [%(default)s]')
+    parser.add_argument('--refit', action='store_true',
+                        help='fit files with saved results again')
+    parser.add_argument('--summary', help='save the summary as csv file')
+    parser.add_argument('--loglevel', default='INFO',
+                        choices=list(log_level_mapping))
+    parser.add_argument('-o', '--option', action='append', default=[],
+                        metavar='KEY=VALUE',
+                        help='further argument of fit_stars, '
+                             'e.g. -o fit_mode=analytic -o phasemaps=False')
+    args = parser.parse_args(argv)
+
+    fit_kwargs = {}
+    for option in args.option:
+        if '=' not in option:
+            parser.error(f'Option {option} is not of the form KEY=VALUE')
+        key, value = option.split('=', 1)
+        fit_kwargs[key.strip()] = _parse_value(value.strip())
+    for key in ['nwalkers', 'nruns', 'minimizer']:
+        if getattr(args, key) is not None:
+            fit_kwargs[key] = getattr(args, key)
+    if args.refit:
+        fit_kwargs['refit'] = True
+
+    try:
+        batch = BatchFit(args.paths, workers=args.workers,
+                         timeout=args.timeout, retries=args.retries,
+                         save_result=args.save_result, pattern=args.pattern,
+                         loglevel=args.loglevel, nthreads=args.nthreads,
+                         **fit_kwargs)
+    except ValueError as e:
+        parser.error(str(e))
+    summary = batch.run()
+    if args.summary:
+        summary.to_csv(args.summary, index=False)
+    return int(not summary['status'].isin(['done', 'exists']).all())
+
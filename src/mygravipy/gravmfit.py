@@ -5,6 +5,15 @@ import corner
 import math
 import mpmath
 import os
+import json
+import hashlib
+import pickle
+import sqlite3
+import contextlib
+import weakref
+import functools
+import itertools
+import concurrent.futures
 import pandas as pd
 import dynesty
 import time
@@ -13,21 +22,22 @@ import matplotlib.colors as mc
 from astropy.io import fits
 from astropy.convolution import Gaussian2DKernel
 from matplotlib import gridspec
-from multiprocessing import Pool
-from scipy import signal, interpolate, stats
+from multiprocessing import Pool, shared_memory, resource_tracker
+from scipy import signal, interpolate, stats, fft, ndimage
+from scipy.optimize import least_squares
 from pkg_resources import resource_filename
 from lmfit import minimize, Parameters
 from dynesty import plotting as dyplot
 from dynesty import utils as dyfunc
-from numba import jit
+from numba import jit, njit, prange
 from reportlab.lib.pagesizes import A4
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
 from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet
 from io import BytesIO
+from collections import OrderedDict
 from svglib.svglib import svg2rlg
 from reportlab.platypus import PageBreak
-from joblib import Parallel, delayed
 
 from .gravdata import *
 from .gcorbits import GCorbits
@@ -102,6 +112,734 @@ def procrustes(a, target, padval=0):
     return b
 
 
+class _PhaseScreens():
+    def __init__(self, coefficients, lam_min, MFR=0.6308, stopB=8.0,
+                 stopS=0.96, d1=8.0, dalpha=1., totN=1024, amax=100,
+                 workers=1):
+        """
+        Simulated complex PSFs of the telescopes, taking into account
+        static aberrations, for many wavelengths
+
+        The coordinate grids, the pupil support and the zernike basis
+        are set up once, for each wavelength the basis is shared by all
+        telescopes and the FFTs of all telescopes are done in one batch
+
+        * Static aberrations in the pupil plane are described by
+        * low-order Zernicke polynomials
+        * Their amplitudes are in units of micro-meter
+        coefficients: one set of 33 coefficients per telescope
+        00: A00  (float) : piston
+        01: A1m1 (float) : vertical tilt
+        02: A1p1 (float) : horizontal tilt
+        03: A2m2 (float) : vertical astigmatism
+        04: A2p2 (float) : horizontal astigmatism
+        05: A20  (float) : defocuss
+        06: A3m1 (float) : vertical coma
+        07: A3p1 (float) : horizontal coma
+        08: A3m3 (float) : vertical trefoil
+        09: A3p3 (float) : oblique trefoil
+        10: A4m2 (float) : oblique secondary astigmatism
+        11: A4p2 (float) : vertical secondary astigmatism
+        12: A4m4 (float) : oblique quadrafoil
+        13: A4p4 (float) : vertical quadrafoil
+        14: A40  (float) : primary spherical
+        15-27: A5m1, A5p1, A5m3, A5p3, A5m5, A5p5,
+               A6m6, A6p6, A6m4, A6p4, A6m2, A6p2, A60
+
+        * Static aberrations in the focal plane
+        28: B1m1 (float) : missplacement of the fiber mode in u1-direction
+        29: B1p1 (float) : missplacement of the fiber mode in u2-direction
+        30: B20  (float) : defocuss
+        31: B2m2 (float) : vertical astigmatism
+        32: B2p2 (float) : horizontal astigmatism
+
+        * optical system
+        lam_min (float) : smallest wavelength in micro-meter, sets the
+                          pupil support
+        MFR (float)   : sigma of fiber mode profile in units of dish radius
+        stopB (float) : outer stop diameter in meters
+        stopS (float) : inner stop diameter in meters
+        d1     (float) : telescope to normalize Zernike RMS in m
+                         (UT=8.0, AT=1.82)
+
+        * further parameters specify the output grid
+        dalpha (float) : pixel width in the imaging plane in mas
+        totN   (float) : total number of pixels in the pupil plane
+        amax   (float) : maximum off-axis distance in the maps returned
+        workers (int)  : workers for scipy.fft
+        """
+        self.coef = np.asarray(coefficients, dtype=float)
+        self.MFR = MFR
+        self.stopB = stopB
+        self.stopS = stopS
+        self.d1 = d1
+        self.totN = totN
+        self.workers = workers
+        self.mas = 1.e-3 * (2.*np.pi/360) * 1./3600
+
+        # --- coordinates, the pupil plane scales with lambda --- #
+        # (u = ii*du*lam0 with du independent of lam0)
+        ii = np.fft.fftshift(np.arange(totN) - (totN/2))
+        a1, a2 = np.meshgrid(ii*dalpha, ii*dalpha)
+        self.aa = np.sqrt(a1*a1 + a2*a2)
+        du = 1/(totN*self.mas*dalpha)
+        u1, u2 = np.meshgrid(ii*du, ii*du)
+        r_unit = np.sqrt(u1*u1 + u2*u2)
+        self.t = np.angle(u1 + 1j*u2)
+
+        # --- cut our central part --- #
+        hmapN = int(amax/dalpha)
+        self.cc = slice(int(totN/2)-hmapN, int(totN/2)+hmapN+1)
+        if 2*hmapN > totN:
+            raise ValueError('Requested map sizes too large')
+
+        # --- pupil support for all wavelengths --- #
+        self.support = np.nonzero(r_unit*lam_min*1e-6 < stopB/2.)
+        self.r_unit = r_unit[self.support]
+        self.t_support = self.t[self.support]
+
+        # --- focal plane aberrations, independent of lambda --- #
+        sigma_ref = 2.2e-6/d1/np.pi/MFR/self.mas
+        rho = self.aa/sigma_ref
+        self.focal_zernike = []
+        for coef in self.coef:
+            B1m1, B1p1, B20, B2m2, B2p2 = coef[28:]
+            zernike = 0
+            zernike += B1m1*2*rho*np.sin(self.t)
+            zernike += B1p1*2*rho*np.cos(self.t)
+            zernike += B20*np.sqrt(3.)*(2.*rho**2 - 1)
+            zernike += B2m2*np.sqrt(6.)*rho**2*np.sin(2.*self.t)
+            zernike += B2p2*np.sqrt(6.)*rho**2*np.cos(2.*self.t)
+            self.focal_zernike.append(zernike)
+
+    def zernike_basis(self, rho, t):
+        """
+        Zernike polynomials of the pupil aberrations A00 ... A60
+        rho: radius in units of the telescope radius
+        returns (28, len(rho))
+        """
+        return np.array([
+            np.ones_like(rho),
+            2*rho*np.sin(t),
+            2*rho*np.cos(t),
+            np.sqrt(6.)*rho**2*np.sin(2.*t),
+            np.sqrt(6.)*rho**2*np.cos(2.*t),
+            np.sqrt(3.)*(2.*rho**2 - 1),
+            np.sqrt(8.)*(3.*rho**3 - 2.*rho)*np.sin(t),
+            np.sqrt(8.)*(3.*rho**3 - 2.*rho)*np.cos(t),
+            np.sqrt(8.)*rho**3*np.sin(3.*t),
+            np.sqrt(8.)*rho**3*np.cos(3.*t),
+            np.sqrt(10.)*rho**4*np.sin(4.*t),
+            np.sqrt(10.)*rho**4*np.cos(4.*t),
+            np.sqrt(10.)*(4.*rho**4 - 3.*rho**2)*np.sin(2.*t),
+            np.sqrt(10.)*(4.*rho**4 - 3.*rho**2)*np.cos(2.*t),
+            np.sqrt(5.)*(6.*rho**4 - 6.*rho**2 + 1),
+            2.*np.sqrt(3.)*(10*rho**5 - 12*rho**3 + 3.*rho)*np.sin(t),
+            2.*np.sqrt(3.)*(10*rho**5 - 12*rho**3 + 3.*rho)*np.cos(t),
+            2.*np.sqrt(3.)*(5.*rho**5 - 4.*rho**3)*np.sin(3.*t),
+            2.*np.sqrt(3.)*(5.*rho**5 - 4.*rho**3)*np.cos(3.*t),
+            2.*np.sqrt(3.)*rho**5*np.sin(5*t),
+            2.*np.sqrt(3.)*rho**5*np.cos(5*t),
+            np.sqrt(14.)*rho**6*np.sin(6.*t),
+            np.sqrt(14.)*rho**6*np.cos(6.*t),
+            np.sqrt(14.)*(6.*rho**6 - 5.*rho**4)*np.sin(4.*t),
+            np.sqrt(14.)*(6.*rho**6 - 5.*rho**4)*np.cos(4.*t),
+            np.sqrt(14.)*(15.*rho**6 - 20.*rho**4 - 6.*rho**2)*np.sin(2.*t),
+            np.sqrt(14.)*(15.*rho**6 - 20.*rho**4 - 6.*rho**2)*np.cos(2.*t),
+            np.sqrt(7.)*(20.*rho**6 - 30.*rho**4 + 12*rho**2 - 1)])
+
+    def __call__(self, lam0):
+        """
+        Complex PSFs of all telescopes at wavelength lam0 [micro-meter],
+        normalised to their maximum, shape (ntel, 2*amax/dalpha+1, ...)
+        """
+        lam0 = lam0*1e-6
+        ntel = len(self.coef)
+        r = self.r_unit*lam0
+
+        # --- pupil function on the support --- #
+        pupil = r < (self.stopB / 2.)
+        if self.stopS > 0.:
+            pupil = np.logical_and(r < (self.stopB/2.), r > (self.stopS/2.))
+
+        # --- fiber profile, with the focal plane aberrations --- #
+        # computed with an explicit fourier transform
+        sigma_fib = lam0/self.d1/np.pi/self.MFR/self.mas
+        gauss = np.exp(-0.5*(self.aa/sigma_fib)**2)
+        fiber = np.array([gauss*np.exp(2.*np.pi/lam0*1j*zernike*1e-6)
+                          for zernike in self.focal_zernike])
+        fiber = fft.fft2(fiber, workers=self.workers)
+
+        # --- phase screens (pupil plane) --- #
+        basis = self.zernike_basis(2.*r/self.d1, self.t_support)
+        phase = 2.*np.pi/lam0*np.dot(self.coef[:, :28], basis)*1.e-6
+
+        # --- transform to image plane --- #
+        field = np.zeros((ntel, self.totN, self.totN), dtype=np.complex_)
+        field[:, self.support[0], self.support[1]] = (
+            pupil * fiber[:, self.support[0], self.support[1]]
+            * np.exp(1j*phase))
+        complexPsf = fft.fftshift(fft.fft2(field, workers=self.workers),
+                                  axes=(-2, -1))
+        complexPsf = complexPsf[:, self.cc, self.cc]
+        return complexPsf/np.abs(complexPsf).max(axis=(1, 2))[:, None, None]
+
+
+class _FFTSmoother():
+    def __init__(self, kernel, shape, workers=1):
+        """
+        Convolution of a stack of maps with a fixed kernel (same output
+        size as signal.convolve2d(..., mode='same')), the FFT of the kernel
+        is computed once and reused for all maps
+        """
+        kernel = np.asarray(kernel)
+        self.shape = tuple(shape)
+        full = [s + k - 1 for s, k in zip(self.shape, kernel.shape)]
+        self.fshape = [fft.next_fast_len(n) for n in full]
+        self.start = [(k - 1)//2 for k in kernel.shape]
+        self.workers = workers
+        self.kernel_ft = fft.fft2(kernel, s=self.fshape, workers=workers)
+
+    def __call__(self, maps):
+        """
+        maps: (n, *shape) maps to smooth
+        """
+        res = fft.ifft2(fft.fft2(maps, s=self.fshape, workers=self.workers)
+                        * self.kernel_ft, workers=self.workers)
+        return res[:, self.start[0]:self.start[0]+self.shape[0],
+                   self.start[1]:self.start[1]+self.shape[1]]
+
+
+def _normalise_phasemaps(pm, pm_denom):
+    """
+    Amplitude and phase of the complex phasemaps and the intensity
+    (denominator) maps as float32, normalised to the maximum
+    of each channel and telescope
+    pm, pm_denom: (nwave, 4, 201, 201)
+    """
+    amp = np.abs(pm)
+    pha = np.angle(pm, deg=True)
+    denom = np.real(pm_denom)
+    return {'amp': (amp/np.max(amp, axis=(2, 3), keepdims=True)
+                    ).astype(np.float32),
+            'pha': pha.astype(np.float32),
+            'denom': (denom/np.max(denom, axis=(2, 3), keepdims=True)
+                      ).astype(np.float32)}
+
+
+def _resample_phasemaps(ref_wave, ref_pm, ref_denom, wave, order=4):
+    """
+    Complex phasemaps & intensity maps at the wavelengths wave from the
+    maps of a reference grid (see create_reference_phasemaps), Lagrange
+    interpolation on the order nearest reference wavelengths. Only these
+    planes are read, so the reference maps can be memory-mapped
+    """
+    ref_wave = np.asarray(ref_wave, dtype=float)
+    wave = np.asarray(wave, dtype=float)
+    if np.any(wave < ref_wave[0]) or np.any(wave > ref_wave[-1]):
+        raise ValueError('Wavelengths outside of the reference phasemaps')
+    pm = np.zeros((len(wave),) + ref_pm.shape[1:], dtype=np.complex_)
+    denom = np.zeros((len(wave),) + ref_denom.shape[1:])
+    for wdx, wl in enumerate(wave):
+        start = min(max(np.searchsorted(ref_wave, wl) - order//2, 0),
+                    len(ref_wave) - order)
+        nodes = ref_wave[start:start+order]
+        weights = [np.prod((wl - np.delete(nodes, k))
+                           / (nodes[k] - np.delete(nodes, k)))
+                   for k in range(order)]
+        pm[wdx] = np.tensordot(weights, ref_pm[start:start+order], 1)
+        denom[wdx] = np.tensordot(weights, ref_denom[start:start+order], 1)
+    return pm, denom
+
+
+class PhasemapStore():
+    def __init__(self, cache_dir=None, loglevel='INFO'):
+        """
+        PhasemapStore: Cache of the created phasemaps outside the package
+
+        cache_dir: directory of the store, by default $MYGRAVIPY_PHASEMAPS
+                   or ~/.cache/mygravipy/phasemaps (or $XDG_CACHE_HOME)
+
+        Each map is saved under a content key (tel, resolution,
+        smoothkernel, datayear and a hash of the wavelength grid) as one
+        .npy file per array plus a small json manifest. The manifest is
+        written last, a map is ready as soon as its manifest exists.
+        All files are written atomically (temporary file & rename), so
+        several processes or nodes can share one store
+
+        Main functions:
+        key : content key of a map
+        ready : cheap check if a map exists, without loading it
+        save : save the arrays of a map
+        load : load the arrays of a map
+        allocate, commit : write a map in pieces (resumable)
+        """
+        log_level = log_level_mapping.get(loglevel, logging.INFO)
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(log_level)
+        if cache_dir is None:
+            cache_dir = os.environ.get('MYGRAVIPY_PHASEMAPS')
+        if cache_dir is None:
+            cache_home = os.environ.get('XDG_CACHE_HOME',
+                                        os.path.join('~', '.cache'))
+            cache_dir = os.path.join(cache_home, 'mygravipy', 'phasemaps')
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+
+    @staticmethod
+    def wave_hash(wave):
+        """
+        Hash of the wavelength grid, rounded to 1e-6 micron
+        """
+        wave = np.round(np.asarray(wave, dtype=float), 6) + 0.
+        return hashlib.sha1(wave.tobytes()).hexdigest()[:12]
+
+    def key(self, tel, resolution, smoothkernel, datayear, wave):
+        return ('Phasemap_%s_%s_Smooth%i_%idata_%s'
+                % (tel, resolution, smoothkernel, datayear,
+                   self.wave_hash(wave)))
+
+    def reference_key(self, tel, smoothkernel, datayear):
+        """
+        Key of the wavelength independent reference maps, from which
+        the maps of any wavelength grid are resampled
+        """
+        return ('PhasemapReference_%s_Smooth%i_%idata'
+                % (tel, smoothkernel, datayear))
+
+    def path(self, key, name=None):
+        """
+        File of one array of a map, or of its manifest if name is None
+        """
+        if name is None:
+            return os.path.join(self.cache_dir, key + '.json')
+        return os.path.join(self.cache_dir, '%s_%s.npy' % (key, name))
+
+    def manifest(self, key):
+        """
+        Manifest of a map, None if it does not exist
+        """
+        try:
+            with open(self.path(key)) as f:
+                return json.load(f)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+    def ready(self, key):
+        manifest = self.manifest(key)
+        if manifest is None:
+            return False
+        return all(os.path.exists(self.path(key, name))
+                   for name in manifest['arrays'])
+
+    def save(self, key, arrays, **meta):
+        """
+        Saves the arrays (dict name: array) of a map, meta is added
+        to the manifest. Arrays of an earlier version of the map, which
+        are not in arrays, are removed
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for name, array in arrays.items():
+            array = np.asarray(array)
+            self._write_atomic(self.path(key, name),
+                               lambda f: np.save(f, array))
+        self._write_manifest(key, {name: np.asarray(array)
+                                   for name, array in arrays.items()}, meta)
+        self.logger.debug('Saved %s to %s' % (key, self.cache_dir))
+
+    def allocate(self, key, arrays, tag=''):
+        """
+        Preallocated arrays (dict name: (shape, dtype)) of a map, which is
+        written in pieces along the first axis, plus the flags 'done' of
+        the finished pieces. Files of an interrupted run with the same
+        key, tag and shapes are reused.
+        Returns dict name: path of the partial files (.npy)
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        npieces = {shape[0] for shape, _ in arrays.values()}
+        if len(npieces) != 1:
+            raise ValueError('Arrays need the same length of the first axis')
+        arrays = dict(arrays, done=((npieces.pop(),), bool))
+        paths = {name: os.path.join(self.cache_dir, '.partial_%s%s_%s.npy'
+                                    % (key, tag, name))
+                 for name in arrays}
+        resume = True
+        for name, (shape, dtype) in arrays.items():
+            try:
+                array = np.load(paths[name], mmap_mode='r')
+                resume &= (array.shape == tuple(shape)
+                           and array.dtype == np.dtype(dtype))
+            except (OSError, ValueError, EOFError):
+                resume = False
+        if not resume:
+            # the flags last, they are only valid with all arrays
+            for name, (shape, dtype) in arrays.items():
+                np.lib.format.open_memmap(paths[name], mode='w+',
+                                          dtype=dtype, shape=tuple(shape))
+        return paths
+
+    def commit(self, key, paths, arrays={}, **meta):
+        """
+        Moves the finished partial files of allocate into the store and
+        saves the additional arrays, meta is added to the manifest
+        """
+        written = {}
+        for name, path in paths.items():
+            if name == 'done':
+                continue
+            written[name] = np.load(path, mmap_mode='r')
+            with open(path, 'rb') as f:
+                os.fsync(f.fileno())
+            os.replace(path, self.path(key, name))
+        for name, array in arrays.items():
+            array = np.asarray(array)
+            self._write_atomic(self.path(key, name),
+                               lambda f: np.save(f, array))
+            written[name] = array
+        self._write_manifest(key, written, meta)
+        os.remove(paths['done'])
+        self.logger.debug('Saved %s to %s' % (key, self.cache_dir))
+
+    def _write_manifest(self, key, arrays, meta):
+        """
+        Writes the manifest of the arrays of a map (last, after all
+        arrays) and removes arrays of an earlier version of the map
+        """
+        old = self.manifest(key)
+        manifest = dict(meta, key=key, arrays={},
+                        created=time.strftime('%Y-%m-%dT%H:%M:%S'))
+        for name, array in arrays.items():
+            manifest['arrays'][name] = {'shape': list(array.shape),
+                                        'dtype': array.dtype.str}
+        self._write_atomic(self.path(key),
+                           lambda f: f.write(json.dumps(manifest, indent=1)
+                                             .encode()))
+        if old is not None:
+            for name in set(old['arrays']) - set(arrays):
+                if os.path.exists(self.path(key, name)):
+                    os.remove(self.path(key, name))
+
+    def load(self, key, mmap_mode=None):
+        """
+        Loads the arrays of a map as dict name: array
+        """
+        manifest = self.manifest(key)
+        if manifest is None:
+            raise ValueError('Phasemap %s not in %s' % (key, self.cache_dir))
+        return {name: np.load(self.path(key, name), mmap_mode=mmap_mode)
+                for name in manifest['arrays']}
+
+    def _write_atomic(self, path, write):
+        # not mkstemp, which creates files only readable by the owner:
+        # the store is shared, the umask sets the permissions
+        tmp = os.path.join(self.cache_dir, '.tmp_%s' % os.urandom(8).hex())
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+
+# fit_stars options which do not change the result,
+# not part of the configuration hash of the results store
+_RUN_OPTIONS = ['save_result', 'save_mcmc', 'refit', 'plot_corner',
+                'vectorize', 'compiled', 'numba_parallel', 'parallel_fits',
+                'pool', 'phasemap_dir']
+
+
+class FitResultStore():
+    def __init__(self, path=None, timeout=60, loglevel='INFO'):
+        """
+        FitResultStore: Results of fit_stars (the fittab) of many files
+        in one indexed table
+
+        path:    database file [./fitresults/fitresults.db]
+        timeout: time to wait for other writers [60 s]
+
+        One SQLite file holds all results: a table of the fits, indexed
+        by file, result name (save_result), DATE-OBS, target and a hash
+        of the fit configuration, and one row per parameter value.
+        Several processes can write at the same time. Queries only read
+        the requested parameters.
+
+        Main functions:
+        lookup : cheap check if results of a file exist
+        save : save the fittab of a file
+        load : load the fittab of a file
+        query : index of the saved fits
+        timeseries : parameters and their errors over time
+        """
+        log_level = log_level_mapping.get(loglevel, logging.INFO)
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(log_level)
+        if path is None:
+            path = os.path.join('fitresults', 'fitresults.db')
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.timeout = timeout
+        self._ready = False
+
+    @staticmethod
+    def config_hash(config):
+        """
+        Hash of a fit configuration (dict of the fit_stars arguments)
+        """
+        def default(value):
+            if isinstance(value, (np.ndarray, np.generic)):
+                return value.tolist()
+            return type(value).__name__
+        text = json.dumps(config, sort_keys=True, default=default)
+        return hashlib.sha1(text.encode()).hexdigest()[:12]
+
+    @contextlib.contextmanager
+    def _connect(self, write=False):
+        if not self._ready:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=self.timeout,
+                               isolation_level=None)
+        try:
+            if write or not self._ready:
+                # takes the write lock at once, waits for other writers
+                conn.execute('BEGIN IMMEDIATE')
+            if not self._ready:
+                self._create(conn)
+            yield conn
+            if conn.in_transaction:
+                conn.execute('COMMIT')
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        self._ready = True
+
+    @staticmethod
+    def _create(conn):
+        conn.execute("""CREATE TABLE IF NOT EXISTS fits (
+                            id INTEGER PRIMARY KEY,
+                            file TEXT NOT NULL,
+                            name TEXT NOT NULL,
+                            date_obs TEXT,
+                            mjd REAL,
+                            target TEXT,
+                            config TEXT,
+                            saved REAL,
+                            labels TEXT,
+                            columns TEXT,
+                            UNIQUE (file, name))""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS results (
+                            fit INTEGER NOT NULL,
+                            row INTEGER NOT NULL,
+                            col INTEGER NOT NULL,
+                            kind TEXT,
+                            pol INTEGER,
+                            dit INTEGER,
+                            param TEXT NOT NULL,
+                            value REAL)""")
+        for index, table, columns in [('fits_date', 'fits', 'date_obs'),
+                                      ('fits_target', 'fits', 'target'),
+                                      ('fits_config', 'fits', 'config'),
+                                      ('results_fit', 'results', 'fit'),
+                                      ('results_param', 'results',
+                                       'param, kind, fit')]:
+            conn.execute('CREATE INDEX IF NOT EXISTS %s ON %s (%s)'
+                         % (index, table, columns))
+
+    @staticmethod
+    def _split_label(label):
+        # fittab rows are labeled like 'M.L. P0_1' (polarisation 0, DIT 1)
+        kind, _, poldit = label.rpartition(' ')
+        try:
+            pol, dit = poldit[1:].split('_')
+            return kind, int(pol), int(dit)
+        except ValueError:
+            return label, None, None
+
+    def lookup(self, file, name):
+        """
+        Index entry (dict) of the results of a file, None if there are
+        none. Only reads the index
+        """
+        file = os.path.basename(file)
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute('SELECT id, file, name, date_obs, mjd, '
+                               'target, config, saved FROM fits '
+                               'WHERE file = ? AND name = ?',
+                               (file, name)).fetchone()
+        return None if row is None else dict(row)
+
+    def save(self, fittab, file, name, date_obs=None, mjd=None,
+             target=None, config=None):
+        """
+        Saves the fittab of a file under name, replaces earlier results
+        of the file with the same name
+        """
+        file = os.path.basename(file)
+        labels = [str(label) for label in fittab['column']]
+        columns = [str(col) for col in fittab.columns if col != 'column']
+        values = fittab[columns].to_numpy(dtype=float)
+        with self._connect(write=True) as conn:
+            old = conn.execute('SELECT id FROM fits WHERE file = ? '
+                               'AND name = ?', (file, name)).fetchone()
+            if old is not None:
+                conn.execute('DELETE FROM results WHERE fit = ?', old)
+                conn.execute('DELETE FROM fits WHERE id = ?', old)
+            fit_id = conn.execute('INSERT INTO fits (file, name, date_obs, '
+                                  'mjd, target, config, saved, labels, '
+                                  'columns) VALUES (?, ?, ?, ?, ?, ?, ?, '
+                                  '?, ?)',
+                                  (file, name, date_obs, mjd, target,
+                                   config, time.time(), json.dumps(labels),
+                                   json.dumps(columns))).lastrowid
+            rows = []
+            for row, label in enumerate(labels):
+                kind, pol, dit = self._split_label(label)
+                for col, param in enumerate(columns):
+                    # empty cells are not stored
+                    if np.isfinite(values[row, col]):
+                        rows.append((fit_id, row, col, kind, pol, dit,
+                                     param, float(values[row, col])))
+            conn.executemany('INSERT INTO results VALUES '
+                             '(?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        self.logger.debug(f'Saved results of {file} as {name}')
+
+    def load(self, file, name):
+        """
+        fittab of a file as saved, None if there are no results
+        """
+        file = os.path.basename(file)
+        with self._connect() as conn:
+            fit = conn.execute('SELECT id, labels, columns FROM fits '
+                               'WHERE file = ? AND name = ?',
+                               (file, name)).fetchone()
+            if fit is None:
+                return None
+            rows = conn.execute('SELECT row, col, value FROM results '
+                                'WHERE fit = ?', (fit[0],)).fetchall()
+        labels = json.loads(fit[1])
+        columns = json.loads(fit[2])
+        values = np.full((len(labels), len(columns)), np.nan)
+        if rows:
+            row, col, value = np.array(rows, dtype=float).T
+            values[row.astype(int), col.astype(int)] = value
+        fittab = pd.DataFrame(values, columns=columns)
+        fittab.insert(0, 'column', labels)
+        return fittab
+
+    @staticmethod
+    def _where(name=None, target=None, config=None, start=None, end=None):
+        where, args = [], []
+        for column, value in [('f.name', name), ('f.target', target),
+                              ('f.config', config)]:
+            if value is not None:
+                where.append(f'{column} = ?')
+                args.append(value)
+        if start is not None:
+            where.append('f.date_obs >= ?')
+            args.append(start)
+        if end is not None:
+            where.append('f.date_obs <= ?')
+            args.append(end)
+        return where, args
+
+    def query(self, name=None, target=None, config=None, start=None,
+              end=None):
+        """
+        Index of the saved fits (file, name, date_obs, mjd, target,
+        config), selected by result name, target, configuration hash
+        and DATE-OBS range (start, end as ISO strings)
+        """
+        where, args = self._where(name, target, config, start, end)
+        sql = ('SELECT f.file, f.name, f.date_obs, f.mjd, f.target, '
+               'f.config, f.saved FROM fits f')
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        with self._connect() as conn:
+            index = pd.read_sql_query(sql + ' ORDER BY f.date_obs', conn,
+                                      params=args)
+        return index
+
+    def timeseries(self, params, kind='M.P.', name=None, target=None,
+                   config=None, start=None, end=None):
+        """
+        Time series of fit parameters, e.g. ['dRA1', 'dDEC1', 'fr2'],
+        one row per file, polarisation and DIT. The values are from the
+        fittab rows kind (M.P. or M.L.), the errors (param_m, param_p)
+        from the sigma rows. Only these values are read.
+        Selection as for query
+        """
+        if isinstance(params, str):
+            params = [params]
+        kinds = [kind, '$-\\sigma$', '$+\\sigma$']
+        where, args = self._where(name, target, config, start, end)
+        where = (['r.param IN (%s)' % ', '.join('?'*len(params)),
+                  'r.kind IN (?, ?, ?)'] + where)
+        sql = ('SELECT f.file, f.name, f.date_obs, f.mjd, f.target, r.pol, '
+               'r.dit, r.kind, r.param, r.value FROM results r '
+               'JOIN fits f ON r.fit = f.id WHERE ' + ' AND '.join(where))
+        with self._connect() as conn:
+            values = pd.read_sql_query(sql, conn,
+                                       params=list(params) + kinds + args)
+        index = ['file', 'name', 'date_obs', 'mjd', 'target', 'pol', 'dit']
+        series = values.set_index(index + ['param', 'kind'])['value']
+        series = series.unstack(['param', 'kind'])
+        result = pd.DataFrame(index=series.index)
+        for param in params:
+            for suffix, _kind in zip(['', '_m', '_p'], kinds):
+                if (param, _kind) in series:
+                    result[param + suffix] = series[(param, _kind)]
+                else:
+                    result[param + suffix] = np.nan
+        return result.reset_index().sort_values(['date_obs', 'pol', 'dit'],
+                                                ignore_index=True)
+
+
+# phase screens, smoothing & output files of a phasemap worker
+_phasemap_worker = {}
+
+
+def _init_phasemap_worker(screen_args, kernel, files):
+    """
+    Sets up a worker of GravPhaseMaps._compute_phasemaps once
+    files: partial files of the store for the output
+    """
+    _phasemap_worker['screens'] = _PhaseScreens(**screen_args)
+    _phasemap_worker['smoother'] = _FFTSmoother(kernel, (201, 201))
+    _phasemap_worker['out'] = {name: np.load(path, mmap_mode='r+')
+                               for name, path in files.items()}
+
+
+def _phasemap_slab(wdx, wl):
+    """
+    Computes the maps of all telescopes at one wavelength and writes
+    them to the output files, returns wdx
+    """
+    pm = _phasemap_worker['screens'](wl)
+    if pm.shape[1:] != (201, 201):
+        logging.getLogger(__name__).warning('Need to convert %s to (201,201) '
+                                            'shape' % (pm.shape,))
+        pm = np.array([procrustes(p, (201, 201), padval=0) for p in pm])
+    # maps and intensities of all telescopes in one batch
+    pm_sm = _phasemap_worker['smoother'](np.concatenate((pm, np.abs(pm)**2)))
+    out = _phasemap_worker['out']
+    if 'pm' in out:
+        slab = {'pm': pm_sm[:4], 'denom': pm_sm[4:].real}
+    else:
+        slab = _normalise_phasemaps(pm_sm[np.newaxis, :4],
+                                    pm_sm[np.newaxis, 4:])
+        slab = {name: value[0] for name, value in slab.items()}
+    for name, array in out.items():
+        array[wdx] = slab[name]
+        array.flush()
+    return wdx
+
+
 class GravPhaseMaps():
     def __init__(self, loglevel='INFO'):
         """
@@ -113,15 +851,23 @@ class GravPhaseMaps():
         GravMFit
 
         Main functions:
-        create_phasemaps : create the phasemaps and saves them in package
-                          (too big to be included by default)
+        create_phasemaps : create the phasemaps and saves them in the
+                           PhasemapStore (too big to be included by default,
+                           load_phasemaps creates missing maps)
+        create_reference_phasemaps : create phasemaps on a reference
+                           wavelength grid, resampled to the wavelengths
+                           of each file by load_phasemaps
         plot_phasemaps : plto the created phasemaps
-        load_phasemaps : load the phasemaps from package
+        load_phasemaps : load the phasemaps from the store (or the package)
+
+        The store directory is taken from the attribute phasemap_dir,
+        see PhasemapStore for the default
         read_phasemaps : read correction from loaded phasemaps
         """
         log_level = log_level_mapping.get(loglevel, logging.INFO)
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(log_level)
+        self.phasemap_dir = None
         try:
             self.get_int_data()
         except AttributeError:
@@ -137,180 +883,110 @@ class GravPhaseMaps():
             self.logger.warning('No data loaded, assume UT LOW res data')
 
     def create_phasemaps(self, nthreads=1, smooth=15, plot=True, 
-                         datayear=2019):
+                         datayear=2019, phasemap_dir=None,
+                         backend='thread'):
+        """
+        Creates the phasemaps for the current setup and saves them in
+        the PhasemapStore
+
+        The maps are computed one wavelength at a time and written
+        directly into files of the store, an interrupted run continues
+        with the missing wavelengths when called again
+
+        nthreads: number of parallel workers [1]
+        smooth:   sigma of the gaussian smoothing kernel in pixels [15]
+        plot:     plot the maps of the central channel [True]
+        datayear: 2019 or 2020 zernike coefficients [2019]
+        phasemap_dir: directory of the store [None, self.phasemap_dir or
+                      the PhasemapStore default]
+        backend:  'thread' or 'process' workers ['thread']
+        """
+        wave = self.wlSC
+        if phasemap_dir is None:
+            phasemap_dir = getattr(self, 'phasemap_dir', None)
+        store = PhasemapStore(phasemap_dir,
+                              loglevel=getattr(self, 'loglevel', 'INFO'))
+        key = store.key(self.tel, self.resolution, smooth, datayear, wave)
+        shape = (len(wave), 4, 201, 201)
+        paths = self._compute_phasemaps(wave, store, key,
+                                        {'amp': (shape, np.float32),
+                                         'pha': (shape, np.float32),
+                                         'denom': (shape, np.float32)},
+                                        nthreads=nthreads, smooth=smooth,
+                                        datayear=datayear, backend=backend)
+        store.commit(key, paths, tel=self.tel, resolution=self.resolution,
+                     smoothkernel=smooth, datayear=datayear,
+                     wave=[float(wl) for wl in wave])
+        self.logger.info('Saved phasemaps as %s in %s'
+                         % (key, store.cache_dir))
+        if plot:
+            maps = store.load(key, mmap_mode='r')
+            mid = len(wave)//2
+            self.plot_phasemaps(maps['amp'][mid]
+                                * np.exp(1j*np.radians(maps['pha'][mid])))
+
+    def create_reference_phasemaps(self, nthreads=1, smooth=15,
+                                   datayear=2019, wave_range=(1.95, 2.55),
+                                   dwave=0.01, phasemap_dir=None,
+                                   backend='thread'):
+        """
+        Creates the phasemaps on a reference wavelength grid, which covers
+        all resolutions, and saves them in the PhasemapStore. load_phasemaps
+        resamples them to the wavelengths of a file (and caches the result)
+        if no maps exist for that grid.
+        The resampled maps agree with create_phasemaps to ~1e-2 (amplitude,
+        normalised), which is the size of the jumps of the maps between
+        neighbouring wavelengths from the pixel sampling of the pupil
+
+        wave_range: range of the reference grid [1.95, 2.55 micron]
+        dwave:      spacing of the reference grid [0.01 micron]
+        see create_phasemaps for the other arguments
+        """
+        ref_wave = np.round(np.arange(wave_range[0], wave_range[1] + dwave/2,
+                                      dwave), 6)
+        if phasemap_dir is None:
+            phasemap_dir = getattr(self, 'phasemap_dir', None)
+        store = PhasemapStore(phasemap_dir,
+                              loglevel=getattr(self, 'loglevel', 'INFO'))
+        key = store.reference_key(self.tel, smooth, datayear)
+        shape = (len(ref_wave), 4, 201, 201)
+        paths = self._compute_phasemaps(ref_wave, store, key,
+                                        {'pm': (shape, np.complex64),
+                                         'denom': (shape, np.float32)},
+                                        nthreads=nthreads, smooth=smooth,
+                                        datayear=datayear, backend=backend)
+        store.commit(key, paths, {'wave': ref_wave}, tel=self.tel,
+                     smoothkernel=smooth, datayear=datayear,
+                     wave_range=[float(ref_wave[0]), float(ref_wave[-1])],
+                     dwave=dwave)
+        self.logger.info('Saved reference phasemaps as %s in %s'
+                         % (key, store.cache_dir))
+
+    def _compute_phasemaps(self, wave, store, key, arrays, nthreads=1,
+                           smooth=15, datayear=2019, backend='thread'):
+        """
+        Computes the maps at the wavelengths wave into the partial files
+        of the store (see PhasemapStore.allocate), one wavelength with
+        all telescopes per task. Wavelengths which are done from an
+        interrupted run are skipped.
+        arrays: {'amp', 'pha', 'denom'} for the normalised maps or
+                {'pm', 'denom'} for the complex (reference) maps
+        returns the partial files
+        """
         if datayear == 2019:
             zerfile = 'phasemap_zernike_20200918_diff_2019data.npy'
         elif datayear == 2020:
             zerfile = 'phasemap_zernike_20200922_diff_2020data.npy'
         else:
             raise ValueError('Datayear has to be 2019 or 2020')
+        if backend not in ['thread', 'process']:
+            self.logger.error('backend has to be thread or process')
+            raise ValueError('backend has to be thread or process')
         self.logger.info('Used file: %s' % zerfile)
 
-        def phase_screen(A00, A1m1, A1p1, A2m2, A2p2, A20, A3m1, A3p1, A3m3,
-                         A3p3, A4m2, A4p2, A4m4, A4p4, A40,  A5m1, A5p1, A5m3,
-                         A5p3, A5m5, A5p5, A6m6, A6p6, A6m4, A6p4, A6m2, A6p2,
-                         A60, B1m1, B1p1, B20, B2m2, B2p2,
-                         lam0=2.2, MFR=0.6308, stopB=8.0, stopS=0.96,
-                         d1=8.0, dalpha=1., totN=1024, amax=100):
-            """
-            Simulate phase screens taking into account static aberrations.
-
-            Parameters:
-            -----------
-            * Static aberrations in the pupil plane are described by 
-            * low-order Zernicke polynomials
-            * Their amplitudes are in units of micro-meter
-
-            00: A00  (float) : piston
-            01: A1m1 (float) : vertical tilt
-            02: A1p1 (float) : horizontal tilt
-            03: A2m2 (float) : vertical astigmatism
-            04: A2p2 (float) : horizontal astigmatism
-            05: A20  (float) : defocuss
-            06: A3m1 (float) : vertical coma
-            07: A3p1 (float) : horizontal coma
-            08: A3m3 (float) : vertical trefoil
-            09: A3p3 (float) : oblique trefoil
-            10: A4m2 (float) : oblique secondary astigmatism
-            11: A4p2 (float) : vertical secondary astigmatism
-            12: A4m4 (float) : oblique quadrafoil
-            13: A4p4 (float) : vertical quadrafoil
-            14: A40  (float) : primary spherical
-            15: A5m1
-            16: A5p1
-            17: A5m3
-            18: A5p3
-            19: A5m5
-            20: A5p5
-            21: A6m6
-            22: A6p6
-            23: A6m4
-            24: A6p4
-            25: A6m2
-            26: A6p2
-            27: A60
-
-            * Static aberrations in the focal plane
-            B1m1 (float) : missplacement of the fiber mode in u1-direction in
-                           meters / Zernike coefficient if 
-                           coefficients > B20 != 0
-            B1p1 (float) : missplacement of the fiber mode in u2-direction in
-                           meters / Zernike coefficient if 
-                           coefficients > B20 != 0
-            B20  (float) : defocuss
-            B2m2 (float) : vertical astigmatism
-            B2p2 (float) : horizontal astigmatism
-
-            * optical system
-            MFR (float)   : sigma of fiber mode profile in units of dish radius
-            stopB (float) : outer stop diameter in meters
-            stopS (float) : inner stop diameter in meters
-
-            * further parameters specify the output grid
-            dalpha (float) : pixel width in the imaging plane in mas
-            totN   (float) : total number of pixels in the pupil plane
-            lam0   (float) : wavelength at which the phase screen is computed in
-                             micro-meter
-            d1     (float) : telescope to normalize Zernike RMS in m 
-                             (UT=8.0, AT=1.82)
-            amax   (float) : maximum off-axis distance in the maps returned
-            """
-
-            # --- coordinate scaling --- #
-            lam0 = lam0*1e-6
-            mas = 1.e-3 * (2.*np.pi/360) * 1./3600
-            ext = totN*d1/lam0*mas*dalpha*dalpha
-            du = dalpha/ext*d1/lam0
-
-            # --- coordinates --- #
-            ii = np.arange(totN) - (totN/2)
-            ii = np.fft.fftshift(ii)
-
-            # image plane
-            a1, a2 = np.meshgrid(ii*dalpha, ii*dalpha)
-            aa = np.sqrt(a1*a1 + a2*a2)
-
-            # pupil plane
-            u1, u2 = np.meshgrid(ii*du*lam0, ii*du*lam0)
-            r = np.sqrt( u1*u1 + u2*u2 )
-            t = np.angle(u1 + 1j*u2)
-
-            # --- cut our central part --- #
-            hmapN = int(amax/dalpha)
-            cc = slice(int(totN/2)-hmapN, int(totN/2)+hmapN+1)
-            if 2*hmapN > totN:
-                self.logger.error('Requested map sizes too large')
-                return False
-
-            # --- pupil function --- #
-            pupil = r < (stopB / 2.)
-            if stopS > 0.:
-                pupil = np.logical_and(r < (stopB/2.), r > (stopS/2.))
-
-            # --- fiber profile --- #
-            fiber = np.exp(-0.5*(r/(MFR*d1/2.))**2)
-            if B1m1 != 0 or B1p1 != 0:
-                fiber = np.exp(-0.5*((u1-B1m1)**2 +
-                                     (u2-B1p1)**2)/(MFR*d1/2.)**2)
-
-            # for higher-order focal plane aberrations we need to compute the 
-            # fourier transform explicitly
-            if np.any([B20, B2m2, B2p2] != 0):
-                sigma_fib = lam0/d1/np.pi/MFR/mas
-                sigma_ref = 2.2e-6/d1/np.pi/MFR/mas
-                zernike = 0
-                zernike += B1m1*2*(aa/sigma_ref)*np.sin(t)
-                zernike += B1p1*2*(aa/sigma_ref)*np.cos(t)
-                zernike += B20*np.sqrt(3.)*(2.*(aa/sigma_ref)**2 - 1)
-                zernike += B2m2*np.sqrt(6.)*(aa/sigma_ref)**2*np.sin(2.*t)
-                zernike += B2p2*np.sqrt(6.)*(aa/sigma_ref)**2*np.cos(2.*t)
-
-                fiber = (np.exp(-0.5*(aa/sigma_fib)**2)
-                         * np.exp(2.*np.pi/lam0*1j*zernike*1e-6))
-                fiber = np.fft.fft2(fiber)
-
-            # --- phase screens (pupil plane) --- #
-            zernike = A00
-            zernike += A1m1*2*(2.*r/d1)*np.sin(t)
-            zernike += A1p1*2*(2.*r/d1)*np.cos(t)
-            zernike += A2m2*np.sqrt(6.)*(2.*r/d1)**2*np.sin(2.*t)
-            zernike += A2p2*np.sqrt(6.)*(2.*r/d1)**2*np.cos(2.*t)
-            zernike += A20*np.sqrt(3.)*(2.*(2.*r/d1)**2 - 1)
-            zernike += A3m1*np.sqrt(8.)*(3.*(2.*r/d1)**3 - 2.*(2.*r/d1))*np.sin(t)
-            zernike += A3p1*np.sqrt(8.)*(3.*(2.*r/d1)**3 - 2.*(2.*r/d1))*np.cos(t)
-            zernike += A3m3*np.sqrt(8.)*(2.*r/d1)**3*np.sin(3.*t)
-            zernike += A3p3*np.sqrt(8.)*(2.*r/d1)**3*np.cos(3.*t)
-            zernike += A4m2*np.sqrt(10.)*(2.*r/d1)**4*np.sin(4.*t)
-            zernike += A4p2*np.sqrt(10.)*(2.*r/d1)**4*np.cos(4.*t)
-            zernike += A4m4*np.sqrt(10.)*(4.*(2.*r/d1)**4 -3.*(2.*r/d1)**2)*np.sin(2.*t)
-            zernike += A4p4*np.sqrt(10.)*(4.*(2.*r/d1)**4 -3.*(2.*r/d1)**2)*np.cos(2.*t)
-            zernike += A40*np.sqrt(5.)*(6.*(2.*r/d1)**4 - 6.*(2.*r/d1)**2 + 1)
-            zernike += A5m1*2.*np.sqrt(3.)*(10*(2.*r/d1)**5 - 12*(2.*r/d1)**3 + 3.*2.*r/d1)*np.sin(t)
-            zernike += A5p1*2.*np.sqrt(3.)*(10*(2.*r/d1)**5 - 12*(2.*r/d1)**3 + 3.*2.*r/d1)*np.cos(t)
-            zernike += A5m3*2.*np.sqrt(3.)*(5.*(2.*r/d1)**5 - 4.*(2.*r/d1)**3)*np.sin(3.*t)
-            zernike += A5p3*2.*np.sqrt(3.)*(5.*(2.*r/d1)**5 - 4.*(2.*r/d1)**3)*np.cos(3.*t)
-            zernike += A5m5*2.*np.sqrt(3.)*(2.*r/d1)**5*np.sin(5*t)
-            zernike += A5p5*2.*np.sqrt(3.)*(2.*r/d1)**5*np.cos(5*t)
-            zernike += A6m6*np.sqrt(14.)*(2.*r/d1)**6*np.sin(6.*t)
-            zernike += A6p6*np.sqrt(14.)*(2.*r/d1)**6*np.cos(6.*t)
-            zernike += A6m4*np.sqrt(14.)*(6.*(2.*r/d1)**6 - 5.*(2.*r/d1)**4)*np.sin(4.*t)
-            zernike += A6p4*np.sqrt(14.)*(6.*(2.*r/d1)**6 - 5.*(2.*r/d1)**4)*np.cos(4.*t)
-            zernike += A6m2*np.sqrt(14.)*(15.*(2.*r/d1)**6 - 20.*(2.*r/d1)**4 - 6.*(2.*r/d1)**2)*np.sin(2.*t)
-            zernike += A6p2*np.sqrt(14.)*(15.*(2.*r/d1)**6 - 20.*(2.*r/d1)**4 - 6.*(2.*r/d1)**2)*np.cos(2.*t)
-            zernike += A60*np.sqrt(7.)*(20.*(2.*r/d1)**6 - 30.*(2.*r/d1)**4 +12*(2.*r/d1)**2 - 1)
-
-            phase = 2.*np.pi/lam0*zernike*1.e-6
-
-            # --- transform to image plane --- #
-            complexPsf = np.fft.fftshift(np.fft.fft2(pupil * fiber
-                                                     * np.exp(1j*phase)))
-            return complexPsf[cc, cc]/np.abs(complexPsf[cc, cc]).max()
-
         zernikefile = resource_filename(__name__, 'Phasemaps/' + zerfile)
         zer = np.load(zernikefile, allow_pickle=True).item()
 
-        wave = self.wlSC
-
         if self.tel == 'UT':
             stopB = 8.0
             stopS = 0.96
@@ -329,6 +1005,10 @@ class GravPhaseMaps():
             amax = 100*4.4
             set_smooth = smooth  # / 4.4
 
+        if 2*int(amax/dalpha) > totN:
+            self.logger.error('Requested map sizes too large')
+            raise ValueError('Requested map sizes too large')
+
         kernel = Gaussian2DKernel(x_stddev=smooth)
 
         self.logger.info('Creating phasemaps')
@@ -337,73 +1017,52 @@ class GravPhaseMaps():
         self.logger.debug('Smooth: %.2f' % set_smooth)
         self.logger.debug('amax: %i' % amax)
 
+        paths = store.allocate(key, arrays, tag='_' + store.wave_hash(wave))
+        done = np.load(paths['done'], mmap_mode='r+')
+        todo = np.where(~done)[0]
+        if len(todo) < len(wave):
+            self.logger.info('Resume, %i of %i wavelengths done'
+                             % (len(wave) - len(todo), len(wave)))
+
+        screen_args = dict(coefficients=[zer['GV%i' % (GV+1)]
+                                         for GV in range(4)],
+                           lam_min=np.min(wave), d1=d, stopB=stopB,
+                           stopS=stopS, dalpha=dalpha, totN=totN, amax=amax)
+        init_args = (screen_args, kernel.array,
+                     {name: paths[name] for name in arrays})
+        start = time.time()
         if nthreads == 1:
-            all_pm = np.zeros((len(wave), 4, 201, 201),
-                              dtype=np.complex_)
-            all_pm_denom = np.zeros((len(wave), 4, 201, 201),
-                                    dtype=np.complex_)
-            for wdx, wl in enumerate(wave):
-                print_status(wdx, len(wave))
-                for GV in range(4):
-                    zer_GV = zer['GV%i' % (GV+1)]
-                    pm = phase_screen(*zer_GV, lam0=wl, d1=d, stopB=stopB,
-                                      stopS=stopS, dalpha=dalpha, totN=totN,
-                                      amax=amax)
-                    if pm.shape != (201, 201):
-                        self.logger.warning(pm.shape)
-                        self.logger.warning('Need to convert to (201,201) shape')
-                        pm = procrustes(pm, (201, 201), padval=0)
-                    pm_sm = signal.convolve2d(pm, kernel, mode='same')
-                    pm_sm_denom = signal.convolve2d(np.abs(pm)**2, 
-                                                    kernel, mode='same')
-
-                    all_pm[wdx, GV] = pm_sm
-                    all_pm_denom[wdx, GV] = pm_sm_denom
-
+            _init_phasemap_worker(*init_args)
+            results = (_phasemap_slab(wdx, wave[wdx]) for wdx in todo)
+        elif backend == 'thread':
+            # the threads share the set up of this process
+            _init_phasemap_worker(*init_args)
+            executor = concurrent.futures.ThreadPoolExecutor(nthreads)
         else:
-            def multi_pm(lam):
-                m_all_pm = np.zeros((4, 201, 201), dtype=np.complex_)
-                m_all_pm_denom = np.zeros((4, 201, 201), dtype=np.complex_)
-                for GV in range(4):
-                    zer_GV = zer['GV%i' % (GV+1)]
-                    pm = phase_screen(*zer_GV, lam0=lam, d1=d, stopB=stopB,
-                                      stopS=stopS, dalpha=dalpha, totN=totN,
-                                      amax=amax)
-
-                    if pm.shape != (201, 201):
-                        self.logger.warning(pm.shape)
-                        self.logger.warning('Need to convert to (201,201) shape')
-                        pm = procrustes(pm, (201,201), padval=0)
-
-                    pm_sm = signal.convolve2d(pm, kernel, mode='same')
-                    pm_sm_denom = signal.convolve2d(np.abs(pm)**2, 
-                                                    kernel, mode='same')
-                    m_all_pm[GV] = pm_sm
-                    m_all_pm_denom[GV] = pm_sm_denom
-                return np.array([m_all_pm, m_all_pm_denom])
-
-            res = np.array(Parallel(n_jobs=nthreads)(delayed(multi_pm)(lam) for lam in wave))
-
-            all_pm = res[:, 0, :, :, :]
-            all_pm_denom = res[:, 1, :, :, :]
-        if datayear == 2019:
-            savename = ('Phasemaps/Phasemap_%s_%s_Smooth%i.npy'
-                        % (self.tel, self.resolution, smooth))
-            savename2 = ('Phasemaps/Phasemap_%s_%s_Smooth%i_denom.npy'
-                         % (self.tel, self.resolution, smooth))
-        else:
-            savename = ('Phasemaps/Phasemap_%s_%s_Smooth%i_2020data.npy'
-                        % (self.tel, self.resolution, smooth))
-            savename2 = ('Phasemaps/Phasemap_%s_%s_Smooth%i_2020data_denom.npy'
-                         % (self.tel, self.resolution, smooth))
-
-        savefile = resource_filename(__name__, savename)
-        np.save(savefile, all_pm)
-        savefile = resource_filename(__name__, savename2)
-        np.save(savefile, all_pm_denom)
-        self.all_pm = all_pm
-        if plot:
-            self.plot_phasemaps(all_pm[len(all_pm)//2])
+            executor = concurrent.futures.ProcessPoolExecutor(
+                nthreads, initializer=_init_phasemap_worker,
+                initargs=init_args)
+        if nthreads != 1:
+            futures = [executor.submit(_phasemap_slab, wdx, wave[wdx])
+                       for wdx in todo]
+            results = (future.result() for future in
+                       concurrent.futures.as_completed(futures))
+        try:
+            for ndx, wdx in enumerate(results):
+                # flags only after the maps are on disk
+                done[wdx] = True
+                done.flush()
+                print_status(ndx, len(todo))
+        finally:
+            if nthreads != 1:
+                executor.shutdown(cancel_futures=True)
+            _phasemap_worker.clear()
+        duration = time.time() - start
+        if len(todo):
+            self.logger.info('Computed %i maps in %.1f s (%.2f maps/s)'
+                             % (4*len(todo), duration,
+                                4*len(todo)/duration))
+        return paths
 
     def plot_phasemaps(self, aberration_maps):
         """
@@ -491,28 +1150,75 @@ class GravPhaseMaps():
             self.logger.error('Datayear has to be 2019 or 2020')
             raise ValueError('Datayear has to be 2019 or 2020')
 
-        try:
-            pm1 = np.load(resource_filename(__name__, pm1_file))
-            pm2 = np.real(np.load(resource_filename(__name__, pm2_file)))
-        except FileNotFoundError:
-            raise ValueError('%s does not exist, you have to create '
-                             'the phasemap first!\nFor this '
-                             'run: GravMFit.create_phasemaps()' % pm1_file)
-
         wave = self.wlSC
-        if pm1.shape[0] != len(wave):
-            self.logger.error(pm1_file)
-            self.logger.error(pm1.shape[0], len(wave))
-            raise ValueError('Phasemap and data have different num of channels')
-
-        amp_map = np.abs(pm1)
-        pha_map = np.angle(pm1, deg=True)
-        amp_map_denom = pm2
-
-        for wdx in range(len(wave)):
-            for tel in range(4):
-                amp_map[wdx, tel] /= np.max(amp_map[wdx, tel])
-                amp_map_denom[wdx, tel] /= np.max(amp_map_denom[wdx, tel])
+        store = PhasemapStore(getattr(self, 'phasemap_dir', None),
+                              loglevel=getattr(self, 'loglevel', 'INFO'))
+        key = store.key(self.tel, self.resolution, smoothkernel, datayear,
+                        wave)
+        manifest = store.manifest(key)
+        if (store.ready(key)
+                and sorted(manifest['arrays']) == ['amp', 'denom', 'pha']):
+            self.logger.debug('Load phasemaps %s from %s'
+                              % (key, store.cache_dir))
+            # read only & memory-mapped, several processes share the
+            # page cache and only the used parts are read from disk
+            maps = store.load(key, mmap_mode='r')
+        else:
+            # complex maps of older versions (in the store or the package)
+            # are normalised once and added to the store
+            pm1 = None
+            if store.ready(key):
+                maps = store.load(key)
+                pm1, pm2 = maps['pm'], maps['pm_denom']
+            else:
+                try:
+                    pm1 = np.load(resource_filename(__name__, pm1_file))
+                    pm2 = np.load(resource_filename(__name__, pm2_file))
+                except FileNotFoundError:
+                    pass
+            # otherwise resampled from the reference maps
+            ref_key = store.reference_key(self.tel, smoothkernel, datayear)
+            if ((pm1 is None or pm1.shape[0] != len(wave))
+                    and store.ready(ref_key)):
+                self.logger.info('Resample phasemaps from %s' % ref_key)
+                ref = store.load(ref_key, mmap_mode='r')
+                try:
+                    pm1, pm2 = _resample_phasemaps(ref['wave'], ref['pm'],
+                                                   ref['denom'], wave)
+                except ValueError as e:
+                    self.logger.error(str(e))
+                    raise
+            if pm1 is None:
+                # nothing to convert or resample, the maps are created
+                # for the wavelengths of the file (~1 s per channel)
+                self.logger.info('%s not in %s, create the phasemaps'
+                                 % (key, store.cache_dir))
+                self.create_phasemaps(smooth=smoothkernel, plot=False,
+                                      datayear=datayear,
+                                      phasemap_dir=store.cache_dir)
+                maps = store.load(key, mmap_mode='r')
+            else:
+                if pm1.shape[0] != len(wave):
+                    self.logger.error(pm1_file)
+                    self.logger.error('%i channels in phasemap, %i in data'
+                                      % (pm1.shape[0], len(wave)))
+                    raise ValueError('Phasemap and data have different num '
+                                     'of channels')
+                maps = _normalise_phasemaps(pm1, pm2)
+                try:
+                    store.save(key, maps, tel=self.tel,
+                               resolution=self.resolution,
+                               smoothkernel=smoothkernel, datayear=datayear,
+                               wave=[float(wl) for wl in wave])
+                    self.logger.info('Converted phasemaps to %s in %s'
+                                     % (key, store.cache_dir))
+                    maps = store.load(key, mmap_mode='r')
+                except OSError as e:
+                    self.logger.warning('Could not save phasemaps in %s: %s'
+                                        % (store.cache_dir, e))
+        amp_map = maps['amp']
+        pha_map = maps['pha']
+        amp_map_denom = maps['denom']
 
         if tofits:
             primary_hdu = fits.PrimaryHDU()
@@ -531,15 +1237,8 @@ class GravPhaseMaps():
                   % resource_filename(__name__, 'testfits.fits'))
 
         if interp:
-            x = np.arange(201)
-            y = np.arange(201)
-            itel = np.arange(4)
-            iwave = np.arange(len(wave))
-            points = (iwave, itel, x, y)
-
-            self.amp_map_int = interpolate.RegularGridInterpolator(points, amp_map)
-            self.pha_map_int = interpolate.RegularGridInterpolator(points, pha_map)
-            self.amp_map_denom_int = interpolate.RegularGridInterpolator(points, amp_map_denom)
+            self.phasemap_sampler = PhasemapSampler(amp_map, pha_map,
+                                                    amp_map_denom)
 
         else:
             self.amp_map = amp_map
@@ -584,29 +1283,23 @@ class GravPhaseMaps():
             dra = [dra1, dra2, dra3, dra4]
 
         wave = self.wlSC
-
-        pm_pos = np.zeros((4, 2))
-        readout_pos = np.zeros((4*len(wave),4))
-        readout_pos[:, 0] = np.tile(np.arange(len(wave)), 4)
-        readout_pos[:, 1] = np.repeat(np.arange(4), len(wave))
-
-        for tel in range(4):
-            pos = np.array([ra + dra[tel], dec + ddec[tel]])
-            if self.tel == 'AT':
-                pos /= 4.4
-            pos_rot = np.dot(self.rotation(northangle[tel]), pos) + 100
-            readout_pos[readout_pos[:, 1] == tel, 2] = pos_rot[1]
-            readout_pos[readout_pos[:, 1] == tel, 3] = pos_rot[0]
-            pm_pos[tel] = pos_rot
-
-        cor_amp = self.amp_map_int(readout_pos).reshape(4, len(wave))
-        cor_pha = self.pha_map_int(readout_pos).reshape(4, len(wave))
-        cor_int_denom = self.amp_map_denom_int(readout_pos).reshape(4, len(wave))
+        if self.tel == 'AT':
+            scale = 4.4
+        else:
+            scale = 1
+        x, y = self.phasemap_sampler.positions(ra, dec, northangle,
+                                               dra, ddec, scale)
 
         if givepos:
+            readout_pos = np.zeros((4*len(wave), 4))
+            readout_pos[:, 0] = np.tile(np.arange(len(wave)), 4)
+            readout_pos[:, 1] = np.repeat(np.arange(4), len(wave))
+            readout_pos[:, 2] = np.repeat(x[0], len(wave))
+            readout_pos[:, 3] = np.repeat(y[0], len(wave))
             return readout_pos
-        else:
-            return cor_amp, cor_pha, cor_int_denom
+
+        cor_amp, cor_pha, cor_int_denom = self.phasemap_sampler.sample(x, y)[0]
+        return cor_amp, cor_pha, cor_int_denom
 
     def phasemap_source(self, x, y, northA, dra, ddec):
         amp, pha, inten = self.read_phasemaps(x, y, fromFits=False,
@@ -642,8 +1335,235 @@ def _rotation(ang):
                      [-np.sin(ang), np.cos(ang)]])
 
 
-def _read_phasemaps(ra, dec, northangle, amp_map_int,
-                    pha_map_int, amp_map_denom_int, wave,
+@njit(cache=True)
+def _sample_phasemaps(amp_map, pha_map, denom_map, x, y, chan, out):
+    """
+    Bilinear interpolation of the phasemaps on the two spatial axes
+    maps: (nwave, 4, nx, ny)
+    x, y: (npos, 4) map coordinates of each position and telescope
+    chan: indices of the sampled channels
+    out:  (npos, [amp, pha, int], 4, len(chan))
+    """
+    nx = amp_map.shape[2]
+    ny = amp_map.shape[3]
+    for pdx in range(x.shape[0]):
+        for tel in range(4):
+            ix = min(max(int(np.floor(x[pdx, tel])), 0), nx-2)
+            iy = min(max(int(np.floor(y[pdx, tel])), 0), ny-2)
+            fx = x[pdx, tel] - ix
+            fy = y[pdx, tel] - iy
+            w00 = (1-fx)*(1-fy)
+            w01 = (1-fx)*fy
+            w10 = fx*(1-fy)
+            w11 = fx*fy
+            for cdx in range(chan.shape[0]):
+                wdx = chan[cdx]
+                out[pdx, 0, tel, cdx] = (
+                    w00*amp_map[wdx, tel, ix, iy]
+                    + w01*amp_map[wdx, tel, ix, iy+1]
+                    + w10*amp_map[wdx, tel, ix+1, iy]
+                    + w11*amp_map[wdx, tel, ix+1, iy+1])
+                out[pdx, 1, tel, cdx] = (
+                    w00*pha_map[wdx, tel, ix, iy]
+                    + w01*pha_map[wdx, tel, ix, iy+1]
+                    + w10*pha_map[wdx, tel, ix+1, iy]
+                    + w11*pha_map[wdx, tel, ix+1, iy+1])
+                out[pdx, 2, tel, cdx] = (
+                    w00*denom_map[wdx, tel, ix, iy]
+                    + w01*denom_map[wdx, tel, ix, iy+1]
+                    + w10*denom_map[wdx, tel, ix+1, iy]
+                    + w11*denom_map[wdx, tel, ix+1, iy+1])
+
+
+class PhasemapSampler():
+    def __init__(self, amp_map, pha_map, amp_map_denom, center=None):
+        """
+        PhasemapSampler: Fast readout of the phasemaps
+
+        Channels and telescopes are always read on their exact index,
+        only the two spatial axes are interpolated (bilinear, compiled).
+        Amplitude, phase and intensity of many positions are read in
+        one pass, which makes fit_phasemaps affordable in the likelihood
+        maps:   (nwave, 4, 201, 201), e.g. the memory-mapped maps of
+                load_phasemaps (they are not copied)
+        center: (2, 4) map coordinates of the field center for each
+                telescope [100, cropped maps see crop]
+        """
+        self.maps = [np.asarray(m) for m in (amp_map, pha_map, amp_map_denom)]
+        self.nwave = self.maps[0].shape[0]
+        self.shape = self.maps[0].shape[2:]
+        if center is None:
+            center = np.full((2, 4), 100.)
+        self.center = np.array(center, dtype=float)
+        # telescopes of the baselines
+        self.tel1 = np.array([0, 0, 0, 1, 1, 2])
+        self.tel2 = np.array([1, 2, 3, 2, 3, 3])
+        # handles for the pool workers, see __getstate__
+        self._handles = None
+        self._shared = []
+
+    def share(self):
+        """
+        Publishes the maps for other processes: memory-mapped maps by
+        their file, all others are copied once into shared memory.
+        Called automatically when the sampler is pickled, the shared
+        memory is released with the sampler (or by release)
+        """
+        if self._handles is not None:
+            return self._handles
+        handles = []
+        for m in self.maps:
+            handle = _memmap_handle(m)
+            if handle is None:
+                shm = shared_memory.SharedMemory(create=True,
+                                                 size=max(m.nbytes, 1))
+                np.ndarray(m.shape, m.dtype, buffer=shm.buf)[...] = m
+                self._shared.append(shm)
+                handle = ('shm', shm.name, m.shape, m.dtype.str)
+            handles.append(handle)
+        if self._shared:
+            self._finalizer = weakref.finalize(self, _release_shared,
+                                               list(self._shared))
+        self._handles = handles
+        return handles
+
+    def release(self):
+        """
+        Frees the shared memory of share, workers attached to it have
+        to be finished before
+        """
+        if self._shared:
+            self._finalizer()
+            self._shared = []
+        self._handles = None
+
+    def __getstate__(self):
+        # only the handles are pickled, not the maps
+        state = self.__dict__.copy()
+        state['_handles'] = self.share()
+        state['maps'] = None
+        state['_shared'] = []
+        state.pop('_finalizer', None)
+        state.pop('_attached', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.maps = []
+        # attached blocks are kept open, but never freed by this copy
+        self._attached = []
+        for handle in self._handles:
+            if handle in _pool_maps:
+                # attached by the SamplerPool worker already
+                self.maps.append(_pool_maps[handle])
+            elif handle[0] == 'file':
+                _, filename, offset, shape, dtype = handle
+                self.maps.append(np.memmap(filename, dtype=dtype, mode='r',
+                                           offset=offset, shape=shape))
+            else:
+                _, name, shape, dtype = handle
+                shm = shared_memory.SharedMemory(name=name)
+                self._attached.append(shm)
+                self.maps.append(np.ndarray(shape, dtype, buffer=shm.buf))
+
+    def sample(self, x, y, chan=None):
+        """
+        Interpolated maps at the map coordinates x, y (npos, 4),
+        returns (npos, [amp, pha, int], 4, nchan)
+        """
+        x = np.ascontiguousarray(x, dtype=float)
+        y = np.ascontiguousarray(y, dtype=float)
+        if chan is None:
+            chan = np.arange(self.nwave)
+        chan = np.asarray(chan, dtype=np.int64)
+        if (np.any(x < 0) or np.any(x > self.shape[0]-1)
+                or np.any(y < 0) or np.any(y > self.shape[1]-1)
+                or not np.all(np.isfinite(x) & np.isfinite(y))):
+            raise ValueError('Position outside of the phasemaps')
+        out = np.zeros((x.shape[0], 3, 4, len(chan)))
+        _sample_phasemaps(*self.maps, x, y, chan, out)
+        return out
+
+    def positions(self, ra, dec, northangle, dra, ddec, scale=1):
+        """
+        Map coordinates of sky positions ra, dec (npos) for all telescopes
+        see read_phasemaps for the arguments, scale: 4.4 for the ATs
+        """
+        ra = np.atleast_1d(np.asarray(ra, dtype=float))
+        dec = np.atleast_1d(np.asarray(dec, dtype=float))
+        pos_ra = (ra[:, np.newaxis] + np.asarray(dra)) / scale
+        pos_dec = (dec[:, np.newaxis] + np.asarray(ddec)) / scale
+        cos = np.cos(np.asarray(northangle, dtype=float))
+        sin = np.sin(np.asarray(northangle, dtype=float))
+        # rotation as in _rotation, first map axis is the second
+        # rotated coordinate
+        rot0 = cos*pos_ra + sin*pos_dec + self.center[1]
+        rot1 = -sin*pos_ra + cos*pos_dec + self.center[0]
+        return rot1, rot0
+
+    def crop(self, x, y, margin=1):
+        """
+        Sampler of the part of the maps which covers the map coordinates
+        x, y (npos, 4), e.g. the corners of the fit boundaries. The maps
+        are copied, the interpolated values do not change
+        margin: additional pixels on each side
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        if (np.any(x < 0) or np.any(x > self.shape[0]-1)
+                or np.any(y < 0) or np.any(y > self.shape[1]-1)):
+            raise ValueError('Position outside of the phasemaps')
+        start, size = [], []
+        for coord, n in zip((x, y), self.shape):
+            low = np.maximum(np.floor(coord.min(axis=0)).astype(int)
+                             - margin, 0)
+            high = np.minimum(np.ceil(coord.max(axis=0)).astype(int)
+                              + margin, n-1)
+            # same size for all telescopes, at least two pixels
+            size.append(max(np.max(high - low) + 1, 2))
+            start.append(np.minimum(low, n - size[-1]))
+        maps = [np.stack([m[:, tel,
+                            start[0][tel]:start[0][tel]+size[0],
+                            start[1][tel]:start[1][tel]+size[1]]
+                          for tel in range(4)], axis=1)
+                for m in self.maps]
+        return PhasemapSampler(*maps, center=self.center - np.array(start))
+
+    def __call__(self, ra, dec, northangle, dra, ddec, chan=None, scale=1):
+        """
+        Phasemap correction of the sources at ra, dec (npos) for
+        all baselines, returns (npos, [amp, pha, int], 6, 2, nchan)
+        """
+        x, y = self.positions(ra, dec, northangle, dra, ddec, scale)
+        maps = self.sample(x, y, chan)
+        return np.stack((maps[:, :, self.tel1], maps[:, :, self.tel2]),
+                        axis=3)
+
+
+def _memmap_handle(array):
+    """
+    ('file', filename, offset, shape, dtype) if array is a complete
+    read-only memory map of a file (as from np.load with mmap_mode),
+    otherwise None
+    """
+    base = array
+    while base is not None and not isinstance(base, np.memmap):
+        base = base.base
+    if (base is None or base.filename is None or base.mode != 'r'
+            or base.shape != array.shape or base.dtype != array.dtype
+            or not base.flags.c_contiguous or not array.flags.c_contiguous
+            or base.ctypes.data != array.ctypes.data):
+        return None
+    return ('file', base.filename, base.offset, array.shape, array.dtype.str)
+
+
+def _release_shared(blocks):
+    for shm in blocks:
+        shm.close()
+        shm.unlink()
+
+
+def _read_phasemaps(ra, dec, northangle, sampler,
                     dra=np.zeros(4), ddec=np.zeros(4)):
     """
     Calculates coupling amplitude / phase for given coordinates
@@ -653,42 +1573,10 @@ def _read_phasemaps(ra, dec, northangle, amp_map_int,
         given by INS.SOBJ relative to *actual* fiber position measured by the laser metrology [mas]
         mis-pointing = actual - desired fiber position = -(DRA,DDEC)
     north_angle: north direction on acqcam in degree
-    if fromFits is true, northangle & dra,ddec are taken from fits file
-    """
-    pm_pos = np.zeros((4, 2))
-    readout_pos = np.zeros((4*len(wave), 4))
-    readout_pos[:, 0] = np.tile(np.arange(len(wave)), 4)
-    readout_pos[:, 1] = np.repeat(np.arange(4), len(wave))
-
-    for tel in range(4):
-        pos = np.array([ra + dra[tel], dec + ddec[tel]])
-        pos_rot = np.dot(_rotation(northangle[tel]), pos) + 100
-        readout_pos[readout_pos[:, 1] == tel, 2] = pos_rot[1]
-        readout_pos[readout_pos[:, 1] == tel, 3] = pos_rot[0]
-        pm_pos[tel] = pos_rot
-
-    amp = amp_map_int(readout_pos).reshape(4, len(wave))
-    pha = pha_map_int(readout_pos).reshape(4, len(wave))
-    inten = amp_map_denom_int(readout_pos).reshape(4, len(wave))
-
-    cor_amp = np.array([[amp[0], amp[1]],
-                        [amp[0], amp[2]],
-                        [amp[0], amp[3]],
-                        [amp[1], amp[2]],
-                        [amp[1], amp[3]],
-                        [amp[2], amp[3]]])
-    cor_pha = np.array([[pha[0], pha[1]],
-                        [pha[0], pha[2]],
-                        [pha[0], pha[3]],
-                        [pha[1], pha[2]],
-                        [pha[1], pha[3]],
-                        [pha[2], pha[3]]])
-    cor_int_denom = np.array([[inten[0], inten[1]],
-                              [inten[0], inten[2]],
-                              [inten[0], inten[3]],
-                              [inten[1], inten[2]],
-                              [inten[1], inten[3]],
-                              [inten[2], inten[3]]])
+    sampler: PhasemapSampler of the loaded maps
+    """
+    cor_amp, cor_pha, cor_int_denom = sampler(ra, dec, northangle,
+                                              dra, ddec)[0]
     return cor_amp, cor_pha, cor_int_denom
 
 
@@ -710,6 +1598,7 @@ def _vis_intensity_approx(s, alpha, lambda0, dlambda):
 def _vis_intensity(s, alpha, lambda0, dlambda):
     """
     Analytic solution for Modulated interferometric intensity
+    mpmath version, the fit uses _vis_intensity_fast
     s:      B*skypos-opd1-opd2
     alpha:  power law index
     lambda0:zentral wavelength
@@ -759,51 +1648,1594 @@ def _vis_int_full(s, alpha, difflam):
     return (a*b/c)
 
 
+@jit(nopython=True)
+def _vis_int_analytic_point(s, a, x1, x2):
+    """
+    Compiled closed form of the channel integral from x2 to x1
+    (same as _vis_intensity, but in double precision without mpmath)
+
+    For |2 pi s/lambda| > 8 the upper incomplete gamma function is
+    evaluated with its continued fraction at both channel edges:
+        Gamma(alpha, z)/z^alpha = exp(-z) / (z+1-alpha - 1(1-alpha)/(z+3-alpha - ...))
+    For smaller values the integrand is expanded in s and integrated
+    term by term, which also covers s == 0 and alpha == 0
+    """
+    tiny = 1e-300
+    k = 2*np.pi*s
+    c = 2.2**(1+a)
+    if abs(k)/x2 < 8:
+        # sum_n (-ik)^n/n! int x^(-1-a-n) dx
+        L = np.log(x1/x2)
+        total = 0j
+        term = 1. + 0j
+        z1 = -1j*k/x1
+        for n in range(500):
+            b = a + n
+            if b == 0:
+                part = term*L
+            else:
+                part = term*np.expm1(b*L)/b
+            total += part
+            if n > 5 and abs(part) < 1e-17*abs(total):
+                break
+            if k == 0:
+                break
+            term = term*z1/(n+1)
+        return c*x1**(-a)*total
+    res = 0j
+    for edx in range(2):
+        if edx == 0:
+            x = x1
+        else:
+            x = x2
+        z = 1j*k/x
+        # modified Lentz algorithm
+        bn = z + 1 - a
+        cn = 1/tiny
+        dn = 1/bn
+        h = dn
+        for n in range(1, 2000):
+            an = -n*(n-a)
+            bn += 2
+            dn = an*dn + bn
+            if abs(dn) < tiny:
+                dn = tiny
+            cn = bn + an/cn
+            if abs(cn) < tiny:
+                cn = tiny
+            dn = 1/dn
+            delta = dn*cn
+            h *= delta
+            if abs(delta-1) < 1e-16:
+                break
+        if edx == 0:
+            res += c*x**(-a)*np.exp(-z)*h
+        else:
+            res -= c*x**(-a)*np.exp(-z)*h
+    return res
+
+
+@jit(nopython=True)
+def _vis_int_analytic(s, alpha, x1, x2):
+    """
+    _vis_int_analytic_point for flat arrays of the same length
+    """
+    res = np.zeros(s.shape[0], dtype=np.complex128)
+    for idx in range(s.shape[0]):
+        res[idx] = _vis_int_analytic_point(s[idx], alpha[idx],
+                                           x1[idx], x2[idx])
+    return res
+
+
+def _vis_intensity_fast(s, alpha, lambda0, dlambda):
+    """
+    Analytic solution for Modulated interferometric intensity,
+    compiled and vectorized version of _vis_intensity
+    s:      B*skypos-opd1-opd2
+    alpha:  power law index
+    lambda0:zentral wavelength
+    dlambda:size of channels
+    All inputs are broadcasted against each other
+    """
+    s, alpha, lambda0, dlambda = np.broadcast_arrays(s, alpha,
+                                                     lambda0, dlambda)
+    res = _vis_int_analytic(np.ravel(s).astype(float),
+                            np.ravel(alpha).astype(float),
+                            np.ravel(lambda0+dlambda).astype(float),
+                            np.ravel(lambda0-dlambda).astype(float))
+    if s.ndim == 0:
+        return res[0]
+    return res.reshape(s.shape)
+
+
 # @jit(nopython=True)
 def _visibility_integrator(wave, s, alpha):
     """
-    complex integral to be integrated over wavelength
-    wave in [micron]
-    theta holds the exponent alpha, and the seperation s
+    complex integral to be integrated over wavelength
+    wave in [micron]
+    theta holds the exponent alpha, and the seperation s
+    """
+    return (wave/2.2)**(-1-alpha)*np.exp(-2*np.pi*1j*s/wave)
+
+
+# @jit(nopython=True)
+def _vis_intensity_num(s, alpha, lambda0, dlambda):
+    """
+    Dull numeric solution for Modulated interferometric intensity
+    s:      B*skypos-opd1-opd2
+    alpha:  power law index
+    lambda0:zentral wavelength
+    dlambda:size of channels
+    """
+    if np.all(s == 0.) and alpha != 0:
+        return np.complex128(-2.2**(1 + alpha)/alpha*(lambda0+dlambda)**(-alpha) - (-2.2**(1 + alpha)/alpha*(lambda0-dlambda)**(-alpha)))
+    else:
+        return complex_quadrature_num(_visibility_integrator, lambda0-dlambda, lambda0+dlambda, (s, alpha))
+
+
+def _ind_visibility(s, alpha, wave, dlambda, fit_mode):
+    """
+    Selectd the correct visibility calculation based on fit_mode
+    """
+    if fit_mode == "approx":
+        ind_vis = _vis_intensity_approx(s, alpha, wave, dlambda)
+    elif fit_mode == "analytic":
+        ind_vis = _vis_intensity_fast(s, alpha, wave, dlambda)
+    elif fit_mode == "numeric":
+        ind_vis = _vis_intensity_num(s, alpha, wave, dlambda)
+    else:
+        print(fit_mode)
+        raise ValueError('fitmode has to be approx, analytic or numeric')
+    return ind_vis
+
+
+def _vis_intensity_num_batch(s, alpha, lambda0, dlambda, nsteps=int(1e2)):
+    """
+    Numeric solution for Modulated interferometric intensity,
+    evaluated for many sources at once
+    s:      (nsource, 6, nwave) B*skypos-opd1-opd2
+    alpha:  (nsource) power law index
+    lambda0:zentral wavelength
+    dlambda:(6, nwave) size of channels
+    """
+    alpha = alpha[:, np.newaxis, np.newaxis]
+    t = np.logspace(np.log10(lambda0-dlambda), np.log10(lambda0+dlambda),
+                    nsteps)
+    dt = np.diff(t, axis=0)[:, np.newaxis]
+    # sources in chunks to limit the size of the integration grid
+    chunk = max(1, int(4e6 // (nsteps * s[0].size)))
+    res = np.zeros(s.shape, dtype=np.complex_)
+    for cdx in range(0, s.shape[0], chunk):
+        values = _visibility_integrator(t[:, np.newaxis], s[cdx:cdx+chunk],
+                                        alpha[cdx:cdx+chunk])
+        res[cdx:cdx+chunk] = np.sum(dt * (values[1:] + values[:-1]),
+                                    axis=0) / 2.
+
+    # same shortcut as in _vis_intensity_num for sources without offset
+    zero = np.all(s == 0, axis=(1, 2)) & (alpha[:, 0, 0] != 0)
+    if np.any(zero):
+        a = alpha[zero]
+        res[zero] = (-2.2**(1 + a)/a*(lambda0+dlambda)**(-a)
+                     - (-2.2**(1 + a)/a*(lambda0-dlambda)**(-a)))
+    return res
+
+
+def _ind_visibility_batch(s, alpha, wave, dlambda, fit_mode):
+    """
+    Batched version of _ind_visibility for the vectorized model
+    s:      (nsource, 6, nwave) separations of all sources & baselines
+    alpha:  (nsource) power law index of each source
+    wave:   (nwave) wavelength
+    dlambda:(6, nwave) size of channels
+    """
+    alpha = np.asarray(alpha, dtype=float)
+    if fit_mode == "approx":
+        ind_vis = _vis_intensity_approx(s, alpha[:, np.newaxis, np.newaxis],
+                                        wave, dlambda)
+    elif fit_mode == "analytic":
+        ind_vis = _vis_intensity_fast(s, alpha[:, np.newaxis, np.newaxis],
+                                      wave, dlambda)
+    elif fit_mode == "numeric":
+        ind_vis = _vis_intensity_num_batch(s, alpha, wave, dlambda)
+    else:
+        print(fit_mode)
+        raise ValueError('fitmode has to be approx, analytic or numeric')
+    return ind_vis
+
+
+def _lagrange_weights(f):
+    """
+    Weights of a 4 point (cubic) Lagrange interpolation on a regular grid
+    for nodes at -1, 0, 1, 2 and the fractional position f
+    """
+    return np.array([-f*(f-1)*(f-2)/6,
+                     (f+1)*(f-1)*(f-2)/2,
+                     -(f+1)*f*(f-2)/2,
+                     (f+1)*f*(f-1)/6])
+
+
+class SmearingTable():
+    def __init__(self, wave, dlambda, s_max, alpha_range=(-10, 10),
+                 ns=64, nalpha=41, tol=1e-4, nsteps=int(1e2),
+                 loglevel='INFO'):
+        """
+        SmearingTable: Tabulated bandwidth smearing for fit_mode numeric
+
+        The numeric integral over each spectral channel only depends on
+        (s, alpha, lambda0, dlambda), and lambda0 & dlambda are fixed for a
+        file. The integral is therefore computed once on a (s, alpha) grid
+        for each channel and interpolated (cubic in both axes) during the
+        fit. The fast carrier exp(-2 pi i s/lambda0) is taken out before
+        tabulating, so that only the slowly varying envelope is interpolated.
+
+        The table is checked against the direct integration in between the
+        grid points and refined until the error is below tol (relative to
+        the flux of the channel) or max. 4 refinements are done.
+
+        wave:        wavelength of the channels [micron]
+        dlambda:     (6, nwave) size of the channels
+        s_max:       largest |s| covered by the table [micron],
+                     values outside are integrated directly
+        alpha_range: range of power law indices covered by the table
+        ns, nalpha:  initial number of grid points
+        tol:         accuracy bound of the interpolation
+        nsteps:      number of integration steps, as in complex_quadrature_num
+        """
+        log_level = log_level_mapping.get(loglevel, logging.INFO)
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(log_level)
+
+        self.wave = np.asarray(wave, dtype=float)
+        self.dlambda = np.asarray(dlambda, dtype=float)
+        self.s_max = s_max
+        self.alpha_range = alpha_range
+        self.tol = tol
+        self.nsteps = nsteps
+        # most files have the same channel width for all baselines
+        self.dl_rows, self.bl_index = np.unique(self.dlambda, axis=0,
+                                                return_inverse=True)
+        self.bl_index = self.bl_index.reshape(-1)
+
+        for _ in range(5):
+            self._build(ns, nalpha)
+            err_s, err_alpha = self.check()
+            self.logger.debug(f'Smearing table ({ns}, {nalpha}): '
+                              f'errors {err_s:.1e} (s), '
+                              f'{err_alpha:.1e} (alpha)')
+            if err_s <= tol and err_alpha <= tol:
+                break
+            if err_s > tol:
+                ns *= 2
+            if err_alpha > tol:
+                nalpha = 2*nalpha - 1
+        else:
+            self.logger.warning('Smearing table does not reach requested '
+                                f'accuracy: {max(err_s, err_alpha):.1e}')
+        self.error = max(err_s, err_alpha)
+
+    def _weights(self, alpha):
+        """
+        Trapezoid weights and power law of all channels on the log grid of
+        complex_quadrature_num, shape (nrows, nwave, nsteps, nalpha)
+        """
+        a = self.wave - self.dl_rows
+        b = self.wave + self.dl_rows
+        t = np.logspace(np.log10(a), np.log10(b), self.nsteps, axis=-1)
+        dt = np.diff(t, axis=-1)
+        q = np.zeros_like(t)
+        q[..., :-1] += dt/2
+        q[..., 1:] += dt/2
+        w = ((t[..., np.newaxis]/2.2)**(-1-np.asarray(alpha))
+             * q[..., np.newaxis])
+        return t, w
+
+    def _integrate(self, s, alpha):
+        """
+        Envelope of the channel integral for all channels on the grid
+        of s and alpha, shape (nrows, nwave, nalpha, ns)
+        """
+        t, w = self._weights(alpha)
+        s = np.asarray(s)
+        res = np.zeros((len(self.dl_rows), len(self.wave),
+                        len(alpha), len(s)), dtype=np.complex_)
+        for rdx in range(len(self.dl_rows)):
+            for wdx, wl in enumerate(self.wave):
+                carrier = np.exp(-2j*np.pi*np.outer(1/t[rdx, wdx] - 1/wl, s))
+                res[rdx, wdx] = np.dot(w[rdx, wdx].T, carrier)
+        return res
+
+    def _build(self, ns, nalpha):
+        # two extra points on each side for the interpolation stencil
+        self.ds = 2*self.s_max/(ns-1)
+        self.s0 = -self.s_max - 2*self.ds
+        self.s_grid = self.s0 + np.arange(ns+4)*self.ds
+        self.dalpha = (self.alpha_range[1]-self.alpha_range[0])/(nalpha-1)
+        self.alpha0 = self.alpha_range[0] - 2*self.dalpha
+        self.alpha_grid = self.alpha0 + np.arange(nalpha+4)*self.dalpha
+        self.table = self._integrate(self.s_grid, self.alpha_grid)
+
+    def check(self):
+        """
+        Compares the interpolation with the direct integration half way
+        between the grid points, separately for s and alpha
+        Returns the maximum relative error for both axes
+        """
+        s_mid = (self.s_grid[2:-3] + self.ds/2)
+        alpha_mid = (self.alpha_grid[2:-3] + self.dalpha/2)
+        err = []
+        for s_test, alpha_test in [(s_mid, self.alpha_grid[2:-2]),
+                                   (self.s_grid[2:-2], alpha_mid)]:
+            exact = self._integrate(s_test, alpha_test)
+            ss, aa = np.meshgrid(s_test, alpha_test)
+            interp = self._interp_envelope(
+                ss[np.newaxis, np.newaxis],
+                aa[np.newaxis, np.newaxis],
+                np.arange(len(self.dl_rows))[:, np.newaxis,
+                                             np.newaxis, np.newaxis],
+                np.arange(len(self.wave))[np.newaxis, :,
+                                          np.newaxis, np.newaxis])
+            # flux of each channel as reference
+            norm = np.abs(self._integrate([0], alpha_test))
+            err.append(np.max(np.abs(interp - exact)/norm))
+        return err[0], err[1]
+
+    def _interp_envelope(self, s, alpha, row, chan):
+        xs = (s - self.s0)/self.ds
+        i_s = np.clip(np.floor(xs).astype(int) - 1, 0, len(self.s_grid)-4)
+        w_s = _lagrange_weights(xs - i_s - 1)
+        xa = (alpha - self.alpha0)/self.dalpha
+        i_a = np.clip(np.floor(xa).astype(int) - 1, 0,
+                      len(self.alpha_grid)-4)
+        w_a = _lagrange_weights(xa - i_a - 1)
+        res = 0
+        for jdx in range(4):
+            for kdx in range(4):
+                res = res + (w_a[jdx] * w_s[kdx]
+                             * self.table[row, chan, i_a+jdx, i_s+kdx])
+        return res
+
+    def __call__(self, s, alpha, bl=None, chan=None):
+        """
+        Interpolated modulated interferometric intensity
+        s:      (nsource, nbl, nwave) B*skypos-opd1-opd2
+        alpha:  (nsource) power law index
+        bl, chan: indices of the baselines & channels in s,
+                  all of them if not given
+        """
+        if bl is None:
+            bl = np.arange(len(self.bl_index))
+        if chan is None:
+            chan = np.arange(len(self.wave))
+        alpha = np.broadcast_to(np.asarray(alpha, dtype=float)
+                                [:, np.newaxis, np.newaxis], s.shape)
+        row = self.bl_index[bl][np.newaxis, :, np.newaxis]
+        wave = self.wave[chan]
+        res = (self._interp_envelope(s, alpha, row,
+                                     chan[np.newaxis, np.newaxis, :])
+               * np.exp(-2j*np.pi*s/wave))
+
+        outside = ((np.abs(s) > self.s_max)
+                   | (alpha < self.alpha_range[0])
+                   | (alpha > self.alpha_range[1]))
+        if np.any(outside):
+            dlambda = np.broadcast_to(self.dlambda[np.ix_(bl, chan)]
+                                      [np.newaxis], s.shape)
+            wave = np.broadcast_to(wave, s.shape)
+            res[outside] = complex_quadrature_num(_visibility_integrator,
+                                                  (wave-dlambda)[outside],
+                                                  (wave+dlambda)[outside],
+                                                  (s[outside], alpha[outside]),
+                                                  nsteps=self.nsteps)
+        return res
+
+    def matches(self, wave, dlambda, s_max, tol):
+        """
+        Checks if the table can be reused for the given setup
+        """
+        return (np.array_equal(self.wave, wave)
+                and np.array_equal(self.dlambda, dlambda)
+                and self.s_max >= s_max and self.tol <= tol)
+
+
+class ChannelQuadrature():
+    def __init__(self, wave, dlambda, nodes=None, s_max=None,
+                 alpha_range=(-10, 10), tol=1e-6, max_nodes=128,
+                 loglevel='INFO'):
+        """
+        ChannelQuadrature: Gauss-Legendre integration of the spectral
+        channels for fit_mode numeric
+
+        Replaces the trapezoidal rule on 100 points of
+        complex_quadrature_num. The integrand is smooth over a channel,
+        so a few Gauss-Legendre nodes are sufficient as long as the phase
+        exp(-2 pi i s/lambda) does not wrap many times within the channel.
+
+        wave:        wavelength of the channels [micron]
+        dlambda:     (6, nwave) size of the channels
+        nodes:       number of nodes, if None the fewest nodes are chosen
+                     which reach tol for all |s| < s_max
+        s_max:       largest |s| of the fit [micron]
+        alpha_range: range of power law indices for the node selection
+        tol:         accuracy bound (complex deviation relative to the
+                     flux of the channel, i.e. amplitude and phase in rad)
+        """
+        log_level = log_level_mapping.get(loglevel, logging.INFO)
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(log_level)
+
+        self.wave = np.asarray(wave, dtype=float)
+        self.dlambda = np.asarray(dlambda, dtype=float)
+        self.s_max = s_max
+        self.alpha_range = alpha_range
+        self.tol = tol
+
+        if nodes is None:
+            if s_max is None:
+                raise ValueError('Give s_max for the automatic node selection')
+            candidates = [4, 6, 8, 10, 12, 16, 20, 24, 32, 48, 64, 96, 128]
+            candidates = [n for n in candidates if n < max_nodes] + [max_nodes]
+            for nodes in candidates:
+                self._set_nodes(nodes)
+                self.error = self.check()
+                if self.error < tol:
+                    break
+            if self.error > tol:
+                self.logger.warning(f'Channel quadrature: {nodes} nodes only '
+                                    f'reach an accuracy of {self.error:.1e}')
+            self.logger.info(f'Channel quadrature: {nodes} nodes '
+                             f'(error {self.error:.1e})')
+        else:
+            self._set_nodes(nodes)
+            self.error = None
+
+    def _set_nodes(self, nodes):
+        self.nodes = nodes
+        x, w = np.polynomial.legendre.leggauss(nodes)
+        # (6, nwave, nodes)
+        self.t = self.wave[:, np.newaxis] + self.dlambda[..., np.newaxis]*x
+        self.weights = self.dlambda[..., np.newaxis]*w
+
+    def check(self, ns=65, nalpha=5):
+        """
+        Max. deviation from the analytic solution (_vis_intensity_fast)
+        for |s| < s_max, relative to the flux of the channel
+        """
+        s_test = np.linspace(0, self.s_max, ns)
+        err = 0
+        for alpha in np.linspace(*self.alpha_range, nalpha):
+            norm = np.abs(_vis_intensity_fast(0, alpha, self.wave,
+                                              self.dlambda))
+            for s in s_test:
+                s = np.full(self.dlambda.shape, s)
+                exact = _vis_intensity_fast(s, alpha, self.wave, self.dlambda)
+                quad = self(s[np.newaxis], [alpha])[0]
+                err = max(err, np.max(np.abs(quad - exact)/norm))
+        return err
+
+    def __call__(self, s, alpha, bl=None, chan=None):
+        """
+        Modulated interferometric intensity
+        s:      (nsource, nbl, nwave) B*skypos-opd1-opd2
+        alpha:  (nsource) power law index
+        bl, chan: indices of the baselines & channels in s,
+                  all of them if not given
+        """
+        t, weights = self.t, self.weights
+        if bl is not None or chan is not None:
+            bl_chan = np.ix_(np.arange(t.shape[0]) if bl is None else bl,
+                             np.arange(t.shape[1]) if chan is None else chan)
+            t, weights = t[bl_chan], weights[bl_chan]
+        alpha = np.asarray(alpha, dtype=float)[:, np.newaxis, np.newaxis,
+                                                np.newaxis]
+        res = np.zeros(s.shape, dtype=np.complex_)
+        # sources in chunks to limit the memory
+        chunk = max(1, int(4e6 // t.size))
+        for cdx in range(0, s.shape[0], chunk):
+            values = _visibility_integrator(t, s[cdx:cdx+chunk,
+                                                 ..., np.newaxis],
+                                            alpha[cdx:cdx+chunk])
+            res[cdx:cdx+chunk] = np.sum(weights*values, axis=-1)
+        return res
+
+
+class FluxNormCache():
+    def __init__(self, maxsize=256):
+        """
+        FluxNormCache: Bounded (LRU) cache for the zero separation
+        normalisations of the visibility model
+
+        The terms only depend on the power law index, the channels and
+        the fit_mode, the key is (alpha, fit_mode, channel signature)
+        maxsize is raised to the number of alphas of a call if needed
+        hits & misses count the lookups since the last clear()
+        """
+        self.maxsize = maxsize
+        self.clear()
+
+    def clear(self):
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def cache_info(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._cache), 'maxsize': self.maxsize}
+
+    def __call__(self, alpha, wave, dlambda, fit_mode):
+        """
+        Zero separation intensity for each alpha
+        alpha:  (n) power law indices
+        wave:   (nwave) wavelength
+        dlambda:(6, nwave) size of channels
+        returns (n, 6, nwave)
+        """
+        alpha = np.asarray(alpha, dtype=float)
+        signature = (fit_mode, np.asarray(wave).tobytes(),
+                     np.asarray(dlambda).tobytes())
+        ualpha, inverse = np.unique(alpha, return_inverse=True)
+        shape = np.shape(dlambda)
+        res = np.zeros((len(ualpha),) + shape, dtype=np.complex_)
+        missing = []
+        for adx, a in enumerate(ualpha):
+            key = (a,) + signature
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                res[adx] = self._cache[key]
+            else:
+                missing.append(adx)
+        # hits/misses counted per requested value, not per unique value
+        nmiss = np.isin(inverse, missing).sum()
+        self.misses += nmiss
+        self.hits += len(alpha) - nmiss
+        if missing:
+            res[missing] = _ind_visibility_batch(
+                np.zeros((len(missing),) + shape),
+                ualpha[missing], wave, dlambda, fit_mode)
+            for adx in missing:
+                self._cache[(ualpha[adx],) + signature] = res[adx]
+            # the values hit in this call are the most recently used and
+            # the cache holds at least one batch: new alphas (free alpha
+            # of SgrA*, more walkers than maxsize) do not evict the
+            # fixed ones of the stars and the background
+            for adx in np.setdiff1d(np.arange(len(ualpha)), missing):
+                self._cache.move_to_end((ualpha[adx],) + signature)
+            while len(self._cache) > max(self.maxsize, len(ualpha)):
+                self._cache.popitem(last=False)
+        return res[inverse]
+
+
+_flux_norm_cache = FluxNormCache()
+
+
+class PreparedData():
+    def __init__(self, fitdata, bispec_ind=None):
+        """
+        PreparedData: Data of a fit, prepared once for the likelihoods
+
+        Behaves like the fitdata list
+        [visamp, visamp_error, visamp_flag, vis2, vis2_error, vis2_flag,
+         closure, closure_error, closure_flag, visphi, visphi_error, visphi_flag]
+        and additionally holds read-only index maps of the unflagged data
+        and the data compacted on them:
+        chan:             used channels (bool, on the full channel axis)
+        chan_index:       indices of the used channels
+        bl:               used baselines, with unflagged data or part of a
+                          used closure triangle (needs bispec_ind, otherwise
+                          all baselines are kept)
+        tri:              used closure triangles
+        visamp, vis2,
+        closure, visphi:  data on (bl or tri, chan), zero for flagged points
+        visamp_w, ...:    inverse variances, zero for flagged points
+        closure_phasor,
+        visphi_phasor:    exp(i*phase) of the data
+        The model only has to be evaluated on these maps,
+        see _calc_vis_mstars_batch(..., compact=fitdata)
+        """
+        self._fitdata = list(fitdata)
+        (visamp, visamp_error, visamp_flag,
+         vis2, vis2_error, vis2_flag,
+         closure, closure_error, closure_flag,
+         visphi, visphi_error, visphi_flag) = self._fitdata
+
+        flags = [np.asarray(f, dtype=bool) for f in
+                 [visamp_flag, vis2_flag, closure_flag, visphi_flag]]
+        nbl, nwave = flags[0].shape[-2:]
+        ntri = flags[2].shape[-2]
+        chan = np.zeros(nwave, dtype=bool)
+        for flag in flags:
+            chan |= np.any(~flag.reshape(-1, nwave), axis=0)
+        tri = np.any(~flags[2][..., chan].reshape(-1, ntri, chan.sum()),
+                     axis=(0, 2))
+        if bispec_ind is None:
+            bl = np.ones(nbl, dtype=bool)
+        else:
+            bl = np.zeros(nbl, dtype=bool)
+            for flag in [flags[0], flags[1], flags[3]]:
+                bl |= np.any(~flag[..., chan].reshape(-1, nbl, chan.sum()),
+                             axis=(0, 2))
+            bl[np.asarray(bispec_ind)[tri].ravel()] = True
+        self.chan = chan
+        self.chan_index = np.flatnonzero(chan)
+        self.bl = np.flatnonzero(bl)
+        self.tri = np.flatnonzero(tri)
+
+        for name, data, error, flag, rows in [
+                ('visamp', visamp, visamp_error, flags[0], self.bl),
+                ('vis2', vis2, vis2_error, flags[1], self.bl),
+                ('closure', closure, closure_error, flags[2], self.tri),
+                ('visphi', visphi, visphi_error, flags[3], self.bl)]:
+            flag = np.take(flag, rows, axis=-2)[..., chan]
+            data = np.take(np.asarray(data, dtype=float), rows,
+                           axis=-2)[..., chan]
+            data = np.where(flag, 0., data)
+            error = np.take(np.asarray(error, dtype=float), rows,
+                            axis=-2)[..., chan]
+            weight = np.where(flag, 0., 1/np.where(flag, 1., error)**2)
+            setattr(self, name, data)
+            setattr(self, f'{name}_w', weight)
+        self.closure_phasor = np.exp(1j*np.radians(self.closure))
+        self.visphi_phasor = np.exp(1j*np.radians(self.visphi))
+        for name in ['chan', 'chan_index', 'bl', 'tri',
+                     'visamp', 'visamp_w', 'vis2', 'vis2_w',
+                     'closure', 'closure_w', 'visphi', 'visphi_w',
+                     'closure_phasor', 'visphi_phasor']:
+            getattr(self, name).setflags(write=False)
+
+    @property
+    def size(self):
+        """
+        Number of evaluated model points (baselines x channels)
+        """
+        return len(self.bl) * len(self.chan_index)
+
+    def __getitem__(self, idx):
+        return self._fitdata[idx]
+
+    def __len__(self):
+        return len(self._fitdata)
+
+    def __iter__(self):
+        return iter(self._fitdata)
+
+
+def _prepare_fitdata(fitdata, bispec_ind=None):
+    if isinstance(fitdata, PreparedData):
+        return fitdata
+    return PreparedData(fitdata, bispec_ind)
+
+
+def _lnprob_mstars(theta, fitdata, lower, upper, fitarg, fithelp):
+    if np.any(theta < lower) or np.any(theta > upper):
+        return -np.inf
+    return _lnlike_mstars(theta, fitdata, fitarg, fithelp, loglike=True)
+
+
+def _lnprob_mstars_batch(thetas, fitdata, lower, upper, fitarg, fithelp):
+    """
+    Log probability for all walkers at once (emcee with vectorize=True)
+    thetas: (nwalkers, ndim)
+    """
+    thetas = np.atleast_2d(thetas)
+    inside = np.all((thetas >= lower) & (thetas <= upper), axis=1)
+    lnprob = np.full(thetas.shape[0], -np.inf)
+    if np.any(inside):
+        lnprob[inside] = _lnlike_mstars_batch(thetas[inside], fitdata,
+                                              fitarg, fithelp)
+    return lnprob
+
+
+class SamplerPool():
+    def __init__(self, processes=None, phasemaps=None, initializer=None,
+                 initargs=()):
+        """
+        SamplerPool: Persistent process pool for the fits
+
+        The workers are started once and reused for all following fits,
+        which saves the start-up of a new pool for every fit. Give it to
+        fit_stars (pool=...) or attach it to the fit object (.pool), and
+        close it when done, best by using it as a context manager:
+
+            with SamplerPool(8, phasemaps=sampler) as pool:
+                for file in files:
+                    fit = GravMFit(file, pool=pool)
+                    fit.fit_stars(...)
+
+        The arguments of a fit are sent once to each worker (see
+        set_args), the tasks then only carry the parameter sets.
+
+        processes:   number of workers [os.cpu_count()]
+        phasemaps:   PhasemapSampler or list of them, attached once by
+                     every worker and reused by all fits with these maps
+        initializer: called with initargs in every worker at start [None]
+        """
+        self.processes = processes or os.cpu_count()
+        if isinstance(phasemaps, PhasemapSampler):
+            phasemaps = [phasemaps]
+        self.phasemaps = list(phasemaps or [])
+        for sampler in self.phasemaps:
+            sampler.share()
+        # the workers have to share the tracker of the shared memory,
+        # their own ones would free it when they exit
+        resource_tracker.ensure_running()
+        self._pool = Pool(processes=self.processes,
+                          initializer=_init_pool_worker,
+                          initargs=(self.phasemaps, initializer, initargs))
+        self._args = None
+        self._handle = None
+        self._nargs = 0
+
+    def set_args(self, *args):
+        """
+        Sets the arguments of the following tasks (fitdata, lower, ...).
+        They are pickled once into shared memory, from where each worker
+        loads them with its first task
+        """
+        self._free_args()
+        data = pickle.dumps(args, protocol=pickle.HIGHEST_PROTOCOL)
+        shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+        shm.buf[:len(data)] = data
+        self._args = shm
+        self._nargs += 1
+        self._handle = (self._nargs, shm.name, len(data))
+
+    def task(self, func):
+        """
+        func(thetas, *args) with the arguments of set_args,
+        as picklable function of thetas only
+        """
+        if self._handle is None:
+            raise ValueError('No arguments set, call set_args first')
+        return functools.partial(_call_pool_worker, func, self._handle)
+
+    def map(self, func, iterable):
+        return self._pool.map(func, iterable)
+
+    def close(self):
+        """
+        Waits for the workers to finish and frees the pool
+        """
+        self._pool.close()
+        self._pool.join()
+        self._free_args()
+
+    def terminate(self):
+        self._pool.terminate()
+        self._pool.join()
+        self._free_args()
+
+    def _free_args(self):
+        if self._args is not None:
+            self._args.close()
+            self._args.unlink()
+            self._args = None
+            self._handle = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+    def __getstate__(self):
+        raise TypeError('A SamplerPool can not be sent to other processes')
+
+
+# state of a pool worker: phasemaps given to the SamplerPool and their
+# maps by handle, the arguments of the current fit and their handle
+_pool_samplers = []
+_pool_maps = {}
+_pool_args = ()
+_pool_handle = None
+
+
+def _init_pool_worker(phasemaps, initializer, initargs):
+    """
+    SamplerPool initializer: the phasemaps are attached once and kept
+    for all fits of the worker (see PhasemapSampler.__setstate__)
+    """
+    # keeping the samplers keeps their shared memory attached
+    _pool_samplers.extend(phasemaps)
+    for sampler in phasemaps:
+        for handle, m in zip(sampler._handles, sampler.maps):
+            _pool_maps[handle] = m
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _call_pool_worker(func, handle, thetas):
+    global _pool_args, _pool_handle
+    if handle != _pool_handle:
+        # first task of a new fit
+        shm = shared_memory.SharedMemory(name=handle[1])
+        try:
+            data = bytes(shm.buf[:handle[2]])
+        finally:
+            shm.close()
+        _pool_args = pickle.loads(data)
+        _pool_handle = handle
+    return func(thetas, *_pool_args)
+
+
+def _lnprob_mstars_pool(thetas, pool, nchunks):
+    """
+    Splits the walkers in nchunks batches, which are evaluated on the
+    SamplerPool (with the arguments of set_args)
+    """
+    chunks = np.array_split(thetas, min(nchunks, len(thetas)))
+    res = pool.map(pool.task(_lnprob_mstars_batch), chunks)
+    return np.concatenate(res)
+
+
+def _optimized_walkers(theta, nwalkers, lower, upper, fitdata, fitarg,
+                       fithelp, width=1e-1):
+    """
+    Least-squares fit from theta, then a walker ball around the optimum
+    drawn from the local covariance (Jacobian, scaled with the reduced
+    chi2), with the standard deviations limited to width.
+    Returns the start positions (nwalkers, ndim) and the least_squares
+    result, None for the positions if the covariance is not usable
+    """
+    out = least_squares(_residuals_mstars, theta, jac=_jacobian_mstars,
+                        bounds=(lower, upper), x_scale='jac',
+                        args=(fitdata, fitarg, fithelp))
+    ndim = len(theta)
+    nres = len(out.fun)
+    redchi = 2*out.cost / max(nres - ndim, 1)
+    cov = np.linalg.pinv(out.jac.T @ out.jac) * redchi
+    sigma = np.sqrt(np.abs(np.diag(cov)))
+    if not out.success or not np.all(np.isfinite(cov)) or np.any(sigma == 0):
+        return None, out
+    # correlations of the covariance, limited standard deviations
+    scale = np.minimum(sigma, width) / sigma
+    cov = cov * np.outer(scale, scale)
+    pos = np.random.multivariate_normal(out.x, cov, size=nwalkers,
+                                        check_valid='ignore')
+    margin = 1e-3*(upper - lower)
+    return np.clip(pos, lower + margin, upper - margin), out
+
+
+# convergence diagnostics of the MCMC in the fit tables
+_CONVERGENCE_KEYS = ['nsteps', 'steps_saved', 'tau', 'burnin', 'thin',
+                     'acceptance', 'converged']
+
+
+def _sample_emcee(sampler, pos, nruns, progress=False, converge=None):
+    """
+    Runs the sampler for nruns steps, or with converge=(ntau, tol, every)
+    until the chain is longer than ntau times the autocorrelation time
+    of all parameters and tau changed by less than tol (relative)
+    between two checks, done every few steps. nruns is the maximum then
+    """
+    if converge is None:
+        sampler.run_mcmc(pos, nruns, progress=progress,
+                         skip_initial_state_check=True)
+        return sampler
+    ntau, tol, every = converge
+    old_tau = np.inf
+    for _ in sampler.sample(pos, iterations=nruns, progress=progress,
+                            skip_initial_state_check=True):
+        if sampler.iteration % every:
+            continue
+        tau = sampler.get_autocorr_time(tol=0)
+        if (np.all(ntau*tau < sampler.iteration)
+                and np.all(np.abs(old_tau - tau) < tol*tau)):
+            break
+        old_tau = tau
+    return sampler
+
+
+def _emcee_convergence(sampler, nruns, ntau=50, converge=False):
+    """
+    Convergence diagnostics of an emcee run from the integrated
+    autocorrelation time tau (largest of all parameters).
+    With converge burn-in (2 tau) and thinning (tau/2) are chosen from
+    tau, otherwise the last 200 / 100 steps are used (nruns > 300 / 200)
+    """
+    nsteps = sampler.iteration
+    tau = np.max(sampler.get_autocorr_time(tol=0))
+    if converge:
+        if np.isfinite(tau):
+            burnin = min(int(2*tau), nsteps // 2)
+            thin = max(1, int(tau / 2))
+        else:
+            burnin, thin = nsteps // 2, 1
+    else:
+        if nsteps > 300:
+            burnin = nsteps - 200
+        elif nsteps > 200:
+            burnin = nsteps - 100
+        else:
+            burnin = 0
+        thin = 1
+    return {'nsteps': nsteps, 'steps_saved': nruns - nsteps, 'tau': tau,
+            'burnin': burnin, 'thin': thin,
+            'acceptance': np.mean(sampler.acceptance_fraction),
+            'converged': bool(nsteps > ntau*tau)}
+
+
+# slots of the smearing table & channel quadrature in fithelp
+# (nsource, fit_for, bispec_ind, fit_mode, wave, dlambda, todel, fixed,
+#  phasemaps, northA, dra, ddec, pm_sampler, _, _, fit_phasemaps,
+#  fix_pm_sources, only_stars, smearing_table, channel_quadrature)
+_FITHELP_SMEARING = 18
+_FITHELP_QUADRATURE = 19
+
+
+def _run_emcee_mstars(pos, nruns, fitdata, lower, upper, fitarg, fithelp,
+                      nthreads=1, vectorize=True, compiled=True,
+                      numba_parallel=False, progress=False, pool=None,
+                      converge=None):
+    """
+    MCMC fit of one polarisation / DIT of GravMFit.fit_stars,
+    pos: (nwalkers, ndim) start positions, returns the emcee sampler
+    pool: SamplerPool to use, otherwise one with nthreads workers is
+          started for the fit (if nthreads > 1)
+    converge: (ntau, tol, every) to stop at convergence, see _sample_emcee
+    """
+    nwalkers, ndim = pos.shape
+    use_compiled = compiled and fithelp[_FITHELP_SMEARING] is None
+    if pool is None and nthreads > 1:
+        with SamplerPool(nthreads) as pool:
+            return _run_emcee_mstars(pos, nruns, fitdata, lower, upper,
+                                     fitarg, fithelp, vectorize=vectorize,
+                                     progress=progress, pool=pool,
+                                     converge=converge)
+    if pool is None:
+        if use_compiled:
+            pack = _pack_mstars(fitdata, fitarg, fithelp)
+            sampler = emcee.EnsembleSampler(nwalkers, ndim,
+                                            _lnprob_mstars_numba,
+                                            args=(lower, upper, pack,
+                                                  numba_parallel),
+                                            vectorize=vectorize)
+        elif vectorize:
+            sampler = emcee.EnsembleSampler(nwalkers, ndim,
+                                            _lnprob_mstars_batch,
+                                            args=(fitdata, lower, upper,
+                                                  fitarg, fithelp),
+                                            vectorize=True)
+        else:
+            sampler = emcee.EnsembleSampler(nwalkers, ndim,
+                                            _lnprob_mstars,
+                                            args=(fitdata, lower, upper,
+                                                  fitarg, fithelp))
+        _sample_emcee(sampler, pos, nruns, progress, converge)
+    else:
+        # fit arguments are sent once per worker
+        pool.set_args(fitdata, lower, upper, fitarg, fithelp)
+        if vectorize:
+            # one batch of walkers per process
+            sampler = emcee.EnsembleSampler(nwalkers, ndim,
+                                            _lnprob_mstars_pool,
+                                            args=(pool, pool.processes),
+                                            vectorize=True)
+        else:
+            sampler = emcee.EnsembleSampler(nwalkers, ndim,
+                                            pool.task(_lnprob_mstars),
+                                            pool=pool)
+        _sample_emcee(sampler, pos, nruns, progress, converge)
+    return sampler
+
+
+def _lnlike_mstars_batch(thetas, fitdata, fitarg, fithelp):
+    """
+    Log likelihood of _lnlike_mstars for many parameter sets at once
+    """
+    (nsource, fit_for, bispec_ind, fit_mode, wave, dlambda,
+     todel, fixed, phasemaps, northA, dra, ddec,
+     pm_sampler, _, _,
+     fit_phasemaps, fix_pm_sources,
+     only_stars, smearing_table, channel_quadrature) = fithelp
+
+    for ddx in range(len(todel)):
+        thetas = np.insert(thetas, todel[ddx], fixed[ddx], axis=1)
+
+    fitdata = _prepare_fitdata(fitdata, bispec_ind)
+    model_visamp, model_visphi, model_closure = _calc_vis_mstars_batch(
+        thetas, fitarg, fithelp, compact=fitdata)
+    model_vis2 = model_visamp**2.
+
+    res_visamp = np.sum((model_visamp-fitdata.visamp)**2
+                        * fitdata.visamp_w, axis=(1, 2))
+    res_vis2 = np.sum((model_vis2-fitdata.vis2)**2.
+                      * fitdata.vis2_w, axis=(1, 2))
+
+    res_closure = np.degrees(np.abs(np.exp(1j*np.radians(model_closure))
+                                    - fitdata.closure_phasor))
+    res_clos = np.sum(res_closure**2. * fitdata.closure_w, axis=(1, 2))
+
+    res_visphi = np.degrees(np.abs(np.exp(1j*np.radians(model_visphi))
+                                   - fitdata.visphi_phasor))
+    res_phi = np.sum(res_visphi**2. * fitdata.visphi_w, axis=(1, 2))
+
+    return -0.5 * (res_visamp * fit_for[0]
+                   + res_vis2 * fit_for[1]
+                   + res_clos * fit_for[2]
+                   + res_phi * fit_for[3])
+
+
+def _lnlike_mstars_grid(thetas, fitdata, fitarg, fithelp):
+    """
+    Log likelihood of many parameter sets without fit boundaries
+    (GravMFit.chi2_map), from the compiled likelihood if available
+    """
+    if fithelp[_FITHELP_SMEARING] is not None:
+        return _lnlike_mstars_batch(thetas, fitdata, fitarg, fithelp)
+    bound = np.full(thetas.shape[1], np.inf)
+    return _lnprob_mstars_numba(thetas, -bound, bound,
+                                _pack_mstars(fitdata, fitarg, fithelp))
+
+
+def _map_minima(chi2, footprint):
+    """
+    Local minima of a chi2 map (GravMFit.chi2_map) within footprint cells.
+    Minima on the edge of the map only show that chi2 decreases outwards
+    and are excluded, unless there are no others.
+    Returns the indices of the minima and whether the lowest chi2 of
+    the map is on its edge
+    """
+    is_min = ((chi2 == ndimage.minimum_filter(chi2, size=footprint,
+                                              mode='nearest'))
+              & np.isfinite(chi2))
+    edge = np.ones(chi2.shape, dtype=bool)
+    edge[1:-1, 1:-1] = False
+    at_edge = (np.min(chi2[is_min & edge], initial=np.inf)
+               < np.min(chi2[is_min & ~edge], initial=np.inf))
+    if np.any(is_min & ~edge):
+        is_min &= ~edge
+    return np.where(is_min), at_edge
+
+
+def _residuals_mstars_batch(thetas, fitdata, fitarg, fithelp):
+    """
+    Weighted residuals of all unflagged data points for many parameter sets,
+    sum(res**2) is the chi2 of _lnlike_mstars. Phases enter as signed
+    chord length in degrees, which keeps the residuals differentiable
+    thetas: (nbatch, ndim)
+    returns (nbatch, nres)
+    """
+    (nsource, fit_for, bispec_ind, fit_mode, wave, dlambda,
+     todel, fixed, phasemaps, northA, dra, ddec,
+     pm_sampler, _, _,
+     fit_phasemaps, fix_pm_sources,
+     only_stars, smearing_table, channel_quadrature) = fithelp
+
+    thetas = np.atleast_2d(np.asarray(thetas, dtype=float))
+    for ddx in range(len(todel)):
+        thetas = np.insert(thetas, todel[ddx], fixed[ddx], axis=1)
+
+    fitdata = _prepare_fitdata(fitdata, bispec_ind)
+    model_visamp, model_visphi, model_closure = _calc_vis_mstars_batch(
+        thetas, fitarg, fithelp, compact=fitdata)
+    model_vis2 = model_visamp**2.
+
+    res = []
+    for model, data, weight, fit_weight, phase in [
+            (model_visamp, fitdata.visamp, fitdata.visamp_w, fit_for[0], False),
+            (model_vis2, fitdata.vis2, fitdata.vis2_w, fit_for[1], False),
+            (model_closure, fitdata.closure, fitdata.closure_w, fit_for[2], True),
+            (model_visphi, fitdata.visphi, fitdata.visphi_w, fit_for[3], True)]:
+        if fit_weight == 0:
+            continue
+        use = weight > 0
+        if phase:
+            diff = np.degrees(2*np.sin(np.radians(model - data)/2))
+        else:
+            diff = model - data
+        res.append((diff*np.sqrt(weight*fit_weight))[:, use])
+    return np.concatenate(res, axis=1)
+
+
+def _residuals_mstars(theta, fitdata, fitarg, fithelp):
+    return _residuals_mstars_batch(theta, fitdata, fitarg, fithelp)[0]
+
+
+def _jacobian_mstars(theta, fitdata, fitarg, fithelp):
+    """
+    Jacobian of _residuals_mstars from central differences,
+    all offsets are evaluated in one batched model call
+    """
+    theta = np.asarray(theta, dtype=float)
+    ndim = len(theta)
+    h = np.finfo(float).eps**(1/3) * np.maximum(np.abs(theta), 1)
+    steps = np.diag(h)
+    res = _residuals_mstars_batch(np.concatenate((theta + steps,
+                                                  theta - steps)),
+                                  fitdata, fitarg, fithelp)
+    return ((res[:ndim] - res[ndim:]) / (2*h[:, np.newaxis])).T
+
+
+def _pack_mstars(fitdata, fitarg, fithelp):
+    """
+    Converts fitdata, fitarg & fithelp into the flat typed arrays of the
+    compiled likelihood (_lnprob_mstars_numba). Not available with the
+    smearing table (a ChannelQuadrature is supported)
+    """
+    (nsource, fit_for, bispec_ind, fit_mode, wave, dlambda,
+     todel, fixed, phasemaps, northA, dra, ddec,
+     pm_sampler, _, _,
+     fit_phasemaps, fix_pm_sources,
+     only_stars, smearing_table, channel_quadrature) = fithelp
+    if smearing_table is not None:
+        raise ValueError('Compiled likelihood not available with smearing table')
+
+    fitdata = _prepare_fitdata(fitdata, bispec_ind)
+
+    if nsource == 0:
+        nfull = 17
+    else:
+        nfull = nsource*3 + 16
+    # positions of free & fixed values in the full theta
+    # (same order as the np.insert in _lnlike_mstars)
+    index = np.arange(nfull - len(todel))
+    for ddx in range(len(todel)):
+        index = np.insert(index, todel[ddx], -1-ddx)
+    free_pos = np.where(index >= 0)[0]
+    template = np.zeros(nfull)
+    template[index < 0] = np.asarray(fixed, dtype=float)[-1-index[index < 0]]
+
+    wave = np.asarray(wave, dtype=float)
+    dlambda = np.asarray(dlambda, dtype=float)
+    nsrc = nsource + 1
+    if phasemaps and not fit_phasemaps:
+        pm = np.array(fix_pm_sources[:nsrc], dtype=float)
+        pm_ds = (pm[:, 1, :, 0] - pm[:, 1, :, 1])/360*wave
+        pm_nom = pm[:, 0, :, 0]*pm[:, 0, :, 1]
+        pm_d1 = pm[:, 2, :, 0]
+        pm_d2 = pm[:, 2, :, 1]
+    else:
+        pm_ds = np.zeros((nsrc, 6, len(wave)))
+        pm_nom = np.ones((nsrc, 6, len(wave)))
+        pm_d1 = np.ones((nsrc, 6, len(wave)))
+        pm_d2 = np.ones((nsrc, 6, len(wave)))
+
+    mode = {'approx': 0, 'analytic': 1, 'numeric': 2}[fit_mode]
+    # nodes & weights of the numeric integration, either from the
+    # ChannelQuadrature or the trapezoidal rule on 100 logarithmic steps
+    # as in _vis_intensity_num
+    if mode == 2 and channel_quadrature is not None:
+        t = channel_quadrature.t
+        quad_w = channel_quadrature.weights
+    else:
+        if mode == 2:
+            t = np.logspace(np.log10(wave-dlambda), np.log10(wave+dlambda),
+                            100, axis=-1)
+        else:
+            t = np.ones((6, len(wave), 1))
+        dt = np.diff(t, axis=-1)
+        quad_w = np.zeros(t.shape)
+        quad_w[..., 1:] += dt/2
+        quad_w[..., :-1] += dt/2
+
+    # only baselines, channels & closures with data
+    bl = np.asarray(fitdata.bl, dtype=np.int64)
+    chan = fitdata.chan_index
+    bl_pos = np.zeros(6, dtype=np.int64)
+    bl_pos[bl] = np.arange(len(bl))
+    bl_chan = np.ix_(bl, chan)
+
+    # phasemaps read at each step, otherwise placeholders
+    fit_pm = bool(phasemaps and fit_phasemaps)
+    if fit_pm:
+        pm_maps = pm_sampler.maps
+        pm_geometry = np.array([northA, dra, ddec, *pm_sampler.center],
+                               dtype=float)
+        tel1 = pm_sampler.tel1[bl]
+        tel2 = pm_sampler.tel2[bl]
+    else:
+        pm_maps = [np.zeros((1, 4, 2, 2), dtype=np.float32)]*3
+        pm_geometry = np.zeros((5, 4))
+        tel1 = tel2 = np.zeros(len(bl), dtype=np.int64)
+    return (free_pos, template, nsource, bool(only_stars), mode,
+            np.asarray(fitarg[0], dtype=float)[bl],
+            np.asarray(fitarg[1], dtype=float)[bl],
+            wave[chan], dlambda[bl_chan],
+            np.log(t/2.2)[bl_chan], 1/t[bl_chan], quad_w[bl_chan],
+            pm_ds[:, bl][..., chan], pm_nom[:, bl][..., chan],
+            pm_d1[:, bl][..., chan], pm_d2[:, bl][..., chan],
+            bl_pos[np.asarray(bispec_ind)[fitdata.tri]], bl,
+            fitdata.visamp, fitdata.visamp_w*fit_for[0],
+            fitdata.vis2, fitdata.vis2_w*fit_for[1],
+            fitdata.closure, fitdata.closure_w*fit_for[2],
+            fitdata.visphi, fitdata.visphi_w*fit_for[3],
+            fit_pm, *pm_maps, pm_geometry, tel1, tel2,
+            np.asarray(chan, dtype=np.int64))
+
+
+@njit(cache=True)
+def _mstars_phasemaps(full, nsource, wave, amp_map, pha_map, denom_map,
+                      pm_geometry, tel1, tel2, chan, pm_x, pm_y, pm_buf,
+                      pm_ds, pm_nom, pm_d1, pm_d2):
+    """
+    Phasemap terms of all sources for the current positions (fit_phasemaps),
+    written into pm_ds, pm_nom, pm_d1 & pm_d2 (nsource+1, nbl, nwave)
+    pm_geometry: northangle, dra, ddec & map center (x, y) of the
+                 telescopes
+    tel1, tel2: telescopes of the evaluated baselines
+    """
+    if nsource == 0:
+        th_rest = 0
+    else:
+        th_rest = nsource*3-1
+    nx = amp_map.shape[2]
+    ny = amp_map.shape[3]
+    for ndx in range(nsource+1):
+        ra = full[th_rest+2]
+        dec = full[th_rest+3]
+        if ndx == 1:
+            ra += full[0]
+            dec += full[1]
+        elif ndx > 1:
+            ra += full[ndx*3-4]
+            dec += full[ndx*3-3]
+        for tel in range(4):
+            pos_ra = ra + pm_geometry[1, tel]
+            pos_dec = dec + pm_geometry[2, tel]
+            cos = np.cos(pm_geometry[0, tel])
+            sin = np.sin(pm_geometry[0, tel])
+            pm_x[0, tel] = -sin*pos_ra + cos*pos_dec + pm_geometry[3, tel]
+            pm_y[0, tel] = cos*pos_ra + sin*pos_dec + pm_geometry[4, tel]
+            if (not (0 <= pm_x[0, tel] <= nx-1)
+                    or not (0 <= pm_y[0, tel] <= ny-1)):
+                raise ValueError('Position outside of the phasemaps')
+        _sample_phasemaps(amp_map, pha_map, denom_map, pm_x, pm_y, chan,
+                          pm_buf)
+        for row in range(tel1.shape[0]):
+            t1 = tel1[row]
+            t2 = tel2[row]
+            for wdx in range(wave.shape[0]):
+                pm_ds[ndx, row, wdx] = ((pm_buf[0, 1, t1, wdx]
+                                         - pm_buf[0, 1, t2, wdx])
+                                        / 360*wave[wdx])
+                pm_nom[ndx, row, wdx] = (pm_buf[0, 0, t1, wdx]
+                                         * pm_buf[0, 0, t2, wdx])
+                pm_d1[ndx, row, wdx] = pm_buf[0, 2, t1, wdx]
+                pm_d2[ndx, row, wdx] = pm_buf[0, 2, t2, wdx]
+
+
+@njit(cache=True)
+def _center_point(alpha, lambda0, dlambda, mode, lt, qw):
+    """
+    Modulated interferometric intensity of one channel at zero separation
+    mode: 0 approx, 1 analytic, 2 numeric
+    lt, qw: log(t/2.2) and weights of the numeric integration
+    """
+    if mode == 0:
+        return (lambda0/2.2)**(-1-alpha)*2*dlambda + 0j
+    elif mode == 1:
+        return _vis_int_analytic_point(0., alpha, lambda0+dlambda,
+                                       lambda0-dlambda)
+    if alpha != 0:
+        return (-2.2**(1 + alpha)/alpha*(lambda0+dlambda)**(-alpha)
+                + 2.2**(1 + alpha)/alpha*(lambda0-dlambda)**(-alpha)) + 0j
+    return np.sum(qw*np.exp(-lt)) + 0j
+
+
+@njit(cache=True)
+def _mstars_alphas(full, nsource, only_stars):
+    """
+    Power law index of SgrA*, stars and background
+    """
+    if nsource == 0:
+        th_rest = 0
+    else:
+        th_rest = nsource*3-1
+    alpha = np.array([full[th_rest], full[th_rest+6], full[th_rest+5]])
+    if only_stars:
+        alpha[0] = full[th_rest+6]
+    return alpha
+
+
+@njit(cache=True)
+def _mstars_centers(alpha, mode, wave, dlambda, quad_lt, quad_w, centers):
+    """
+    Zero separation normalisation of all baselines and channels
+    """
+    for b in range(dlambda.shape[0]):
+        for wdx in range(wave.shape[0]):
+            centers[b, wdx] = _center_point(alpha, wave[wdx], dlambda[b, wdx],
+                                            mode, quad_lt[b, wdx],
+                                            quad_w[b, wdx])
+
+
+@njit(cache=True)
+def _mstars_baseline(b, full, nsource, alphas, centers, mode, u, v, wave,
+                     dlambda, quad_lt, quad_it, quad_w,
+                     pm_ds, pm_nom, pm_d1, pm_d2, visamp, visphi):
+    """
+    Model visibility amplitude & phase (without self calibration)
+    of baseline b, written into visamp[b] and visphi[b]
+    alphas, centers: from _mstars_alphas & _mstars_centers
+    """
+    mas2rad = 1e-3 / 3600 / 180 * np.pi
+    if nsource == 0:
+        th_rest = 0
+    else:
+        th_rest = nsource*3-1
+    fluxRatioBG = full[th_rest+1]
+    pc_RA = full[th_rest+2]
+    pc_DEC = full[th_rest+3]
+    fr_BH = 10**(full[th_rest+4])
+    alpha_SgrA = alphas[0]
+    alpha_stars = alphas[1]
+
+    nsrc = nsource + 1
+    s_src = np.zeros(nsrc)
+    fr_src = np.ones(nsrc)
+    for ndx in range(nsrc):
+        if ndx == 0:
+            ra = pc_RA
+            dec = pc_DEC
+            fr_src[0] = fr_BH
+        elif ndx == 1:
+            ra = pc_RA + full[0]
+            dec = pc_DEC + full[1]
+        else:
+            ra = pc_RA + full[ndx*3-4]
+            dec = pc_DEC + full[ndx*3-3]
+            fr_src[ndx] = 10.**(full[ndx*3-2])
+        s_src[ndx] = (ra*u[b] + dec*v[b]) * mas2rad * 1e6
+
+    for wdx in range(wave.shape[0]):
+        lam = wave[wdx]
+        dl = dlambda[b, wdx]
+        lt = quad_lt[b, wdx]
+        it = quad_it[b, wdx]
+        qw = quad_w[b, wdx]
+        c_sgra = centers[0, b, wdx]
+        c_star = centers[1, b, wdx]
+        c_bg = centers[2, b, wdx]
+        if mode == 2:
+            # power law on the integration nodes, shared by all stars
+            w_sgra = qw*np.exp((-1-alpha_SgrA)*lt)
+            w_star = qw*np.exp((-1-alpha_stars)*lt)
+        nom = 0j
+        denom1 = fluxRatioBG*c_bg
+        denom2 = fluxRatioBG*c_bg
+        for ndx in range(nsrc):
+            if ndx == 0:
+                alpha = alpha_SgrA
+                center = c_sgra
+            else:
+                alpha = alpha_stars
+                center = c_star
+            s = s_src[ndx] - pm_ds[ndx, b, wdx]
+            if mode == 0:
+                x = np.pi*2*s*dl/lam**2.
+                if x == 0:
+                    sinc = 1.
+                else:
+                    sinc = np.sin(x)/x
+                ind_vis = center*sinc*np.exp(-2.j*np.pi*s/lam)
+            elif mode == 1:
+                ind_vis = _vis_int_analytic_point(s, alpha, lam+dl, lam-dl)
+            elif s == 0 and alpha != 0:
+                ind_vis = center
+            else:
+                if ndx == 0:
+                    w = w_sgra
+                else:
+                    w = w_star
+                re = 0.
+                im = 0.
+                for n in range(lt.shape[0]):
+                    ph = 2*np.pi*s*it[n]
+                    re += w[n]*np.cos(ph)
+                    im -= w[n]*np.sin(ph)
+                ind_vis = re + 1j*im
+            nom += fr_src[ndx]*pm_nom[ndx, b, wdx]*ind_vis
+            denom1 += fr_src[ndx]*pm_d1[ndx, b, wdx]*center
+            denom2 += fr_src[ndx]*pm_d2[ndx, b, wdx]*center
+        vis = nom / (np.sqrt(denom1)*np.sqrt(denom2))
+        visamp[b, wdx] = np.abs(vis)
+        visphi[b, wdx] = np.arctan2(vis.imag, vis.real)*180/np.pi
+
+
+@njit(cache=True)
+def _mstars_lnlike(full, nsource, bispec_ind, bl, visamp_m, visphi_m,
+                   visamp, visamp_w, vis2, vis2_w,
+                   closure, closure_w, visphi, visphi_w):
+    """
+    log likelihood of the model from _mstars_baseline, weights hold
+    fit_for, flags and the inverse variances
+    bl: baseline index of each evaluated row
+    """
+    if nsource == 0:
+        th_rest = 0
+    else:
+        th_rest = nsource*3-1
+    nwave = visamp_m.shape[1]
+    chi2 = 0.
+    for row in range(bl.shape[0]):
+        b = bl[row]
+        # self calibration of the phases
+        if b == 0:
+            cal = full[th_rest+13] - full[th_rest+14]
+        elif b == 1:
+            cal = full[th_rest+13] - full[th_rest+15]
+        elif b == 2:
+            cal = full[th_rest+13] - full[th_rest+16]
+        elif b == 3:
+            cal = full[th_rest+14] - full[th_rest+15]
+        elif b == 4:
+            cal = full[th_rest+14] - full[th_rest+16]
+        else:
+            cal = full[th_rest+15] - full[th_rest+16]
+        for wdx in range(nwave):
+            amp = visamp_m[row, wdx]*full[th_rest+7+b]
+            phi = visphi_m[row, wdx] + cal
+            if phi < -180:
+                phi += 360
+            elif phi > 180:
+                phi -= 360
+            chi2 += (amp - visamp[row, wdx])**2*visamp_w[row, wdx]
+            chi2 += (amp**2 - vis2[row, wdx])**2*vis2_w[row, wdx]
+            dphi = np.degrees(2*np.sin(np.radians(phi - visphi[row, wdx])/2))
+            chi2 += dphi**2*visphi_w[row, wdx]
+    for c in range(bispec_ind.shape[0]):
+        for wdx in range(nwave):
+            clo = (visphi_m[bispec_ind[c, 0], wdx]
+                   + visphi_m[bispec_ind[c, 1], wdx]
+                   - visphi_m[bispec_ind[c, 2], wdx])
+            if clo < -180:
+                clo += 360
+            elif clo > 180:
+                clo -= 360
+            dclo = np.degrees(2*np.sin(np.radians(clo - closure[c, wdx])/2))
+            chi2 += dclo**2*closure_w[c, wdx]
+    return -0.5*chi2
+
+
+@njit(cache=True)
+def _mstars_buffers(template, nbl, nwave, fit_pm, pm_ds, pm_nom, pm_d1,
+                    pm_d2):
+    """
+    Work arrays of the compiled likelihood, reused for all parameter sets
     """
-    return (wave/2.2)**(-1-alpha)*np.exp(-2*np.pi*1j*s/wave)
-
-
-# @jit(nopython=True)
-def _vis_intensity_num(s, alpha, lambda0, dlambda):
+    full = template.copy()
+    visamp_m = np.zeros((nbl, nwave))
+    visphi_m = np.zeros((nbl, nwave))
+    # normalisations are only recomputed if the alphas change
+    centers = np.zeros((3, nbl, nwave), dtype=np.complex128)
+    last_alphas = np.full(3, np.nan)
+    if fit_pm:
+        # phasemap terms are refilled for each parameter set
+        pm_ds = pm_ds.copy()
+        pm_nom = pm_nom.copy()
+        pm_d1 = pm_d1.copy()
+        pm_d2 = pm_d2.copy()
+    pm_x = np.zeros((1, 4))
+    pm_y = np.zeros((1, 4))
+    pm_buf = np.zeros((1, 3, 4, nwave))
+    return (full, visamp_m, visphi_m, centers, last_alphas,
+            pm_ds, pm_nom, pm_d1, pm_d2, pm_x, pm_y, pm_buf)
+
+
+@njit(cache=True)
+def _mstars_walker(theta, lower, upper, free_pos, full, nsource,
+                   only_stars, mode, wave, dlambda, quad_lt, quad_w,
+                   fit_pm, amp_map, pha_map, denom_map, pm_geometry,
+                   tel1, tel2, chan, pm_x, pm_y, pm_buf,
+                   pm_ds, pm_nom, pm_d1, pm_d2, centers, last_alphas):
     """
-    Dull numeric solution for Modulated interferometric intensity
-    s:      B*skypos-opd1-opd2
-    alpha:  power law index
-    lambda0:zentral wavelength
-    dlambda:size of channels
+    Part of the compiled likelihood of one parameter set before the
+    baselines: fills full, the phasemap terms and the normalisations.
+    Returns False outside of the boundaries and the alphas
     """
-    if np.all(s == 0.) and alpha != 0:
-        return np.complex128(-2.2**(1 + alpha)/alpha*(lambda0+dlambda)**(-alpha) - (-2.2**(1 + alpha)/alpha*(lambda0-dlambda)**(-alpha)))
-    else:
-        return complex_quadrature_num(_visibility_integrator, lambda0-dlambda, lambda0+dlambda, (s, alpha))
-
-
-def _ind_visibility(s, alpha, wave, dlambda, fit_mode):
+    alphas = np.zeros(3)
+    if np.any(theta < lower) or np.any(theta > upper):
+        return False, alphas
+    for idx in range(free_pos.shape[0]):
+        full[free_pos[idx]] = theta[idx]
+    alphas = _mstars_alphas(full, nsource, only_stars)
+    if fit_pm:
+        _mstars_phasemaps(full, nsource, wave, amp_map, pha_map,
+                          denom_map, pm_geometry, tel1, tel2, chan,
+                          pm_x, pm_y, pm_buf, pm_ds, pm_nom, pm_d1, pm_d2)
+    for adx in range(3):
+        if alphas[adx] != last_alphas[adx]:
+            _mstars_centers(alphas[adx], mode, wave, dlambda,
+                            quad_lt, quad_w, centers[adx])
+            last_alphas[adx] = alphas[adx]
+    return True, alphas
+
+
+@njit(cache=True)
+def _lnprob_mstars_numba_kernel(thetas, lower, upper, free_pos, template,
+                                nsource, only_stars, mode, u, v, wave,
+                                dlambda, quad_lt, quad_it, quad_w, pm_ds,
+                                pm_nom, pm_d1, pm_d2, bispec_ind, bl,
+                                visamp, visamp_w, vis2, vis2_w,
+                                closure, closure_w, visphi, visphi_w,
+                                fit_pm, amp_map, pha_map, denom_map,
+                                pm_geometry, tel1, tel2, chan):
     """
-    Selectd the correct visibility calculation based on fit_mode
+    Compiled version of _lnprob_mstars for a batch of parameter sets,
+    arguments from _pack_mstars
     """
-    if fit_mode == "approx":
-        ind_vis = _vis_intensity_approx(s, alpha, wave, dlambda)
-    elif fit_mode == "analytic":
-        ind_vis = _vis_intensity(s, alpha, wave, dlambda)
-    elif fit_mode == "numeric":
-        ind_vis = _vis_intensity_num(s, alpha, wave, dlambda)
+    lnprob = np.full(thetas.shape[0], -np.inf)
+    nbl = bl.shape[0]
+    (full, visamp_m, visphi_m, centers, last_alphas, pm_ds, pm_nom, pm_d1,
+     pm_d2, pm_x, pm_y, pm_buf) = _mstars_buffers(template, nbl,
+                                                  wave.shape[0], fit_pm,
+                                                  pm_ds, pm_nom, pm_d1, pm_d2)
+    for tdx in range(thetas.shape[0]):
+        inside, alphas = _mstars_walker(
+            thetas[tdx], lower, upper, free_pos, full, nsource, only_stars,
+            mode, wave, dlambda, quad_lt, quad_w, fit_pm, amp_map, pha_map,
+            denom_map, pm_geometry, tel1, tel2, chan, pm_x, pm_y, pm_buf,
+            pm_ds, pm_nom, pm_d1, pm_d2, centers, last_alphas)
+        if not inside:
+            continue
+        for b in range(nbl):
+            _mstars_baseline(b, full, nsource, alphas, centers, mode, u, v, wave,
+                             dlambda, quad_lt, quad_it, quad_w,
+                             pm_ds, pm_nom, pm_d1, pm_d2,
+                             visamp_m, visphi_m)
+        lnprob[tdx] = _mstars_lnlike(full, nsource, bispec_ind, bl,
+                                     visamp_m, visphi_m,
+                                     visamp, visamp_w, vis2, vis2_w,
+                                     closure, closure_w, visphi, visphi_w)
+    return lnprob
+
+
+@njit(cache=True, parallel=True)
+def _lnprob_mstars_numba_parallel(thetas, lower, upper, free_pos, template,
+                                  nsource, only_stars, mode, u, v, wave,
+                                  dlambda, quad_lt, quad_it, quad_w, pm_ds,
+                                  pm_nom, pm_d1, pm_d2, bispec_ind, bl,
+                                  visamp, visamp_w, vis2, vis2_w,
+                                  closure, closure_w, visphi, visphi_w,
+                                  fit_pm, amp_map, pha_map, denom_map,
+                                  pm_geometry, tel1, tel2, chan):
+    """
+    _lnprob_mstars_numba_kernel with the baselines evaluated in parallel
+    """
+    lnprob = np.full(thetas.shape[0], -np.inf)
+    nbl = bl.shape[0]
+    (full, visamp_m, visphi_m, centers, last_alphas, pm_ds, pm_nom, pm_d1,
+     pm_d2, pm_x, pm_y, pm_buf) = _mstars_buffers(template, nbl,
+                                                  wave.shape[0], fit_pm,
+                                                  pm_ds, pm_nom, pm_d1, pm_d2)
+    for tdx in range(thetas.shape[0]):
+        inside, alphas = _mstars_walker(
+            thetas[tdx], lower, upper, free_pos, full, nsource, only_stars,
+            mode, wave, dlambda, quad_lt, quad_w, fit_pm, amp_map, pha_map,
+            denom_map, pm_geometry, tel1, tel2, chan, pm_x, pm_y, pm_buf,
+            pm_ds, pm_nom, pm_d1, pm_d2, centers, last_alphas)
+        if not inside:
+            continue
+        for b in prange(nbl):
+            _mstars_baseline(b, full, nsource, alphas, centers, mode, u, v, wave,
+                             dlambda, quad_lt, quad_it, quad_w,
+                             pm_ds, pm_nom, pm_d1, pm_d2,
+                             visamp_m, visphi_m)
+        lnprob[tdx] = _mstars_lnlike(full, nsource, bispec_ind, bl,
+                                     visamp_m, visphi_m,
+                                     visamp, visamp_w, vis2, vis2_w,
+                                     closure, closure_w, visphi, visphi_w)
+    return lnprob
+
+
+def _lnprob_mstars_numba(thetas, lower, upper, pack, parallel=False):
+    """
+    Log probability from the compiled likelihood for one parameter set
+    or a batch of them (emcee with vectorize=True)
+    pack: arguments from _pack_mstars
+    """
+    thetas = np.asarray(thetas, dtype=float)
+    lower = np.asarray(lower, dtype=float)
+    upper = np.asarray(upper, dtype=float)
+    if parallel:
+        kernel = _lnprob_mstars_numba_parallel
     else:
-        print(fit_mode)
-        raise ValueError('fitmode has to be approx, analytic or numeric')
-    return ind_vis
-
-
-def _lnprob_mstars(theta, fitdata, lower, upper, fitarg, fithelp):
-    if np.any(theta < lower) or np.any(theta > upper):
-        return -np.inf
-    return _lnlike_mstars(theta, fitdata, fitarg, fithelp, loglike=True)
+        kernel = _lnprob_mstars_numba_kernel
+    if thetas.ndim == 1:
+        return kernel(thetas[np.newaxis], lower, upper, *pack)[0]
+    return kernel(thetas, lower, upper, *pack)
 
 
 def _leastsq_mstars(params, theta1, theta2, fitdata, fitarg, fithelp):
@@ -816,32 +3248,28 @@ def _leastsq_mstars(params, theta1, theta2, fitdata, fitarg, fithelp):
 def _lnlike_mstars(theta, fitdata, fitarg, fithelp, loglike=False):
     (nsource, fit_for, bispec_ind, fit_mode, wave, dlambda,
      todel, fixed, phasemaps, northA, dra, ddec,
-     amp_map_int, pha_map_int, amp_map_denom_int,
+     pm_sampler, _, _,
      fit_phasemaps, fix_pm_sources,
-     only_stars) = fithelp
+     only_stars, smearing_table, channel_quadrature) = fithelp
 
     for ddx in range(len(todel)):
         theta = np.insert(theta, todel[ddx], fixed[ddx])
 
-    model_visamp, model_visphi, model_closure = _calc_vis_mstars(theta, fitarg,
-                                                                 fithelp)
+    fitdata = _prepare_fitdata(fitdata, bispec_ind)
+    model_visamp, model_visphi, model_closure = _calc_vis_mstars(
+        theta, fitarg, fithelp, compact=fitdata)
     model_vis2 = model_visamp**2.
 
-    (visamp, visamp_error, visamp_flag,
-        vis2, vis2_error, vis2_flag,
-        closure, closure_error, closure_flag,
-        visphi, visphi_error, visphi_flag) = fitdata
-
-    res_visamp = np.sum((model_visamp-visamp)**2/visamp_error**2*(1-visamp_flag))
-    res_vis2 = np.sum((model_vis2-vis2)**2./vis2_error**2.*(1-vis2_flag))
+    res_visamp = np.sum((model_visamp-fitdata.visamp)**2*fitdata.visamp_w)
+    res_vis2 = np.sum((model_vis2-fitdata.vis2)**2.*fitdata.vis2_w)
 
     res_closure = np.degrees(np.abs(np.exp(1j*np.radians(model_closure))
-                                    - np.exp(1j*np.radians(closure))))
-    res_clos = np.sum(res_closure**2./closure_error**2.*(1-closure_flag))
+                                    - fitdata.closure_phasor))
+    res_clos = np.sum(res_closure**2.*fitdata.closure_w)
 
     res_visphi = np.degrees(np.abs(np.exp(1j*np.radians(model_visphi))
-                                   - np.exp(1j*np.radians(visphi))))
-    res_phi = np.sum(res_visphi**2./visphi_error**2.*(1-visphi_flag))
+                                   - fitdata.visphi_phasor))
+    res_phi = np.sum(res_visphi**2.*fitdata.visphi_w)
 
     if loglike:
         ln_prob_res = -0.5 * (res_visamp * fit_for[0]
@@ -857,17 +3285,184 @@ def _lnlike_mstars(theta, fitdata, fitarg, fithelp, loglike=False):
         return least_sqr
 
 
-def _calc_vis_mstars(theta, fitarg, fithelp):
+def _calc_vis_mstars(theta, fitarg, fithelp, compact=None):
+    """
+    Calculates the complex visibility of several point sources
+    Single parameter set version of _calc_vis_mstars_batch
+    """
+    visamp, visphi, closure = _calc_vis_mstars_batch(
+        np.asarray(theta, dtype=float)[np.newaxis], fitarg, fithelp,
+        compact=compact)
+    return visamp[0], visphi[0], closure[0]
+
+
+def _calc_vis_mstars_batch(thetas, fitarg, fithelp, compact=None):
+    """
+    Calculates the complex visibility of several point sources
+    for many parameter sets (e.g. all walkers) at once
+    thetas: (nbatch, ntheta) full parameter sets
+    All sources, baselines and channels are evaluated on arrays of shape
+    (nbatch, nsource+1, nbl, nwave), the first source is the central source
+    compact: optional PreparedData, if given the model is only evaluated
+             on its used baselines (bl), channels (chan) and closure
+             triangles (tri) and the output is compacted accordingly
+    """
+    mas2rad = 1e-3 / 3600 / 180 * np.pi
+
+    (nsource, _, bispec_ind, fit_mode, wave, dlambda,
+     _, _, phasemaps, northA, dra, ddec,
+     pm_sampler, _, _,
+     fit_phasemaps, fix_pm_sources,
+     only_stars, smearing_table, channel_quadrature) = fithelp
+
+    thetas = np.atleast_2d(np.asarray(thetas, dtype=float))
+    nbatch = thetas.shape[0]
+    u = np.asarray(fitarg[0])
+    v = np.asarray(fitarg[1])
+    wave = np.asarray(wave)
+    dlambda = np.asarray(dlambda)
+    bispec_ind = np.asarray(bispec_ind)
+    if compact is None:
+        bl = np.arange(len(u))
+        chan = np.arange(len(wave))
+        tri = np.arange(len(bispec_ind))
+    else:
+        bl, chan, tri = compact.bl, compact.chan_index, compact.tri
+    u = u[bl]
+    v = v[bl]
+    wave = wave[chan]
+    dlambda = dlambda[np.ix_(bl, chan)]
+    nbl = len(bl)
+    nwave = len(wave)
+    nsrc = nsource + 1
+    # closure triangles in terms of the evaluated baselines
+    bl_pos = np.zeros(6, dtype=int)
+    bl_pos[bl] = np.arange(nbl)
+    bispec_ind = bl_pos[bispec_ind[tri]]
+
+    if nsource == 0:
+        th_rest = 0
+    else:
+        th_rest = nsource*3-1
+    alpha_SgrA = thetas[:, th_rest]
+    fluxRatioBG = thetas[:, th_rest+1]
+    pc_RA = thetas[:, th_rest+2]
+    pc_DEC = thetas[:, th_rest+3]
+    fr_BH = 10**(thetas[:, th_rest+4])
+    alpha_bg = thetas[:, th_rest+5]
+    alpha_stars = thetas[:, th_rest+6]
+
+    if only_stars:
+        alpha_SgrA = thetas[:, th_rest+6]
+
+    # position, flux ratio and power law of all sources
+    src_ra = np.repeat(pc_RA[:, np.newaxis], nsrc, axis=1)
+    src_dec = np.repeat(pc_DEC[:, np.newaxis], nsrc, axis=1)
+    src_fr = np.ones((nbatch, nsrc))
+    src_fr[:, 0] = fr_BH
+    for ndx in range(nsource):
+        if ndx == 0:
+            src_ra[:, 1] += thetas[:, 0]
+            src_dec[:, 1] += thetas[:, 1]
+        else:
+            src_ra[:, ndx+1] += thetas[:, ndx*3-1]
+            src_dec[:, ndx+1] += thetas[:, ndx*3]
+            src_fr[:, ndx+1] = 10.**(thetas[:, ndx*3+1])
+    src_alpha = np.repeat(alpha_stars[:, np.newaxis], nsrc, axis=1)
+    src_alpha[:, 0] = alpha_SgrA
+
+    s_src = ((src_ra[:, :, np.newaxis]*u + src_dec[:, :, np.newaxis]*v)
+             * mas2rad * 1e6)
+    s_src = np.repeat(s_src[:, :, :, np.newaxis], nwave, axis=3)
+
+    if phasemaps:
+        if fit_phasemaps:
+            # all walkers & sources in one readout, only used channels
+            pm_sources = pm_sampler(src_ra.ravel(), src_dec.ravel(), northA,
+                                    dra, ddec, chan=chan)
+            pm_sources = pm_sources.reshape(nbatch, nsrc,
+                                            *pm_sources.shape[1:])
+            pm_sources = pm_sources[:, :, :, bl]
+        else:
+            pm_sources = np.array(fix_pm_sources[:nsrc])[np.newaxis]
+            pm_sources = pm_sources[:, :, :, bl][..., chan]
+        # (nbatch, nsource+1, [amp, pha, int], nbl, 2, nwave)
+        pm_amp = pm_sources[:, :, 0]
+        pm_pha = pm_sources[:, :, 1]
+        pm_int = pm_sources[:, :, 2]
+
+        s_src -= (pm_pha[:, :, :, 0] - pm_pha[:, :, :, 1])/360*wave
+        cr_nom = pm_amp[:, :, :, 0]*pm_amp[:, :, :, 1]
+        cr_denom1 = pm_int[:, :, :, 0]
+        cr_denom2 = pm_int[:, :, :, 1]
+    else:
+        cr_nom = 1
+        cr_denom1 = 1
+        cr_denom2 = 1
+
+    # batch and sources are flattened into one axis for the integrals
+    if smearing_table is not None:
+        int_src = smearing_table(s_src.reshape(-1, nbl, nwave),
+                                 src_alpha.ravel(), bl=bl, chan=chan)
+    elif channel_quadrature is not None:
+        int_src = channel_quadrature(s_src.reshape(-1, nbl, nwave),
+                                     src_alpha.ravel(), bl=bl, chan=chan)
+    else:
+        int_src = _ind_visibility_batch(s_src.reshape(-1, nbl, nwave),
+                                        src_alpha.ravel(), wave,
+                                        dlambda, fit_mode)
+    int_src = int_src.reshape(nbatch, nsrc, nbl, nwave)
+    # zero separation normalisation for SgrA*, stars and background
+    alpha_center = np.stack((alpha_SgrA, alpha_stars, alpha_bg), axis=1)
+    int_center = _flux_norm_cache(alpha_center.ravel(), wave,
+                                  dlambda, fit_mode)
+    int_center = int_center.reshape(nbatch, 3, nbl, nwave)
+    src_center = np.repeat(int_center[:, 1:2], nsrc, axis=1)
+    src_center[:, 0] = int_center[:, 0]
+
+    src_fr = src_fr[:, :, np.newaxis, np.newaxis]
+    bg = fluxRatioBG[:, np.newaxis, np.newaxis] * int_center[:, 2]
+    nom = np.sum(src_fr * cr_nom * int_src, axis=1)
+    denom1 = np.sum(src_fr * cr_denom1 * src_center, axis=1) + bg
+    denom2 = np.sum(src_fr * cr_denom2 * src_center, axis=1) + bg
+
+    vis = nom / (np.sqrt(denom1)*np.sqrt(denom2))
+
+    visamp = np.abs(vis)
+    visphi = np.angle(vis, deg=True)
+    closure = (visphi[:, bispec_ind[:, 0]]
+               + visphi[:, bispec_ind[:, 1]]
+               - visphi[:, bispec_ind[:, 2]])
+
+    # self_call
+    self_cal_arr = np.array([[1, 1, 1, 0, 0, 0],
+                            [-1, 0, 0, 1, 1, 0],
+                            [0, -1, 0, -1, 0, 1],
+                            [0, 0, -1, 0, -1, -1]])
+    visphi = visphi + np.dot(thetas[:, th_rest+13:th_rest+17],
+                             self_cal_arr[:, bl])[:, :, np.newaxis]
+    # coherence loss
+    visamp = visamp * thetas[:, th_rest+7+bl, np.newaxis]
+
+    visphi = visphi + 360.*(visphi < -180.) - 360.*(visphi > 180.)
+    closure = closure + 360.*(closure < -180.) - 360.*(closure > 180.)
+
+    return visamp, visphi, closure
+
+
+def _calc_vis_mstars_loop(theta, fitarg, fithelp):
     """
     Calculates the complex visibility of several point sources
+    Reference implementation looping over baselines and sources,
+    kept to validate and benchmark _calc_vis_mstars
     """
     mas2rad = 1e-3 / 3600 / 180 * np.pi
 
     (nsource, _, bispec_ind, fit_mode, wave, dlambda,
      _, _, phasemaps, northA, dra, ddec,
-     amp_map_int, pha_map_int, amp_map_denom_int,
+     pm_sampler, _, _,
      fit_phasemaps, fix_pm_sources,
-     only_stars) = fithelp
+     only_stars, smearing_table, channel_quadrature) = fithelp
 
     u = fitarg[0]
     v = fitarg[1]
@@ -891,29 +3486,23 @@ def _calc_vis_mstars(theta, fitarg, fithelp):
         if fit_phasemaps:
             pm_sources = []
             pm_amp_c, pm_pha_c, pm_int_c = _read_phasemaps(pc_RA, pc_DEC,
-                                                           northA, amp_map_int,
-                                                           pha_map_int,
-                                                           amp_map_denom_int,
-                                                           wave, dra, ddec)
+                                                           northA, pm_sampler,
+                                                           dra, ddec)
             pm_sources.append([pm_amp_c, pm_pha_c, pm_int_c])
             for ndx in range(nsource):
                 if ndx == 0:
                     pm_amp, pm_pha, pm_int = _read_phasemaps(pc_RA + theta[0],
                                                              pc_DEC + theta[1],
                                                              northA,
-                                                             amp_map_int,
-                                                             pha_map_int,
-                                                             amp_map_denom_int,
-                                                             wave, dra, ddec)
+                                                             pm_sampler,
+                                                             dra, ddec)
                     pm_sources.append([pm_amp, pm_pha, pm_int])
                 else:
                     pm_amp, pm_pha, pm_int = _read_phasemaps(pc_RA + theta[ndx*3-1],
                                                              pc_DEC + theta[ndx*3],
                                                              northA,
-                                                             amp_map_int,
-                                                             pha_map_int,
-                                                             amp_map_denom_int,
-                                                             wave, dra, ddec)
+                                                             pm_sampler,
+                                                             dra, ddec)
                     pm_sources.append([pm_amp, pm_pha, pm_int])
         else:
             pm_sources = fix_pm_sources
@@ -993,9 +3582,9 @@ def _calc_vis_mstars(theta, fitarg, fithelp):
                     denom1 += (int_star_center)
                     denom2 += (int_star_center)
                 else:
-                    nom += (10.**(theta[ndx*3+2]) * int_star)
-                    denom1 += (10.**(theta[ndx*3+2]) * int_star_center)
-                    denom2 += (10.**(theta[ndx*3+2]) * int_star_center)
+                    nom += (10.**(theta[ndx*3+1]) * int_star)
+                    denom1 += (10.**(theta[ndx*3+1]) * int_star_center)
+                    denom2 += (10.**(theta[ndx*3+1]) * int_star_center)
 
         intBG = _ind_visibility(0, alpha_bg, wave, dlambda[i, :], fit_mode)
         denom1 += (fluxRatioBG * intBG)
@@ -1031,15 +3620,18 @@ def _calc_vis_mstars(theta, fitarg, fithelp):
 
 
 class GravMFit(GravData, GravPhaseMaps):
-    def __init__(self, data, loglevel='INFO', ignore_tel=[]):
+    def __init__(self, data, loglevel='INFO', ignore_tel=[], pool=None):
         """
         GravMFit: Class to fit a multiple point source model to GRAVITY data
 
         Main functions:
         fit_stars : the function to do the fit
         plot_fit : plot the data and the fitted model
+
+        pool: SamplerPool used by all fits of the object [None]
         """
         super().__init__(data, loglevel=loglevel)
+        self.pool = pool
         self.get_int_data(ignore_tel=ignore_tel)
         log_level = log_level_mapping.get(loglevel, logging.INFO)
         self.logger = logging.getLogger(__name__)
@@ -1202,6 +3794,200 @@ class GravMFit(GravData, GravPhaseMaps):
                                                           self.northangle, self.dra, self.ddec)
             self.pm_sources.append([pm_amp, pm_pha, pm_int])
 
+    def coupling_table(self, sampler, boxes, cache_dir=None):
+        """
+        Coupling table of this file: the parts of the phasemaps, which
+        the sources can reach within the fit boundaries. North angle and
+        fiber offsets are fixed for a file, so the table is built once
+        and used for all polarisations and DITs, the values are the same
+        as from the full maps.
+
+        sampler:   PhasemapSampler of the full maps
+        boxes:     (nbox, 4) ra_min, ra_max, dec_min, dec_max [mas]
+        cache_dir: if given, the table is saved there and loaded
+                   instead of cropped in the next fit of the file
+        """
+        boxes = np.asarray(boxes, dtype=float)
+        geometry = {'file': self.filename, 'tel': self.tel,
+                    'resolution': self.resolution,
+                    'smoothkernel': self.smoothkernel,
+                    'datayear': self.datayear,
+                    'wave': PhasemapStore.wave_hash(self.wlSC),
+                    'northangle': np.round(self.northangle, 9).tolist(),
+                    'dra': np.round(self.dra, 6).tolist(),
+                    'ddec': np.round(self.ddec, 6).tolist(),
+                    'boxes': np.round(boxes, 6).tolist()}
+        key = ('Coupling_%s_%s'
+               % (self.filename[:-5],
+                  hashlib.sha1(json.dumps(geometry).encode())
+                  .hexdigest()[:12]))
+        if cache_dir is not None:
+            store = PhasemapStore(cache_dir, loglevel=self.loglevel)
+            if store.ready(key):
+                self.logger.debug('Load coupling table %s' % key)
+                table = store.load(key, mmap_mode='r')
+                return PhasemapSampler(table['amp'], table['pha'],
+                                       table['denom'],
+                                       center=table['center'])
+
+        # corners of the boxes, the map coordinates are linear in ra, dec
+        ra = boxes[:, [0, 1, 0, 1]].ravel()
+        dec = boxes[:, [2, 2, 3, 3]].ravel()
+        x, y = sampler.positions(ra, dec, self.northangle, self.dra,
+                                 self.ddec)
+        try:
+            table = sampler.crop(x, y)
+        except ValueError:
+            self.logger.error('Fit boundaries are outside of the phasemaps')
+            raise ValueError('Fit boundaries are outside of the phasemaps')
+        self.logger.debug('Coupling table with %i x %i pixels'
+                          % table.shape)
+        if cache_dir is not None:
+            try:
+                store.save(key, {'amp': table.maps[0], 'pha': table.maps[1],
+                                 'denom': table.maps[2],
+                                 'center': table.center}, **geometry)
+            except OSError as e:
+                self.logger.warning('Could not save coupling table in %s: %s'
+                                    % (cache_dir, e))
+        return table
+
+    def chi2_map(self, ra_list, de_list, fr_list, initial=None, search=None,
+                 size=20, step=0.5, nseeds=3, min_sep=2, nthreads=1,
+                 plot=False, **kwargs):
+        """
+        chi2 maps of the companion positions, to find start values for
+        fit_stars when the orbit predictions of prep_fit are off or an
+        unknown source is present.
+        For each searched companion its position is set on a grid around
+        the initial one, all other parameters stay at their initial
+        values, or the best position of the companions mapped before.
+        The model is evaluated for all grid cells at once (in chunks,
+        split between the cores) and summed over the polarisations
+        (last DIT).
+
+        ra_list, de_list, fr_list, initial: as for fit_stars
+        search:   indices of the companions to map [all]
+        size:     half width of the grid around the initial position [20 mas]
+        step:     grid spacing [0.5 mas]
+        nseeds:   number of minima returned for each map [3], minima on
+                  the edge of the map are only used if there are no others
+        min_sep:  minimum separation of the minima [2 mas]
+        nthreads: number of cores [1]
+        plot:     plot the maps and their minima [False]
+        kwargs:   pool (see fit_stars) and further arguments of
+                  fit_stars, e.g. phasemaps or fit_mode, which is approx
+                  here by default, precise enough to locate the minima.
+                  The phasemaps are read at each grid position
+                  (fit_phasemaps=True by default), fixed phasemaps are
+                  only valid close to the initial positions
+
+        Returns ra_list and de_list with the searched companions at their
+        best minimum (start values for fit_stars) and a list of the maps:
+        dicts with the companion index, the ra and dec of the grid,
+        chi2 (ndec, nra) and the seeds (nseeds, [ra, dec, chi2])
+        """
+        pool = kwargs.pop('pool', self.pool)
+        # all positions have to be free, the map sets them
+        kwargs.pop('fit_pos', None)
+        kwargs.setdefault('fit_mode', 'approx')
+        kwargs.setdefault('fit_phasemaps', True)
+        if (kwargs.get('phasemaps', True) and not kwargs['fit_phasemaps']
+                and size > 5):
+            self.logger.warning('Fixed phasemaps are read at the initial '
+                                'positions, the map is only valid close '
+                                'to them (size < 5 mas)')
+        self.fit_stars(ra_list, de_list, fr_list, initial=initial,
+                       no_fit=True, plot_science=False, **kwargs)
+        theta_names = list(self.theta_names)
+        ncomp = len(ra_list)
+        if search is None:
+            search = range(ncomp)
+        offsets = np.arange(-size, size + step/2, step)
+        footprint = 2*int(np.ceil(min_sep / step)) + 1
+
+        own_pool = pool is None and nthreads > 1
+        if own_pool:
+            pool = SamplerPool(nthreads)
+        ra_list = list(ra_list)
+        de_list = list(de_list)
+        thetas_in = [np.array(data[0], dtype=float) for data in self.plotdata]
+        maps = []
+        try:
+            for comp in search:
+                if comp < 0 or comp >= ncomp:
+                    self.logger.error(f'No companion {comp} to search for')
+                    raise ValueError(f'No companion {comp} to search for')
+                ira = theta_names.index('dRA%i' % (comp + 1))
+                idec = theta_names.index('dDEC%i' % (comp + 1))
+                ra = ra_list[comp] + offsets
+                dec = de_list[comp] + offsets
+                grid_ra, grid_dec = np.meshgrid(ra, dec)
+                start_time = time.time()
+                chi2 = np.zeros(grid_ra.size)
+                for theta, (_, fitdata, fitarg, fithelp) in zip(thetas_in,
+                                                               self.plotdata):
+                    thetas = np.tile(theta, (grid_ra.size, 1))
+                    thetas[:, ira] = grid_ra.ravel()
+                    thetas[:, idec] = grid_dec.ravel()
+                    nchunks = max(len(thetas) // 2048, 1)
+                    if pool is None:
+                        lnlike = [_lnlike_mstars_grid(chunk, fitdata, fitarg,
+                                                      fithelp)
+                                  for chunk in np.array_split(thetas,
+                                                              nchunks)]
+                    else:
+                        nchunks = max(nchunks, pool.processes)
+                        pool.set_args(fitdata, fitarg, fithelp)
+                        lnlike = pool.map(pool.task(_lnlike_mstars_grid),
+                                          np.array_split(thetas, nchunks))
+                    chi2 -= 2*np.concatenate(lnlike)
+                chi2 = np.where(np.isfinite(chi2), chi2, np.inf)
+                chi2 = chi2.reshape(grid_ra.shape)
+                self.logger.debug('chi2 map of %i cells in %.2f s'
+                                  % (chi2.size, time.time() - start_time))
+
+                # local minima, best first
+                minima, at_edge = _map_minima(chi2, footprint)
+                if at_edge:
+                    self.logger.warning('Companion %i: chi2 is lowest at the '
+                                        'edge of the map, increase size'
+                                        % (comp + 1))
+                order = np.argsort(chi2[minima])[:nseeds]
+                seeds = np.array([grid_ra[minima][order],
+                                  grid_dec[minima][order],
+                                  chi2[minima][order]]).T
+                ra_list[comp], de_list[comp] = seeds[0, :2]
+                for theta in thetas_in:
+                    theta[[ira, idec]] = seeds[0, :2]
+                self.logger.info('Companion %i: best chi2 %.1f at '
+                                 '%.2f, %.2f mas'
+                                 % (comp + 1, seeds[0, 2], *seeds[0, :2]))
+                maps.append({'companion': comp, 'ra': ra, 'dec': dec,
+                             'chi2': chi2, 'seeds': seeds})
+        finally:
+            if own_pool:
+                pool.close()
+
+        if plot:
+            fig, axes = plt.subplots(1, len(maps), squeeze=False,
+                                     figsize=(4.5*len(maps), 4))
+            for ax, _map in zip(axes[0], maps):
+                im = ax.pcolormesh(_map['ra'], _map['dec'],
+                                   _map['chi2'] - _map['seeds'][0, 2],
+                                   shading='auto', cmap='viridis_r')
+                ax.plot(_map['seeds'][:, 0], _map['seeds'][:, 1], 'x',
+                        color=color1)
+                ax.set_xlim(_map['ra'][-1], _map['ra'][0])
+                ax.set_aspect('equal')
+                ax.set_title('Companion %i' % (_map['companion'] + 1))
+                ax.set_xlabel('dRa [mas]')
+                ax.set_ylabel('dDec [mas]')
+                fig.colorbar(im, ax=ax, label=r'$\Delta\chi^2$')
+            plt.show()
+        self.chi2_maps = maps
+        return ra_list, de_list, maps
+
     @timing
     def fit_stars(self,
                   ra_list,
@@ -1257,6 +4043,8 @@ class GravMFit(GravData, GravPhaseMaps):
                           analytic, onlyphases) [numeric]
         minimizer:        Minimizer for initial guess (emcee, leastsq) [emcee]
         minmethod:        Minimizer method for leastsq (all lmfit otpions) [lbfgsb]
+                          least_squares uses the residual vector and
+                          Jacobian of the model (trust region reflective)
         bestchi:          Gives best chi2 (for True) or mcmc res as output [True]
         redchi2:          Gives redchi2 instead of chi2 [True]
         flagtill:         Flag blue channels, default 3 for LOW, 30 for MED
@@ -1267,9 +4055,10 @@ class GravMFit(GravData, GravPhaseMaps):
                           initial guess [False]
         onlypol:          Only fits one polarization for split mode, 
                           either 0 or 1 [None]
-        save_result:      I/O of results. Saves results in dedicated
-                          Folder and loads them instead of fitting if
-                          available. Give prefix to filename [None]
+        save_result:      I/O of results. Saves results in the results
+                          store (./fitresults/fitresults.db, FitResultStore)
+                          and loads them instead of fitting if available.
+                          Give name of the results [None]
         save_mcmc:        I/O of MCMC results. Saves results in dedicated
                           Folder and gives prefix to filename [None]
         refit:            Refit the data even if save files exist [False]
@@ -1280,12 +4069,46 @@ class GravMFit(GravData, GravPhaseMaps):
         interppm:         Interpolate Phasemaps [True]
         pmdatayear:       Phasemaps year, 2019 or 2020 [2019]
         smoothkernel:     Size of smoothing kernel in mas [15]
+        phasemap_dir:     Directory of the phasemap store, see
+                          PhasemapStore for the default [None]
+        coupling_table:   With fit_phasemaps, only read the part of the
+                          phasemaps reachable within the fit boundaries,
+                          cached in the folder of the results [False]
         vis_flag:         Does flag vis > 1 if True [True]
         fixed_BG_alpha:   Fix background power law index [True]
         fixed_star_alpha: Fix star power law index [True]
         only_stars:       All sources have the same spectral index [False]
         pc_size:          Size of the fitting area for the central source [5]
         simulateGC:       Uses default GC values for some properties [False]
+        smearing_table:   Interpolate the bandwidth smearing from a table,
+                          which is computed once per file. Only for
+                          fit_mode numeric [False]
+        smearing_tol:     Accuracy bound of the smearing table [1e-4]
+        quad_nodes:       Gauss-Legendre nodes per channel for fit_mode
+                          numeric, 'auto' chooses the fewest nodes which
+                          reach quad_tol. None uses the trapezoidal rule
+                          on 100 points [None]
+        quad_tol:         Accuracy bound for quad_nodes='auto' [1e-6]
+        vectorize:        Evaluate all walkers of a MCMC step at once [True]
+        compiled:         Use the compiled likelihood for fixed phasemaps
+                          (with nthreads=1) [True]
+        numba_parallel:   Evaluate the baselines of the compiled likelihood
+                          in parallel [False]
+        parallel_fits:    Run the MCMC fits of the polarisations and DITs
+                          concurrently, the nthreads cores are split
+                          between the fits and their pools [False]
+        pool:             SamplerPool for the MCMC, replaces nthreads
+                          and parallel_fits [self.pool]
+        converge:         Stop the MCMC once converged (nruns is the
+                          maximum), burn-in and thinning from the
+                          autocorrelation time tau [False]
+        converge_ntau:    Chain length for convergence, in units of tau [50]
+        converge_tol:     Maximum relative change of tau between checks [0.01]
+        converge_every:   Steps between the convergence checks [100]
+        optimize:         Start the MCMC with a least-squares fit: the
+                          walkers start around its optimum, spread with
+                          its covariance, and the burn-in is sized from
+                          tau. Much shorter chains (nruns) suffice [False]
         '''
         fit_mode = kwargs.get('fit_mode', 'numeric')
         minimizer = kwargs.get('minimizer', 'emcee')
@@ -1307,12 +4130,27 @@ class GravMFit(GravData, GravPhaseMaps):
         fixed_star_alpha = kwargs.get('fixed_star_alpha', True)
         only_stars = kwargs.get('only_stars', False)
         pc_size = kwargs.get('pc_size', 5)
-        phasemaps = kwargs.get('phasemaps', True)
         fit_phasemaps = kwargs.get('fit_phasemaps', False)
         interppm = kwargs.get('interppm', True)
         self.datayear = kwargs.get('pmdatayear', 2019)
         self.smoothkernel = kwargs.get('smoothkernel', 15)
+        self.phasemap_dir = kwargs.get('phasemap_dir', None)
+        coupling_table = kwargs.get('coupling_table', False)
         simulateGC = kwargs.get('simulateGC', False)
+        use_smearing_table = kwargs.get('smearing_table', False)
+        smearing_tol = kwargs.get('smearing_tol', 1e-4)
+        quad_nodes = kwargs.get('quad_nodes', None)
+        quad_tol = kwargs.get('quad_tol', 1e-6)
+        vectorize = kwargs.get('vectorize', True)
+        compiled = kwargs.get('compiled', True)
+        numba_parallel = kwargs.get('numba_parallel', False)
+        parallel_fits = kwargs.get('parallel_fits', False)
+        pool = kwargs.get('pool', self.pool)
+        converge = kwargs.get('converge', False)
+        converge_ntau = kwargs.get('converge_ntau', 50)
+        converge_tol = kwargs.get('converge_tol', 0.01)
+        converge_every = kwargs.get('converge_every', 100)
+        optimize = kwargs.get('optimize', False)
 
         available_keys = ['fit_mode', 'minimizer', 'minmethod', 'bestchi',
                           'redchi2', 'flagtill', 'flagfrom', 'coh_loss',
@@ -1320,7 +4158,12 @@ class GravMFit(GravData, GravPhaseMaps):
                           'save_result', 'save_mcmc', 'refit', 'vis_flag',
                           'fixed_BG_alpha', 'fixed_star_alpha', 'only_stars',
                           'pc_size', 'phasemaps', 'fit_phasemaps', 'interppm',
-                          'pmdatayear', 'smoothkernel', 'simulateGC']
+                          'pmdatayear', 'smoothkernel', 'phasemap_dir',
+                          'coupling_table', 'simulateGC', 'smearing_table', 'smearing_tol', 'quad_nodes',
+                          'quad_tol', 'vectorize',
+                          'compiled', 'numba_parallel', 'parallel_fits',
+                          'pool', 'converge', 'converge_ntau',
+                          'converge_tol', 'converge_every', 'optimize']
 
         for kwarg in kwargs:
             if kwarg not in available_keys:
@@ -1397,6 +4240,7 @@ class GravMFit(GravData, GravPhaseMaps):
                 phasemaps.resolution = self.resolution
                 phasemaps.smoothkernel = self.smoothkernel
                 phasemaps.datayear = self.datayear
+                phasemaps.phasemap_dir = self.phasemap_dir
                 phasemaps.wlSC = self.wlSC
                 phasemaps.interppm = interppm
                 phasemaps.load_phasemaps(interp=interppm)
@@ -1627,8 +4471,64 @@ class GravMFit(GravData, GravPhaseMaps):
                                                                   pc_DEC_in + theta[ndx*3],
                                                                   self.northangle, self.dra, self.ddec)
                     self.pm_sources.append([pm_amp, pm_pha, pm_int])
-        
+
+        smearing_table = None
+        channel_quadrature = None
+        if use_smearing_table or quad_nodes is not None:
+            if fit_mode != 'numeric':
+                self.logger.warning('Smearing table and quad_nodes are only '
+                                    'used for fit_mode numeric')
+            else:
+                # largest separation reachable within the fit boundaries
+                mas2rad = 1e-3 / 3600 / 180 * np.pi
+                sep = [np.hypot(abs(pc_RA_in) + pc_size,
+                                abs(pc_DEC_in) + pc_size)]
+                for ndx in range(nsource):
+                    sep.append(np.hypot(abs(pc_RA_in + ra_list[ndx])
+                                        + fit_size[ndx] + pc_size,
+                                        abs(pc_DEC_in + de_list[ndx])
+                                        + fit_size[ndx] + pc_size))
+                s_max = (np.max(np.sqrt(u**2 + v**2)) * np.max(sep)
+                         * mas2rad * 1e6 + np.max(wave))
+                if use_smearing_table:
+                    if quad_nodes is not None:
+                        self.logger.warning('quad_nodes is not used together '
+                                            'with the smearing table')
+                    try:
+                        if not self.smearing_table.matches(wave, self.dlambda,
+                                                           s_max, smearing_tol):
+                            raise AttributeError
+                        self.logger.debug('Reuse existing smearing table')
+                    except AttributeError:
+                        self.logger.info('Create smearing table')
+                        self.smearing_table = SmearingTable(wave, self.dlambda,
+                                                            s_max,
+                                                            tol=smearing_tol,
+                                                            loglevel=self.loglevel)
+                    smearing_table = self.smearing_table
+                else:
+                    if quad_nodes == 'auto':
+                        quad_nodes = None
+                    self.channel_quadrature = ChannelQuadrature(
+                        wave, self.dlambda, nodes=quad_nodes, s_max=s_max,
+                        tol=quad_tol, loglevel=self.loglevel)
+                    channel_quadrature = self.channel_quadrature
+
         savefolder = './fitresults/'
+        if phasemaps and fit_phasemaps:
+            pm_sampler = phasemaps.phasemap_sampler
+            if coupling_table:
+                # fit boundaries of the central source & the stars
+                boxes = [[pc_RA_in - pc_size, pc_RA_in + pc_size,
+                          pc_DEC_in - pc_size, pc_DEC_in + pc_size]]
+                for ndx in range(nsource):
+                    size = fit_size[ndx] + pc_size
+                    boxes.append([pc_RA_in + ra_list[ndx] - size,
+                                  pc_RA_in + ra_list[ndx] + size,
+                                  pc_DEC_in + de_list[ndx] - size,
+                                  pc_DEC_in + de_list[ndx] + size])
+                pm_sampler = self.coupling_table(pm_sampler, boxes,
+                                                 f'{savefolder}coupling')
         if save_mcmc is not None:
             # check if save_mcmc is a string
             if type(save_mcmc) != str:
@@ -1640,6 +4540,18 @@ class GravMFit(GravData, GravPhaseMaps):
             if type(save_result) != str:
                 self.logger.error('save_result needs to be a string')
                 raise ValueError('save_result needs to be a string')
+            store = FitResultStore(f'{savefolder}fitresults.db',
+                                   loglevel=self.loglevel)
+            fit_config = dict(ra_list=ra_list, de_list=de_list,
+                              fr_list=fr_list, fit_size=fit_size,
+                              fit_pos=fit_pos, fit_fr=fit_fr,
+                              nwalkers=nwalkers, nruns=nruns, fit_for=fit_for,
+                              fixed_BH_alpha=fixed_BH_alpha,
+                              fixed_BG=fixed_BG, initial=initial,
+                              phasemaps=bool(phasemaps))
+            fit_config.update((key, value) for key, value in kwargs.items()
+                              if key not in _RUN_OPTIONS)
+            fit_config = store.config_hash(fit_config)
 
         if no_fit:
             save_result_exist = False
@@ -1654,7 +4566,6 @@ class GravMFit(GravData, GravPhaseMaps):
                 if not os.path.exists(savefolder):
                     self.logger.debug('Create folder %s' % savefolder)
                     os.makedirs(savefolder)
-                pdname = f'{savefolder}{save_result}_{self.filename[:-4]}pd'
         else:
             # check if results and mcmc results exist
             # if result exists do not fit the data
@@ -1664,17 +4575,28 @@ class GravMFit(GravData, GravPhaseMaps):
                     self.logger.debug('Create folder %s' % savefolder)
                     os.makedirs(savefolder)
                 pdname = f'{savefolder}{save_result}_{self.filename[:-4]}pd'
-                self.logger.debug(f'Look for results at {pdname}')
-                try:
+                self.logger.debug(f'Look for results in {store.path}')
+                saved = store.lookup(self.filename, save_result)
+                if saved is not None:
+                    fittab = store.load(self.filename, save_result)
+                    if saved['config'] != fit_config:
+                        self.logger.warning('Saved results are from a '
+                                            'different fit configuration, '
+                                            'use refit to fit again')
+                    self.logger.info(f'Results exist in {store.path}')
+                elif os.path.exists(pdname):
+                    # results saved by earlier versions
                     fittab = pd.read_pickle(pdname)
-                    fittab_res = fittab.iloc[:, :-1]
+                    self.logger.info(f'Results exist at {pdname}')
+                else:
+                    fittab = None
+                    self.logger.debug('Results do not exist')
+                if fittab is not None:
                     save_result_exist = True
                     no_fit = True
-                    self.logger.info(f'Results exist at {pdname}')
-                except FileNotFoundError:
+                else:
                     save_result_exist = False
                     no_fit = False
-                    self.logger.debug('Results do not exist')
             else:
                 save_result_exist = False
                 no_fit = False
@@ -1693,7 +4615,177 @@ class GravMFit(GravData, GravPhaseMaps):
         self.fixed = fixed
         self.todel = todel
 
-        # Get data
+        if self.polmode == 'SPLIT':
+            ndit = np.shape(self.visampSC_P1)[0]//6
+            if onlypol is not None:
+                polnom = [onlypol]
+            else:
+                polnom = [0, 1]
+        elif self.polmode == 'COMBINED':
+            ndit = np.shape(self.visampSC)[0]//6
+            polnom = [0]
+        if ndit > 1:
+            self.logger.info('NDIT = %i' % ndit)
+        if (flagtill > 0) and (flagfrom > 0) and not no_fit:
+            self.logger.info('using channels from #%i to #%i'
+                             % (flagtill, flagfrom))
+
+        subsets = list(itertools.product(range(ndit), polnom))
+        fitdata = {(dit, idx): self._subset_data(idx, dit, vis_flag,
+                                                 flagtill, flagfrom)
+                   for dit, idx in subsets}
+        fitarg = [u, v]
+        if phasemaps:
+            if fit_phasemaps:
+                fithelp = [self.nsource, self.fit_for, self.bispec_ind,
+                           self.fit_mode, self.wave, self.dlambda,
+                           todel, fixed,
+                           phasemaps, self.northangle, self.dra,
+                           self.ddec, pm_sampler,
+                           None, None,
+                           fit_phasemaps, None, only_stars,
+                           smearing_table, channel_quadrature]
+            else:
+                fithelp = [self.nsource, self.fit_for, self.bispec_ind,
+                           self.fit_mode, self.wave, self.dlambda,
+                           todel, fixed,
+                           phasemaps, self.northangle, self.dra,
+                           self.ddec, None, None, None,
+                           fit_phasemaps, self.pm_sources,
+                           only_stars, smearing_table,
+                           channel_quadrature]
+        else:
+            fithelp = [self.nsource, self.fit_for, self.bispec_ind,
+                       self.fit_mode, self.wave, self.dlambda,
+                       todel, fixed,
+                       phasemaps, None, None, None, None, None,
+                       None, None, None, only_stars,
+                       smearing_table, channel_quadrature]
+
+        fit_options = dict(nwalkers=nwalkers, nruns=nruns,
+                           onlyphases=onlyphases, minimizer=minimizer,
+                           minmethod=minmethod, optimize=optimize,
+                           converge=converge, converge_ntau=converge_ntau,
+                           converge_tol=converge_tol,
+                           converge_every=converge_every,
+                           vectorize=vectorize, compiled=compiled,
+                           numba_parallel=numba_parallel)
+        summary_options = dict(no_fit=no_fit, onlyphases=onlyphases,
+                               minimizer=minimizer, bestchi=bestchi,
+                               redchi2=redchi2, plot_corner=plot_corner,
+                               mcmcname=mcmcname if save_mcmc else None,
+                               nruns=nruns, converge=converge,
+                               optimize=optimize, converge_ntau=converge_ntau)
+
+        # the MCMC fits of all polarisations & DITs are independent: with
+        # parallel_fits they all run at once in worker processes
+        executor = None
+        if (parallel_fits and len(subsets) > 1 and nthreads > 1
+                and not no_fit and not onlyphases and minimizer == 'emcee'
+                and pool is None):
+            fit_workers = min(len(subsets), nthreads)
+            fit_threads = max(1, nthreads // fit_workers)
+            self.logger.info('Run %i fits concurrently, %i cores per fit'
+                             % (fit_workers, fit_threads))
+            # own random state per worker (forked ones share the parent's)
+            executor = concurrent.futures.ProcessPoolExecutor(
+                fit_workers, initializer=np.random.seed)
+        if not no_fit:
+            fittab = pd.DataFrame()
+        try:
+            if executor is not None:
+                subfits = {key: executor.submit(self._fit_subset,
+                                                fitdata[key], fitarg,
+                                                fithelp, theta, lower, upper,
+                                                theta_names,
+                                                nthreads=fit_threads,
+                                                **fit_options)
+                           for key in subsets}
+            for dit in range(ndit):
+                if not no_fit and ndit > 1:
+                    self.logger.info('')
+                    self.logger.info(f'Run MCMC for DIT {dit+1}')
+                plotdata = []
+                for idx in polnom:
+                    if no_fit:
+                        self.logger.info(f'Get results for Pol {idx+1}')
+                        if save_result_exist:
+                            fit = self._saved_fit(idx, dit, fittab, todel)
+                        else:
+                            fit = {'mostprop': theta, 'mostlike': theta}
+                    else:
+                        self.logger.info(f'Run Fit for Pol {idx+1}')
+                        if executor is None:
+                            fit = self._fit_subset(
+                                fitdata[dit, idx], fitarg, fithelp, theta,
+                                lower, upper, theta_names, nthreads=nthreads,
+                                pool=pool,
+                                progress=self.logger.level <= logging.INFO,
+                                **fit_options)
+                        else:
+                            fit = subfits.pop((dit, idx)).result()
+
+                    theta_result, _fittab, redchi = self._fit_summary(
+                        idx, dit, fit, fitdata[dit, idx], fitarg, fithelp,
+                        theta_names, ndof, **summary_options)
+                    if _fittab is not None:
+                        fittab = pd.concat([fittab, _fittab],
+                                           ignore_index=True)
+                        if not onlyphases:
+                            results.append(theta_result)
+                    if idx == 0:
+                        redchi0 = redchi
+                        self.redchi0 = redchi0
+                    elif idx == 1:
+                        redchi1 = redchi
+                        self.redchi1 = redchi1
+                    plotdata.append([theta_result, fitdata[dit, idx],
+                                     fitarg, fithelp])
+
+                if plot_science:
+                    self.plot_fit(plotdata)
+                self.plotdata = plotdata
+        finally:
+            # also stops the workers if a fit or the collection fails
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+        if not no_fit or save_result_exist:
+            self.fittab = fittab
+        if (save_result is not None and not save_result_exist
+                and not kwargs.get('no_fit', False)):
+            # results of the initial values (no_fit) are not saved
+            store.save(fittab, self.filename, save_result,
+                       date_obs=self.date_obs, mjd=self.mjd,
+                       target=self.header.get('ESO OBS TARG NAME',
+                                              self.header.get('OBJECT')),
+                       config=fit_config)
+        if create_pdf:
+            self.create_pdf()
+
+        chi2string = 'red. chi2' if redchi2 else 'chi2'
+        try:
+            fitted = 1-(np.array(self.fit_for) == 0)
+            redchi0_f = np.sum(redchi0*fitted)
+            if onlypol == 0:
+                redchi1 = np.zeros_like(redchi0)
+            redchi1_f = np.sum(redchi1*fitted)
+            redchi_f = redchi0_f + redchi1_f
+            self.logger.info(f'Combined {chi2string} of fitted data: {redchi_f:.3}')
+        except UnboundLocalError:
+            pass
+        except:
+            self.logger.error("could not compute reduced chi2")
+        if onlypol is not None and ndit == 1:
+            return theta_result
+        else:
+            return results
+
+    def _subset_data(self, idx, dit, vis_flag=True, flagtill=0, flagfrom=0):
+        """
+        Data of polarisation idx and DIT dit for fit_stars, with invalid
+        points and the channels outside flagtill - flagfrom flagged.
+        Returns the PreparedData of the fit
+        """
         if self.polmode == 'SPLIT':
             visamp_P = [self.visampSC_P1, self.visampSC_P2]
             visamp_error_P = [self.visamperrSC_P1, self.visamperrSC_P2]
@@ -1715,14 +4807,6 @@ class GravMFit(GravData, GravPhaseMaps):
             closamp_error_P = [self.t3amperrSC_P1, self.t3amperrSC_P2]
             closamp_flag_P = [self.t3ampflagSC_P1, self.t3ampflagSC_P2]
 
-            ndit = np.shape(self.visampSC_P1)[0]//6
-            if ndit > 1:
-                self.logger.info('NDIT = %i' % ndit)
-            if onlypol is not None:
-                polnom = [onlypol]
-            else:
-                polnom = [0, 1]
-
         elif self.polmode == 'COMBINED':
             visamp_P = [self.visampSC]
             visamp_error_P = [self.visamperrSC]
@@ -1744,501 +4828,532 @@ class GravMFit(GravData, GravPhaseMaps):
             closamp_error_P = [self.t3amperrSC]
             closamp_flag_P = [self.t3ampflagSC]
 
-            ndit = np.shape(self.visampSC)[0]//6
-            if ndit > 1:
-                self.logger.info('NDIT = %i' % ndit)
-            polnom = [0]
-
-        for dit in range(ndit):
-            if not no_fit:
-                if ndit > 1:
-                    self.logger.info('')
-                    self.logger.info(f'Run MCMC for DIT {dit+1}')
-            ditstart = dit*6
-            ditstop = ditstart + 6
-            t3ditstart = dit*4
-            t3ditstop = t3ditstart + 4
-
-            for idx in polnom:
-                visamp = visamp_P[idx][ditstart:ditstop]
-                visamp_error = visamp_error_P[idx][ditstart:ditstop]
-                visamp_flag = visamp_flag_P[idx][ditstart:ditstop]
-                vis2 = vis2_P[idx][ditstart:ditstop]
-                vis2_error = vis2_error_P[idx][ditstart:ditstop]
-                vis2_flag = vis2_flag_P[idx][ditstart:ditstop]
-                closure = closure_P[idx][t3ditstart:t3ditstop]
-                closure_error = closure_error_P[idx][t3ditstart:t3ditstop]
-                closure_flag = closure_flag_P[idx][t3ditstart:t3ditstop]
-                visphi = visphi_P[idx][ditstart:ditstop]
-                visphi_error = visphi_error_P[idx][ditstart:ditstop]
-                visphi_flag = visphi_flag_P[idx][ditstart:ditstop]
-                closamp = closamp_P[idx][t3ditstart:t3ditstop]
-                closamp_error = closamp_error_P[idx][t3ditstart:t3ditstop]
-                closamp_flag = closamp_flag_P[idx][t3ditstart:t3ditstop]
-
-                with np.errstate(invalid='ignore'):
-                    visamp_flag1 = (visamp > 1) | (visamp < 1.e-5)
-                if not vis_flag:
-                    visamp_flag1 = np.full_like(visamp_flag1, False)
-                visamp_flag2 = np.isnan(visamp)
-                visamp_flag_final = ((visamp_flag) | (visamp_flag1) | (visamp_flag2))
-                visamp_flag = visamp_flag_final
-                visamp = np.nan_to_num(visamp)
-                visamp_error[visamp_flag] = 1.
-                closamp = np.nan_to_num(closamp)
-                closamp_error[closamp_flag] = 1.
-
-                with np.errstate(invalid='ignore'):
-                    vis2_flag1 = (vis2 > 1) | (vis2 < 1.e-5)
-                if not vis_flag:
-                    vis2_flag1 = np.full_like(vis2_flag1, False)
-                vis2_flag2 = np.isnan(vis2)
-                vis2_flag_final = ((vis2_flag) | (vis2_flag1) | (vis2_flag2))
-                vis2_flag = vis2_flag_final
-                vis2 = np.nan_to_num(vis2)
-                vis2_error[vis2_flag] = 1.
-
-                closure = np.nan_to_num(closure)
-                visphi = np.nan_to_num(visphi)
-                visphi_flag[np.where(visphi_error == 0)] = True
-                visphi_error[np.where(visphi_error == 0)] = 100
-                closure_flag[np.where(closure_error == 0)] = True
-                closure_error[np.where(closure_error == 0)] = 100
-
-                if ((flagtill > 0) and (flagfrom > 0)):
-                    p = flagtill
-                    t = flagfrom
-                    if idx == 0 and dit == 0 and not no_fit:
-                        self.logger.info('using channels from #%i to #%i' % (p, t))
-                    visamp_flag[:, 0:p] = True
-                    vis2_flag[:, 0:p] = True
-                    visphi_flag[:, 0:p] = True
-                    closure_flag[:, 0:p] = True
-                    closamp_flag[:, 0:p] = True
-
-                    visamp_flag[:, t:] = True
-                    vis2_flag[:, t:] = True
-                    visphi_flag[:, t:] = True
-                    closure_flag[:, t:] = True
-                    closamp_flag[:, t:] = True
-
-                width = 1e-1
-                ndim = len(theta)
-                pos = np.ones((nwalkers, ndim))
-                for par in range(ndim):
-                    pos[:, par] = (theta[par]
-                                   + width*np.random.randn(nwalkers))
-
-                if no_fit:
-                    self.logger.info(f'Get results for Pol {idx+1}')
-                else:
-                    self.logger.info(f'Run Fit for Pol {idx+1}')
-
-                fitdata = [visamp, visamp_error, visamp_flag,
-                           vis2, vis2_error, vis2_flag,
-                           closure, closure_error, closure_flag,
-                           visphi, visphi_error, visphi_flag]
-                fitarg = [u, v]
-
-                if phasemaps:
-                    if fit_phasemaps:
-                        fithelp = [self.nsource, self.fit_for, self.bispec_ind,
-                                   self.fit_mode, self.wave, self.dlambda,
-                                   todel, fixed,
-                                   phasemaps, self.northangle, self.dra,
-                                   self.ddec, phasemaps.amp_map_int,
-                                   phasemaps.pha_map_int, 
-                                   phasemaps.amp_map_denom_int,
-                                   fit_phasemaps, None, only_stars]
-                    else:
-                        fithelp = [self.nsource, self.fit_for, self.bispec_ind,
-                                   self.fit_mode, self.wave, self.dlambda,
-                                   todel, fixed,
-                                   phasemaps, self.northangle, self.dra,
-                                   self.ddec, None, None, None,
-                                   fit_phasemaps, self.pm_sources,
-                                   only_stars]
-                else:
-                    fithelp = [self.nsource, self.fit_for, self.bispec_ind,
-                               self.fit_mode, self.wave, self.dlambda,
-                               todel, fixed,
-                               phasemaps, None, None, None, None, None,
-                               None, None, None, only_stars]
-
-                if not no_fit:
-                    level = self.logger.level
-                    if not onlyphases:
-                        if minimizer == 'emcee':
-                            if nthreads == 1:
-                                sampler = emcee.EnsembleSampler(nwalkers, ndim,
-                                                                _lnprob_mstars,
-                                                                args=(fitdata,
-                                                                    lower,
-                                                                    upper,
-                                                                    fitarg,
-                                                                    fithelp))
-                                if level > logging.INFO:
-                                    sampler.run_mcmc(pos, nruns, progress=False,
-                                                    skip_initial_state_check=True)
-                                else:
-                                    sampler.run_mcmc(pos, nruns, progress=True,
-                                                    skip_initial_state_check=True)
-                            else:
-                                with Pool(processes=nthreads) as pool:
-                                    sampler = emcee.EnsembleSampler(nwalkers, ndim,
-                                                                    _lnprob_mstars,
-                                                                    args=(fitdata,
-                                                                        lower,
-                                                                        upper,
-                                                                        fitarg,
-                                                                        fithelp),
-                                                                    pool=pool)
-                                    if level > logging.INFO:
-                                        sampler.run_mcmc(pos, nruns, progress=False,
-                                                        skip_initial_state_check=True)
-                                    else:
-                                        sampler.run_mcmc(pos, nruns, progress=True,
-                                                        skip_initial_state_check=True)
-
-                            ac_fraction = np.mean(sampler.acceptance_fraction)
-                            if ac_fraction < 0.25 or ac_fraction > 0.5:
-                                self.logger.warning(f'Mean acceptance fraction: {ac_fraction:.2}')
-                                self.logger.warning('Should be between 0.25 and 0.5')
-                            else:
-                                self.logger.info(f'Mean acceptance fraction: {ac_fraction:.2}')
-
-                            samples = sampler.chain
-                            if save_mcmc is not None:
-                                mcname = f'{mcmcname}_P{idx+1}'
-                                np.save(mcname, samples)
-                                np.savetxt(f'{mcname}.txt', theta_names, fmt='%s')
-
-                            mostprop = sampler.flatchain[np.argmax(sampler.flatlnprobability)]
-
-                            clsamples = samples
-                            cllabels = theta_names
-                            clmostprop = mostprop
-
-                            cldim = len(cllabels)
-                            if plot_corner in ['steps', 'both']:
-                                fig, axes = plt.subplots(cldim, figsize=(8, cldim/1.5),
-                                                        sharex=True)
-                                for i in range(cldim):
-                                    ax = axes[i]
-                                    ax.plot(clsamples[:, :, i].T, "k", alpha=0.3)
-                                    ax.set_ylabel(theta_names[i])
-                                    ax.axhline(clmostprop[i], color='C0', alpha=0.5)
-                                    ax.yaxis.set_label_coords(-0.1, 0.5)
-                                axes[-1].set_xlabel("step number")
-                                plt.show()
-
-                            if nruns > 300:
-                                fl_samples = samples[:, -200:, :].reshape((-1, ndim))
-                            elif nruns > 200:
-                                fl_samples = samples[:, -100:, :].reshape((-1, ndim))
-                            else:
-                                fl_samples = samples.reshape((-1, ndim))
-
-                            if plot_corner in ['corner', 'both']:
-                                fig = corner.corner(fl_samples,
-                                                    quantiles=[0.16, 0.5, 0.84],
-                                                    truths=mostprop,
-                                                    labels=theta_names)
-                                plt.show()
-
-                            # get the actual fit
-                            theta_fit = np.percentile(fl_samples, [50],
-                                                    axis=0).T.flatten()
-                            percentiles = np.percentile(fl_samples, [16, 50, 84],
-                                                        axis=0).T
-                            mostlike_m = percentiles[:, 1] - percentiles[:, 0]
-                            mostlike_p = percentiles[:, 2] - percentiles[:, 1]
-                            if bestchi:
-                                theta_result = mostprop
-                            else:
-                                theta_result = theta_fit
-
-                            results.append(theta_result)
-                            fulltheta = np.copy(theta_result)
-                            all_mostprop = np.copy(mostprop)
-                            all_mostlike = np.copy(theta_fit)
-
-                        elif minimizer == 'leastsq':
-                            params = Parameters()
-                            for tdx, th in enumerate(theta):
-                                params.add(theta_names[tdx], 
-                                           value=th,
-                                           min=lower[tdx],
-                                           max=upper[tdx])
-
-                            start_time = time.time()
-                            out = minimize(_lnlike_mstars, params,
-                                           args=(fitdata,
-                                                 fitarg, fithelp),
-                                           method=minmethod,
-                                           )
-                            end_time = time.time()
-                            elapsed_time = end_time - start_time
-                            
-                            if out.success:
-                                self.logger.info('Fit successful')
-                                self.logger.info('Fit message: %s' % out.message)
-                            else:
-                                self.logger.warning('Fit not successful')
-                                self.logger.warning('Fit message: %s' % out.message)
-                            self.logger.debug(f"Elapsed time for fit: {elapsed_time:.2f} s")
-
-                            theta_result = []
-                            theta_err = []
-                            for tdx, th in enumerate(theta_names):
-                                theta_result.append(out.params[th].value)
-                                theta_err.append(out.params[th].stderr)
+        ditstart = dit*6
+        ditstop = ditstart + 6
+        t3ditstart = dit*4
+        t3ditstop = t3ditstart + 4
+
+        visamp = visamp_P[idx][ditstart:ditstop]
+        visamp_error = visamp_error_P[idx][ditstart:ditstop]
+        visamp_flag = visamp_flag_P[idx][ditstart:ditstop]
+        vis2 = vis2_P[idx][ditstart:ditstop]
+        vis2_error = vis2_error_P[idx][ditstart:ditstop]
+        vis2_flag = vis2_flag_P[idx][ditstart:ditstop]
+        closure = closure_P[idx][t3ditstart:t3ditstop]
+        closure_error = closure_error_P[idx][t3ditstart:t3ditstop]
+        closure_flag = closure_flag_P[idx][t3ditstart:t3ditstop]
+        visphi = visphi_P[idx][ditstart:ditstop]
+        visphi_error = visphi_error_P[idx][ditstart:ditstop]
+        visphi_flag = visphi_flag_P[idx][ditstart:ditstop]
+        closamp = closamp_P[idx][t3ditstart:t3ditstop]
+        closamp_error = closamp_error_P[idx][t3ditstart:t3ditstop]
+        closamp_flag = closamp_flag_P[idx][t3ditstart:t3ditstop]
 
-                            results.append(theta_result)
-                            fulltheta = np.copy(theta_result)
-                            all_mostprop = np.copy(theta_result)
-                            all_mostlike = np.copy(theta_result)
-                            mostlike_m = theta_err
-                            mostlike_p = theta_err
-                            cllabels = theta_names
-                            clmostprop = theta_result
-                            cldim = len(cllabels)
-                        else:
-                            self.logger.error('minimizer not recognized, has to be emcee or leastsq')
-                            raise ValueError('minimizer not recognized, has to be emcee or leastsq')
-
-                        for ddx in range(len(todel)):
-                            fulltheta = np.insert(fulltheta, todel[ddx],
-                                                fixed[ddx])
-                            all_mostprop = np.insert(all_mostprop, todel[ddx],
-                                                    fixed[ddx])
-                            all_mostlike = np.insert(all_mostlike, todel[ddx],
-                                                    fixed[ddx])
-                            mostlike_m = np.insert(mostlike_m, todel[ddx], 0)
-                            mostlike_p = np.insert(mostlike_p, todel[ddx], 0)
-
-                        if idx == 0 and dit == 0:
-                            fittab = pd.DataFrame()
-                        _fittab = pd.DataFrame()
-                        _fittab["column"] = ["in P%i_%i" % (idx, dit),
-                                            "M.L. P%i_%i" % (idx, dit),
-                                            "M.P. P%i_%i" % (idx, dit),
-                                            "$-\sigma$ P%i_%i" % (idx, dit),
-                                            "$+\sigma$ P%i_%i" % (idx, dit)]
-                        for ndx, name in enumerate(self.theta_allnames):
-                            _fittab[name] = pd.Series([self.theta_in[ndx],
-                                                    all_mostprop[ndx],
-                                                    all_mostlike[ndx],
-                                                    mostlike_m[ndx],
-                                                    mostlike_p[ndx]])
+        with np.errstate(invalid='ignore'):
+            visamp_flag1 = (visamp > 1) | (visamp < 1.e-5)
+        if not vis_flag:
+            visamp_flag1 = np.full_like(visamp_flag1, False)
+        visamp_flag2 = np.isnan(visamp)
+        visamp_flag_final = ((visamp_flag) | (visamp_flag1) | (visamp_flag2))
+        visamp_flag = visamp_flag_final
+        visamp = np.nan_to_num(visamp)
+        visamp_error[visamp_flag] = 1.
+        closamp = np.nan_to_num(closamp)
+        closamp_error[closamp_flag] = 1.
 
+        with np.errstate(invalid='ignore'):
+            vis2_flag1 = (vis2 > 1) | (vis2 < 1.e-5)
+        if not vis_flag:
+            vis2_flag1 = np.full_like(vis2_flag1, False)
+        vis2_flag2 = np.isnan(vis2)
+        vis2_flag_final = ((vis2_flag) | (vis2_flag1) | (vis2_flag2))
+        vis2_flag = vis2_flag_final
+        vis2 = np.nan_to_num(vis2)
+        vis2_error[vis2_flag] = 1.
+
+        closure = np.nan_to_num(closure)
+        visphi = np.nan_to_num(visphi)
+        visphi_flag[np.where(visphi_error == 0)] = True
+        visphi_error[np.where(visphi_error == 0)] = 100
+        closure_flag[np.where(closure_error == 0)] = True
+        closure_error[np.where(closure_error == 0)] = 100
+
+        if ((flagtill > 0) and (flagfrom > 0)):
+            p = flagtill
+            t = flagfrom
+            visamp_flag[:, 0:p] = True
+            vis2_flag[:, 0:p] = True
+            visphi_flag[:, 0:p] = True
+            closure_flag[:, 0:p] = True
+            closamp_flag[:, 0:p] = True
+
+            visamp_flag[:, t:] = True
+            vis2_flag[:, t:] = True
+            visphi_flag[:, t:] = True
+            closure_flag[:, t:] = True
+            closamp_flag[:, t:] = True
+
+        fitdata = PreparedData([visamp, visamp_error, visamp_flag,
+                                vis2, vis2_error, vis2_flag,
+                                closure, closure_error, closure_flag,
+                                visphi, visphi_error, visphi_flag],
+                               self.bispec_ind)
+        self.logger.debug('Model evaluated on %i baselines x %i '
+                          'channels (%i of %i points)'
+                          % (len(fitdata.bl), len(fitdata.chan_index),
+                             fitdata.size, visamp.size))
+        return fitdata
+
+    def _fit_subset(self, fitdata, fitarg, fithelp, theta, lower, upper,
+                    theta_names, nwalkers=301, nruns=301, onlyphases=False,
+                    minimizer='emcee', minmethod='lbfgsb', optimize=False,
+                    converge=False, converge_ntau=50, converge_tol=0.01,
+                    converge_every=100, nthreads=1, vectorize=True,
+                    compiled=True, numba_parallel=False, pool=None,
+                    progress=False):
+        """
+        Fit of one polarisation / DIT of fit_stars, runs in a worker
+        process with parallel_fits. Returns a dict with the result for
+        the free parameters:
+        mostprop:     best chi2 parameters
+        mostlike:     median of the MCMC (best fit for leastsq)
+        err_m, err_p: lower and upper uncertainties
+        samples:      MCMC chain (emcee)
+        flat_samples: chain after burn-in and thinning (emcee)
+        convergence:  see _emcee_convergence (emcee)
+        pc:           fitted position of the central source (phasefit)
+        """
+        if onlyphases:
+            _pc_idx = theta_names.index('pc RA')
+            theta1 = theta[:_pc_idx]
+            theta2 = theta[_pc_idx+2:]
+            params = Parameters()
+            params.add('pcRa', value=theta[_pc_idx],
+                       min=theta[_pc_idx]-5,
+                       max=theta[_pc_idx]+5)
+            params.add('pcDec', value=theta[_pc_idx+1],
+                       min=theta[_pc_idx+1]-5,
+                       max=theta[_pc_idx+1]+5)
+
+            out = minimize(_leastsq_mstars, params,
+                           args=(theta1, theta2, fitdata,
+                                 fitarg, fithelp),
+                           method='least_squares')
+            pcRa = out.params['pcRa'].value
+            pcDec = out.params['pcDec'].value
+            theta_result = np.concatenate((theta1,
+                                           np.array([pcRa, pcDec]),
+                                           theta2))
+            return {'mostprop': theta_result, 'mostlike': theta_result,
+                    'pc': [pcRa, pcDec]}
+
+        if minimizer == 'emcee':
+            width = 1e-1
+            ndim = len(theta)
+            pos = np.ones((nwalkers, ndim))
+            for par in range(ndim):
+                pos[:, par] = theta[par] + width*np.random.randn(nwalkers)
+            if optimize:
+                start_time = time.time()
+                opt_pos, out = _optimized_walkers(theta, nwalkers, lower,
+                                                  upper, fitdata, fitarg,
+                                                  fithelp, width)
+                self.logger.debug('Least-squares start in %.2f s, %i '
+                                  'evaluations'
+                                  % (time.time() - start_time, out.nfev))
+                if opt_pos is None:
+                    self.logger.warning('Least-squares start failed, '
+                                        'walkers start around initial')
+                else:
+                    pos = opt_pos
+            if converge:
+                converge = (converge_ntau, converge_tol, converge_every)
+            norm_info = _flux_norm_cache.cache_info()
+            sampler = _run_emcee_mstars(pos, nruns, fitdata, lower, upper,
+                                        fitarg, fithelp, nthreads=nthreads,
+                                        vectorize=vectorize,
+                                        compiled=compiled,
+                                        numba_parallel=numba_parallel,
+                                        progress=progress, pool=pool,
+                                        converge=converge or None)
+            if nthreads == 1 and pool is None:
+                # the pool workers have their own caches
+                hits = _flux_norm_cache.hits - norm_info['hits']
+                misses = _flux_norm_cache.misses - norm_info['misses']
+                self.logger.debug(f'Normalisation cache: {hits} hits, {misses} misses')
+
+            # optimize: no fixed tail, the burn-in is short
+            convergence = _emcee_convergence(sampler, nruns, converge_ntau,
+                                             bool(converge) or optimize)
+            samples = sampler.chain
+            fl_samples = samples[:, convergence['burnin']::
+                                 convergence['thin'], :]
+            fl_samples = fl_samples.reshape((-1, ndim))
+            mostprop = sampler.flatchain[np.argmax(sampler.flatlnprobability)]
+            percentiles = np.percentile(fl_samples, [16, 50, 84], axis=0).T
+            return {'mostprop': mostprop, 'mostlike': percentiles[:, 1],
+                    'err_m': percentiles[:, 1] - percentiles[:, 0],
+                    'err_p': percentiles[:, 2] - percentiles[:, 1],
+                    'samples': samples, 'flat_samples': fl_samples,
+                    'convergence': convergence}
+
+        elif minimizer == 'leastsq' and minmethod == 'least_squares':
+            ndim = len(theta)
+            start_time = time.time()
+            out = least_squares(_residuals_mstars, theta,
+                                jac=_jacobian_mstars,
+                                bounds=(lower, upper),
+                                x_scale='jac',
+                                args=(fitdata, fitarg, fithelp))
+            end_time = time.time()
+            elapsed_time = end_time - start_time
+
+            if out.success:
+                self.logger.info('Fit successful')
+                self.logger.info('Fit message: %s' % out.message)
+            else:
+                self.logger.warning('Fit not successful')
+                self.logger.warning('Fit message: %s' % out.message)
+            self.logger.debug(f"Elapsed time for fit: {elapsed_time:.2f} s, "
+                              f"{out.nfev} evaluations")
+
+            # covariance scaled with the reduced chi2 (as lmfit)
+            nres = len(out.fun)
+            redchi = 2*out.cost / max(nres - ndim, 1)
+            cov = np.linalg.pinv(out.jac.T @ out.jac) * redchi
+            theta_err = np.sqrt(np.abs(np.diag(cov)))
+            return {'mostprop': out.x, 'mostlike': out.x,
+                    'err_m': theta_err, 'err_p': theta_err}
+
+        elif minimizer == 'leastsq':
+            params = Parameters()
+            for tdx, th in enumerate(theta):
+                params.add(theta_names[tdx],
+                           value=th,
+                           min=lower[tdx],
+                           max=upper[tdx])
+
+            start_time = time.time()
+            out = minimize(_lnlike_mstars, params,
+                           args=(fitdata,
+                                 fitarg, fithelp),
+                           method=minmethod,
+                           )
+            end_time = time.time()
+            elapsed_time = end_time - start_time
+
+            if out.success:
+                self.logger.info('Fit successful')
+                self.logger.info('Fit message: %s' % out.message)
+            else:
+                self.logger.warning('Fit not successful')
+                self.logger.warning('Fit message: %s' % out.message)
+            self.logger.debug(f"Elapsed time for fit: {elapsed_time:.2f} s")
+
+            theta_result = []
+            theta_err = []
+            for tdx, th in enumerate(theta_names):
+                theta_result.append(out.params[th].value)
+                theta_err.append(out.params[th].stderr)
+            return {'mostprop': theta_result, 'mostlike': theta_result,
+                    'err_m': theta_err, 'err_p': theta_err}
+        else:
+            self.logger.error('minimizer not recognized, has to be emcee or leastsq')
+            raise ValueError('minimizer not recognized, has to be emcee or leastsq')
 
+    def _saved_fit(self, idx, dit, fittab, todel):
+        """
+        Result of polarisation idx and DIT dit from the saved fit table,
+        in the form of _fit_subset
+        """
+        fittab_res = fittab.drop(columns=['chi2', *_CONVERGENCE_KEYS],
+                                 errors='ignore')
+        fulltheta = fittab_res.loc[fittab['column'].str.contains('M.L. P%i_%i' % (idx, dit))].values[0, 1:]
+        param_pd = list(fittab_res.columns[1:])
+        param_fit = self.theta_allnames
+        param_diff = set(param_pd) ^ set(param_fit)
+
+        if len(param_diff) != 0:
+            if param_diff == {'SelfCal1', 'SelfCal4', 'SelfCal3', 'SelfCal2'}:
+                self.logger.warning('Phase self cal not in pandas file, will continue with assuming self cal is zero')
+                self.logger.warning('To remove this inconsistency, run the fit again with refit=True')
+                fulltheta = np.concatenate((fulltheta, [0.0,0.0,0.0,0.0]))
+            else:
+                self.logger.error(f'Pandas and fit parameters are different, inconsistency in:')
+                [self.logger.error(i) for i in param_diff]
+                self.logger.error('To remove this inconsistency, run the fit again with refit=True')
+                raise ValueError('Pandas and fit parameters are different')
+        if len(self.theta_in) != len(fulltheta):
+            self.logger.error('Length of parameters from pandas are not as expected')
+            raise ValueError('Length of parameters from pandas are not as expected')
+
+        theta_result = np.copy(fulltheta)
+        theta_result = np.delete(theta_result, todel)
+        return {'mostprop': theta_result, 'mostlike': theta_result,
+                'fulltheta': fulltheta}
+
+    def _fit_summary(self, idx, dit, fit, fitdata, fitarg, fithelp,
+                     theta_names, ndof, no_fit=False, onlyphases=False,
+                     minimizer='emcee', bestchi=True, redchi2=True,
+                     plot_corner=None, mcmcname=None, nruns=301,
+                     converge=False, optimize=False, converge_ntau=50):
+        """
+        Logs, plots and tabulates the result of _fit_subset for
+        polarisation idx and DIT dit of fit_stars.
+        Returns the result, its rows of the fit table (None without fit)
+        and the chi2 of visamp, vis2, closure and visphi
+        """
+        todel, fixed = self.todel, self.fixed
+        if bestchi:
+            theta_result = fit['mostprop']
+        else:
+            theta_result = fit['mostlike']
+        fulltheta = fit.get('fulltheta')
+        if fulltheta is None:
+            fulltheta = np.copy(theta_result)
+            for ddx in range(len(todel)):
+                fulltheta = np.insert(fulltheta, todel[ddx], fixed[ddx])
 
+        _fittab = None
+        if no_fit:
+            if plot_corner in ['corner', 'steps', 'both'] and mcmcname is not None:
+                ndim = len(theta_result)
+                mcname = f'{mcmcname}_P{idx+1}'
+                try:
+                    samples = np.load(f'{mcname}.npy')
+                    theta_names = np.loadtxt(f'{mcname}.txt', dtype=str)
+
+                    cldim = len(theta_names)
+                    if plot_corner in ['steps', 'both']:
+                        fig, axes = plt.subplots(cldim, figsize=(8, cldim/1.5),
+                                                 sharex=True)
+                        for i in range(cldim):
+                            ax = axes[i]
+                            ax.plot(samples[:, :, i].T, "k", alpha=0.3)
+                            ax.set_ylabel(theta_names[i])
+                            ax.yaxis.set_label_coords(-0.1, 0.5)
+                        axes[-1].set_xlabel("step number")
+                        plt.show()
+
+                    if nruns > 300:
+                        fl_samples = samples[:, -200:, :].reshape((-1, ndim))
+                    elif nruns > 200:
+                        fl_samples = samples[:, -100:, :].reshape((-1, ndim))
                     else:
-                        _pc_idx = theta_names.index('pc RA')
-                        theta1 = theta[:_pc_idx]
-                        theta2 = theta[_pc_idx+2:]
-                        params = Parameters()
-                        params.add('pcRa', value=theta[_pc_idx],
-                                   min=theta[_pc_idx]-5,
-                                   max=theta[_pc_idx]+5)
-                        params.add('pcDec', value=theta[_pc_idx+1],
-                                   min=theta[_pc_idx+1]-5,
-                                   max=theta[_pc_idx+1]+5)
-
-                        out = minimize(_leastsq_mstars, params, 
-                                       args=(theta1, theta2, fitdata,
-                                             fitarg, fithelp),
-                                       method='least_squares')
-                        pcRa = out.params['pcRa'].value
-                        pcDec = out.params['pcDec'].value
-
-                        if idx == 0 and dit == 0:
-                            fittab = pd.DataFrame()
-                        _fittab = pd.DataFrame()
-                        _fittab["column"] = ["in P%i_%i" % (idx, dit),
-                                             "MFit P%i_%i" % (idx, dit)]
-                        _fittab['pcRa'] = pd.Series([theta[_pc_idx],
-                                                     pcRa])
-                        _fittab['pcDec'] = pd.Series([theta[_pc_idx+1],
-                                                      pcDec])
-
-                        theta_result = np.concatenate((theta1,
-                                                       np.array([pcRa, pcDec]),
-                                                       theta2))
-                        fulltheta = np.copy(theta_result)
-                        for ddx in range(len(todel)):
-                            fulltheta = np.insert(fulltheta, todel[ddx], fixed[ddx])
+                        fl_samples = samples.reshape((-1, ndim))
 
+                    if plot_corner in ['corner', 'both']:
+                        fig = corner.corner(fl_samples,
+                                            quantiles=[0.16, 0.5, 0.84],
+                                            labels=theta_names)
+                        plt.show()
+                except FileNotFoundError:
+                    self.logger.warning('MCMC results shouldbe saved, but do not exist')
+
+        elif onlyphases:
+            _pc_idx = theta_names.index('pc RA')
+            pcRa, pcDec = fit['pc']
+            _fittab = pd.DataFrame()
+            _fittab["column"] = ["in P%i_%i" % (idx, dit),
+                                 "MFit P%i_%i" % (idx, dit)]
+            theta_in = np.delete(self.theta_in, todel)
+            _fittab['pcRa'] = pd.Series([theta_in[_pc_idx], pcRa])
+            _fittab['pcDec'] = pd.Series([theta_in[_pc_idx+1], pcDec])
+
+        else:
+            mostprop = fit['mostprop']
+            cldim = len(theta_names)
+            if minimizer == 'emcee':
+                convergence = fit['convergence']
+                if not (converge or optimize):
+                    # fixed length run, no convergence check
+                    self.logger.info('MCMC: %i steps, tau = %.1f (%.0f tau)'
+                                     % (convergence['nsteps'],
+                                        convergence['tau'],
+                                        convergence['nsteps']
+                                        / convergence['tau']))
+                elif convergence['converged']:
+                    self.logger.info('MCMC converged after %i steps '
+                                     '(tau = %.1f)'
+                                     % (convergence['nsteps'],
+                                        convergence['tau']))
                 else:
-                    if save_result is not None and save_result_exist:
-                        fulltheta = fittab_res.loc[fittab['column'].str.contains('M.L. P%i_%i' % (idx, dit))].values[0, 1:]
-                        param_pd = list(fittab_res.columns[1:])
-                        param_fit = self.theta_allnames
-                        param_diff = set(param_pd) ^ set(param_fit)
-                        
-                        if len(param_diff) != 0:
-                            if param_diff == {'SelfCal1', 'SelfCal4', 'SelfCal3', 'SelfCal2'}:
-                                self.logger.warning('Phase self cal not in pandas file, will continue with assuming self cal is zero')
-                                self.logger.warning('To remove this inconsistency, run the fit again with refit=True')
-                                fulltheta = np.concatenate((fulltheta, [0.0,0.0,0.0,0.0])) 
-                            else:
-                                self.logger.error(f'Pandas and fit parameters are different, inconsistency in:')
-                                [self.logger.error(i) for i in param_diff]
-                                self.logger.error('To remove this inconsistency, run the fit again with refit=True')
-                                raise ValueError('Pandas and fit parameters are different')
-                        if len(self.theta_in) != len(fulltheta):
-                            self.logger.error('Length of parameters from pandas are not as expected')
-                            raise ValueError('Length of parameters from pandas are not as expected')
-                        
-                        theta_result = np.copy(fulltheta)
-                        theta_result = np.delete(theta_result, todel)
-                    else:
-                        theta_result = theta
-                        fulltheta = np.copy(theta_result)
-                        for ddx in range(len(todel)):
-                            fulltheta = np.insert(fulltheta, todel[ddx],
-                                                  fixed[ddx])
-                        
-                    if plot_corner in ['corner', 'steps', 'both'] and save_mcmc is not None:
-                        mcname = f'{mcmcname}_P{idx+1}'
-                        try:
-                            samples = np.load(f'{mcname}.npy')
-                            theta_names = np.loadtxt(f'{mcname}.txt', dtype=str)
-
-                            cldim = len(theta_names)
-                            if plot_corner in ['steps', 'both']:
-                                fig, axes = plt.subplots(cldim, figsize=(8, cldim/1.5),
-                                                        sharex=True)
-                                for i in range(cldim):
-                                    ax = axes[i]
-                                    ax.plot(samples[:, :, i].T, "k", alpha=0.3)
-                                    ax.set_ylabel(theta_names[i])
-                                    ax.yaxis.set_label_coords(-0.1, 0.5)
-                                axes[-1].set_xlabel("step number")
-                                plt.show()
-
-                            if nruns > 300:
-                                fl_samples = samples[:, -200:, :].reshape((-1, ndim))
-                            elif nruns > 200:
-                                fl_samples = samples[:, -100:, :].reshape((-1, ndim))
-                            else:
-                                fl_samples = samples.reshape((-1, ndim))
-
-                            if plot_corner in ['corner', 'both']:
-                                fig = corner.corner(fl_samples,
-                                                    quantiles=[0.16, 0.5, 0.84],
-                                                    labels=theta_names)
-                                plt.show()
-                        except FileNotFoundError:
-                            self.logger.warning('MCMC results shouldbe saved, but do not exist')
-
-                self.theta_result = theta_result
-                (fit_visamp, fit_visphi,
-                 fit_closure) = _calc_vis_mstars(fulltheta, fitarg, fithelp)
-                fit_vis2 = fit_visamp**2.
-
-                self.result_fit_visamp = fit_visamp
-                self.result_fit_vis2 = fit_vis2
-                self.result_visphi = fit_visphi
-                self.result_closure = fit_closure
-
-                res_visamp = fit_visamp-visamp
-                res_vis2 = fit_vis2-vis2
-                res_closure = np.degrees(np.abs(np.exp(1j*np.radians(fit_closure))
-                                                - np.exp(1j*np.radians(closure))))
-                res_visphi = np.degrees(np.abs(np.exp(1j*np.radians(fit_visphi))
-                                               - np.exp(1j*np.radians(visphi))))
-
-                redchi_visamp = np.sum(res_visamp**2./visamp_error**2.
-                                       * (1-visamp_flag))
-                redchi_vis2 = np.sum(res_vis2**2./vis2_error**2.
-                                     * (1-vis2_flag))
-                redchi_closure = np.sum(res_closure**2./closure_error**2.
-                                        * (1-closure_flag))
-                redchi_visphi = np.sum(res_visphi**2./visphi_error**2.
-                                       * (1-visphi_flag))
-
-                if redchi2:
-                    redchi_visamp /= (visamp.size-np.sum(visamp_flag)-ndof)
-                    redchi_vis2 /= (vis2.size-np.sum(vis2_flag)-ndof)
-                    redchi_closure /= (closure.size-np.sum(closure_flag)-ndof)
-                    redchi_visphi /= (visphi.size-np.sum(visphi_flag)-ndof)
-                    chi2string = 'red. chi2'
+                    self.logger.warning('MCMC not converged: %i steps < %i '
+                                        'tau (tau = %.1f)'
+                                        % (convergence['nsteps'],
+                                           converge_ntau,
+                                           convergence['tau']))
+                ac_fraction = convergence['acceptance']
+                if ac_fraction < 0.25 or ac_fraction > 0.5:
+                    self.logger.warning(f'Mean acceptance fraction: {ac_fraction:.2}')
+                    self.logger.warning('Should be between 0.25 and 0.5')
                 else:
-                    chi2string = 'chi2'
+                    self.logger.info(f'Mean acceptance fraction: {ac_fraction:.2}')
+
+                samples = fit['samples']
+                if mcmcname is not None:
+                    mcname = f'{mcmcname}_P{idx+1}'
+                    np.save(mcname, samples)
+                    np.savetxt(f'{mcname}.txt', theta_names, fmt='%s')
+
+                if plot_corner in ['steps', 'both']:
+                    fig, axes = plt.subplots(cldim, figsize=(8, cldim/1.5),
+                                             sharex=True)
+                    for i in range(cldim):
+                        ax = axes[i]
+                        ax.plot(samples[:, :, i].T, "k", alpha=0.3)
+                        ax.set_ylabel(theta_names[i])
+                        ax.axhline(mostprop[i], color='C0', alpha=0.5)
+                        ax.yaxis.set_label_coords(-0.1, 0.5)
+                    axes[-1].set_xlabel("step number")
+                    plt.show()
+
+                if plot_corner in ['corner', 'both']:
+                    fig = corner.corner(fit['flat_samples'],
+                                        quantiles=[0.16, 0.5, 0.84],
+                                        truths=mostprop,
+                                        labels=theta_names)
+                    plt.show()
+
+            all_mostprop = np.copy(mostprop)
+            all_mostlike = np.copy(fit['mostlike'])
+            mostlike_m = fit['err_m']
+            mostlike_p = fit['err_p']
+            for ddx in range(len(todel)):
+                all_mostprop = np.insert(all_mostprop, todel[ddx],
+                                         fixed[ddx])
+                all_mostlike = np.insert(all_mostlike, todel[ddx],
+                                         fixed[ddx])
+                mostlike_m = np.insert(mostlike_m, todel[ddx], 0)
+                mostlike_p = np.insert(mostlike_p, todel[ddx], 0)
+
+            _fittab = pd.DataFrame()
+            _fittab["column"] = ["in P%i_%i" % (idx, dit),
+                                 "M.L. P%i_%i" % (idx, dit),
+                                 "M.P. P%i_%i" % (idx, dit),
+                                 "$-\sigma$ P%i_%i" % (idx, dit),
+                                 "$+\sigma$ P%i_%i" % (idx, dit)]
+            for ndx, name in enumerate(self.theta_allnames):
+                _fittab[name] = pd.Series([self.theta_in[ndx],
+                                           all_mostprop[ndx],
+                                           all_mostlike[ndx],
+                                           mostlike_m[ndx],
+                                           mostlike_p[ndx]])
 
-                if not onlyphases and not no_fit:
-                    chi2pd = pd.DataFrame({'chi2': [redchi_visamp, redchi_vis2,
-                                                    redchi_closure,
-                                                    redchi_visphi]
-                                           })
-                    _fittab = pd.concat([_fittab, chi2pd], axis=1)
+        (visamp, visamp_error, visamp_flag,
+         vis2, vis2_error, vis2_flag,
+         closure, closure_error, closure_flag,
+         visphi, visphi_error, visphi_flag) = fitdata
 
-                if idx == 0:
-                    redchi0 = [redchi_visamp, redchi_vis2,
-                               redchi_closure, redchi_visphi]
-                    self.redchi0 = redchi0
-                elif idx == 1:
-                    redchi1 = [redchi_visamp, redchi_vis2,
-                               redchi_closure, redchi_visphi]
-                    self.redchi1 = redchi1
-
-                self.logger.info('ndof: %i' % (vis2.size-np.sum(vis2_flag)-ndof))
-                self.logger.info(f'{chi2string} for visamp: {redchi_visamp:.2}')
-                self.logger.info(f'{chi2string} for vis2: {redchi_vis2:.2}')
-                self.logger.info(f'{chi2string} for visphi: {redchi_visphi:.2}')
-                self.logger.info(f'{chi2string} for closure: {redchi_closure:.2}')
-
-                if not no_fit and not onlyphases:
-
-                    self.logger.info("Best chi2 result:")
-                    for i in range(0, cldim):
-                        self.logger.info("%s = %.3f" % (cllabels[i], clmostprop[i]))
-                    
-                    if minimizer == 'emcee':
-                        percentiles = np.percentile(fl_samples,
-                                                    [16, 50, 84], axis=0).T
-                        percentiles[:, 0] = percentiles[:, 1] - percentiles[:, 0]
-                        percentiles[:, 2] = percentiles[:, 2] - percentiles[:, 1]
-                        self.logger.info("MCMC Result:")
-                        for i in range(0, cldim):
-                            self.logger.info("%s = %.3f + %.3f - %.3f"
-                                % (cllabels[i], percentiles[i, 1],
-                                    percentiles[i, 2], percentiles[i, 0]))
+        self.theta_result = theta_result
+        (fit_visamp, fit_visphi,
+         fit_closure) = _calc_vis_mstars(fulltheta, fitarg, fithelp)
+        fit_vis2 = fit_visamp**2.
 
-                if idx == 0:
-                    plotdata = []
-                plotdata.append([theta_result, fitdata, fitarg, fithelp])
-                if not no_fit:
-                    fittab = pd.concat([fittab, _fittab], ignore_index=True)
-
-            if plot_science:
-                self.plot_fit(plotdata)
-            self.plotdata = plotdata
-        if not no_fit or save_result_exist:
-            self.fittab = fittab
-        if save_result is not None and not save_result_exist:
-            fittab.to_pickle(pdname)
-        if create_pdf:
-            self.create_pdf()
+        self.result_fit_visamp = fit_visamp
+        self.result_fit_vis2 = fit_vis2
+        self.result_visphi = fit_visphi
+        self.result_closure = fit_closure
 
-        try:
-            fitted = 1-(np.array(self.fit_for) == 0)
-            redchi0_f = np.sum(redchi0*fitted)
-            if onlypol == 0:
-                redchi1 = np.zeros_like(redchi0)
-            redchi1_f = np.sum(redchi1*fitted)
-            redchi_f = redchi0_f + redchi1_f
-            self.logger.info(f'Combined {chi2string} of fitted data: {redchi_f:.3}')
-        except UnboundLocalError:
-            pass
-        except:
-            self.logger.error("could not compute reduced chi2")
-        if onlypol is not None and ndit == 1:
-            return theta_result
+        res_visamp = fit_visamp-visamp
+        res_vis2 = fit_vis2-vis2
+        res_closure = np.degrees(np.abs(np.exp(1j*np.radians(fit_closure))
+                                        - np.exp(1j*np.radians(closure))))
+        res_visphi = np.degrees(np.abs(np.exp(1j*np.radians(fit_visphi))
+                                       - np.exp(1j*np.radians(visphi))))
+
+        redchi_visamp = np.sum(res_visamp**2./visamp_error**2.
+                               * (1-visamp_flag))
+        redchi_vis2 = np.sum(res_vis2**2./vis2_error**2.
+                             * (1-vis2_flag))
+        redchi_closure = np.sum(res_closure**2./closure_error**2.
+                                * (1-closure_flag))
+        redchi_visphi = np.sum(res_visphi**2./visphi_error**2.
+                               * (1-visphi_flag))
+
+        if redchi2:
+            redchi_visamp /= (visamp.size-np.sum(visamp_flag)-ndof)
+            redchi_vis2 /= (vis2.size-np.sum(vis2_flag)-ndof)
+            redchi_closure /= (closure.size-np.sum(closure_flag)-ndof)
+            redchi_visphi /= (visphi.size-np.sum(visphi_flag)-ndof)
+            chi2string = 'red. chi2'
         else:
-            return results
+            chi2string = 'chi2'
+
+        if not onlyphases and not no_fit:
+            chi2pd = pd.DataFrame({'chi2': [redchi_visamp, redchi_vis2,
+                                            redchi_closure,
+                                            redchi_visphi]
+                                   })
+            _fittab = pd.concat([_fittab, chi2pd], axis=1)
+            if minimizer == 'emcee':
+                convpd = pd.DataFrame({key: [convergence[key]]
+                                       for key in _CONVERGENCE_KEYS})
+                _fittab = pd.concat([_fittab, convpd], axis=1)
+
+        self.logger.info('ndof: %i' % (vis2.size-np.sum(vis2_flag)-ndof))
+        self.logger.info(f'{chi2string} for visamp: {redchi_visamp:.2}')
+        self.logger.info(f'{chi2string} for vis2: {redchi_vis2:.2}')
+        self.logger.info(f'{chi2string} for visphi: {redchi_visphi:.2}')
+        self.logger.info(f'{chi2string} for closure: {redchi_closure:.2}')
+
+        if not no_fit and not onlyphases:
+
+            self.logger.info("Best chi2 result:")
+            for i in range(0, cldim):
+                self.logger.info("%s = %.3f" % (theta_names[i], mostprop[i]))
+
+            if minimizer == 'emcee':
+                self.logger.info("MCMC Result:")
+                for i in range(0, cldim):
+                    self.logger.info("%s = %.3f + %.3f - %.3f"
+                        % (theta_names[i], fit['mostlike'][i],
+                           fit['err_p'][i], fit['err_m'][i]))
+
+        return theta_result, _fittab, [redchi_visamp, redchi_vis2,
+                                       redchi_closure, redchi_visphi]
+
+    def benchmark_model(self, nrep=100):
+        """
+        Compares the per call time of the vectorized visibility model with
+        the reference implementation, which loops over baselines and sources.
+        Uses the setup of the last fit, so fit_stars has to be run before
+        (no_fit=True is sufficient)
+
+        Returns the time per call of the loop and the vectorized model [s]
+        """
+        try:
+            theta, _, fitarg, fithelp = self.plotdata[0]
+        except AttributeError:
+            self.logger.error('No fit setup available, run fit_stars first')
+            raise ValueError('No fit setup available, run fit_stars first')
+        fulltheta = np.copy(theta)
+        for ddx in range(len(self.todel)):
+            fulltheta = np.insert(fulltheta, self.todel[ddx],
+                                  self.fixed[ddx])
+
+        res_loop = _calc_vis_mstars_loop(fulltheta, fitarg, fithelp)
+        res_vec = _calc_vis_mstars(fulltheta, fitarg, fithelp)
+        maxdiff = np.max([np.max(np.abs(r1 - r2))
+                          for r1, r2 in zip(res_loop, res_vec)])
+
+        start_time = time.perf_counter()
+        for _ in range(nrep):
+            _calc_vis_mstars_loop(fulltheta, fitarg, fithelp)
+        t_loop = (time.perf_counter() - start_time)/nrep
+
+        start_time = time.perf_counter()
+        for _ in range(nrep):
+            _calc_vis_mstars(fulltheta, fitarg, fithelp)
+        t_vec = (time.perf_counter() - start_time)/nrep
+
+        self.logger.info(f'Model with {self.nsource+1} sources, '
+                         f'fit_mode {self.fit_mode}')
+        self.logger.info(f'Loop model:       {t_loop*1e3:.3f} ms per call')
+        self.logger.info(f'Vectorized model: {t_vec*1e3:.3f} ms per call')
+        self.logger.info(f'Speedup: {t_loop/t_vec:.1f}, '
+                         f'max. difference: {maxdiff:.2e}')
+        return t_loop, t_vec
 
     def plot_fit(self, plotdata, nicer=True, save=False):
         rad2as = 180 / np.pi * 3600
@@ -2281,15 +5396,20 @@ class GravMFit(GravData, GravPhaseMaps):
 
             (nsource, fit_for, bispec_ind, fit_mode, wave, dlambda,
              todel, fixed, phasemaps, northA, dra, ddec,
-             amp_map_int, pha_map_int, amp_map_denom_int,
+             pm_sampler, _, _,
              fit_phasemaps, fix_pm_sources,
-             only_stars) = fithelp
+             only_stars, smearing_table, channel_quadrature) = fithelp
 
             for ddx in range(len(todel)):
                 theta = np.insert(theta, todel[ddx], fixed[ddx])
 
+            fithelp = list(fithelp)
             fithelp[4] = wave_model
             fithelp[5] = dlambda_model
+            # smearing table / channel quadrature are set up for the
+            # data channels, the model grid is integrated directly
+            fithelp[_FITHELP_SMEARING] = None
+            fithelp[_FITHELP_QUADRATURE] = None
             self.wave = wave_model
             self.dlambda = dlambda_model
             fitres.append(_calc_vis_mstars(theta, fitarg, fithelp))
@@ -2623,7 +5743,8 @@ class GravMFit(GravData, GravPhaseMaps):
         fname = stname[:29]
         title_paragraph = Paragraph(fname, title_style)
 
-        keys = self.fittab.keys()[1:-7]
+        keys = self.fittab.keys().drop(_CONVERGENCE_KEYS,
+                                       errors='ignore')[1:-7]
         d = []
         for key in keys:
             d.append([np.round(_,3) for _ in self.fittab[key].values])
@@ -2740,10 +5861,7 @@ def _lnlike_night(theta, fitdata, fitarg, fithelp_night):
      todel, fixed,
      phasemaps, pm_sources_night,
      only_stars) = fithelp_night
-    (visamp, visamp_error, visamp_flag,
-     vis2, vis2_error, vis2_flag,
-     closure, closure_error, closure_flag,
-     visphi, visphi_error, visphi_flag) = fitdata
+    fitdata = _prepare_fitdata(fitdata, bispec_ind)
 
     for ddx in range(len(todel)):
         theta = np.insert(theta, todel[ddx], fixed[ddx])
@@ -2797,32 +5915,31 @@ def _lnlike_night(theta, fitdata, fitarg, fithelp_night):
                        None, None, phasemaps, None, None, None,
                        None, None, None,
                        False, pm_sources,
-                       only_stars]
+                       only_stars, None, None]
         else:
             fithelp = [nsource, fit_for, bispec_ind, fit_mode, wave, dlambda,
                        None, None, phasemaps, None, None, None,
                        None, None, None,
                        False, None,
-                       only_stars]
+                       only_stars, None, None]
         (model_visamp, model_visphi,
-         model_closure) = _calc_vis_mstars(_theta, fitarg[:, ndx], fithelp)
+         model_closure) = _calc_vis_mstars(_theta, fitarg[:, ndx], fithelp,
+                                           compact=fitdata)
         model_vis2 = model_visamp**2.
 
         #Data
-        res_visamp = np.sum(-(model_visamp-visamp[ndx])**2
-                            /visamp_error[ndx]**2*(1-visamp_flag[ndx]))
-        res_vis2 = np.sum(-(model_vis2-vis2[ndx])**2.
-                          /vis2_error[ndx]**2.*(1-vis2_flag[ndx]))
+        res_visamp = np.sum(-(model_visamp-fitdata.visamp[ndx])**2
+                            * fitdata.visamp_w[ndx])
+        res_vis2 = np.sum(-(model_vis2-fitdata.vis2[ndx])**2.
+                          * fitdata.vis2_w[ndx])
 
         res_closure = np.degrees(np.abs(np.exp(1j*np.radians(model_closure))
-                                        - np.exp(1j*np.radians(closure[ndx]))))
-        res_clos = np.sum(-res_closure**2./closure_error[ndx]**2.
-                          * (1-closure_flag[ndx]))
+                                        - fitdata.closure_phasor[ndx]))
+        res_clos = np.sum(-res_closure**2. * fitdata.closure_w[ndx])
 
         res_visphi = np.degrees(np.abs(np.exp(1j*np.radians(model_visphi))
-                                       - np.exp(1j*np.radians(visphi[ndx]))))
-        res_phi = np.sum(-res_visphi**2./visphi_error[ndx]**2.
-                         * (1-visphi_flag[ndx]))
+                                       - fitdata.visphi_phasor[ndx]))
+        res_phi = np.sum(-res_visphi**2. * fitdata.visphi_w[ndx])
 
         loglike = 0.5 * (res_visamp * fit_for[0]
                               + res_vis2 * fit_for[1]
@@ -2839,7 +5956,7 @@ def _lnlike_night(theta, fitdata, fitarg, fithelp_night):
 
 
 class GravMNightFit(GravNight, GravPhaseMaps):
-    def __init__(self, file_list, loglevel='INFO'):
+    def __init__(self, file_list, loglevel='INFO', pool=None):
         """
         GravMNightFit: Class to fit a multiple point source model
                        to several GRAVITY datasets at once
@@ -2848,8 +5965,11 @@ class GravMNightFit(GravNight, GravPhaseMaps):
         Main functions:
         fit_stars : the function to do the fit
         plot_fit : plot the data and the fitted model
+
+        pool: SamplerPool used by all fits of the object [None]
         """
         super().__init__(file_list, loglevel=loglevel)
+        self.pool = pool
         log_level = log_level_mapping.get(loglevel, logging.INFO)
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(log_level)
@@ -2923,6 +6043,10 @@ class GravMNightFit(GravNight, GravPhaseMaps):
         interppm:         Interpolate Phasemaps [True]
         smoothkernel:     Size of smoothing kernel in mas [15]
         pmdatayear:       Phasemaps year, 2019 or 2020 [2019]
+        phasemap_dir:     Directory of the phasemap store, see
+                          PhasemapStore for the default [None]
+        pool:             SamplerPool for the fit, replaces nthreads
+                          [self.pool]
         """
 
         fit_mode = kwargs.get('fit_mode', 'numeric')
@@ -2936,19 +6060,22 @@ class GravMNightFit(GravNight, GravPhaseMaps):
         only_stars = kwargs.get('only_stars', False)
         fixed_BG_alpha = kwargs.get('fixed_BG_alpha', True)
         fixed_star_alpha = kwargs.get('fixed_star_alpha', True)
+        pool = kwargs.get('pool', self.pool)
         self.no_fit = no_fit
         self.nested = nested
 
         interppm = kwargs.get('interppm', True)
         self.datayear = kwargs.get('pmdatayear', 2019)
         self.smoothkernel = kwargs.get('smoothkernel', 15)
+        self.phasemap_dir = kwargs.get('phasemap_dir', None)
         self.phasemaps = phasemaps
 
         available_keys = ['fit_mode', 'flagtill', 'flagfrom', 'error_scale',
                           'nocohloss', 'no_fit', 'nested', 'only_stars',
                           'save_mcmc',
                           'fixed_BG_alpha', 'fixed_star_alpha', 'interppm',
-                          'smoothkernel', 'pmdatayear']
+                          'smoothkernel', 'pmdatayear', 'phasemap_dir',
+                          'pool']
 
         for kwarg in kwargs:
             if kwarg not in available_keys:
@@ -3381,10 +6508,11 @@ class GravMNightFit(GravNight, GravPhaseMaps):
         self.todel = todel
         self.ndim = ndim
 
-        fitdata = [visamp_P, visamp_error_P, visamp_flag_P,
-                   vis2_P, vis2_error_P, vis2_flag_P,
-                   closure_P, closure_error_P, closure_flag_P,
-                   visphi_P, visphi_error_P, visphi_flag_P]
+        fitdata = PreparedData([visamp_P, visamp_error_P, visamp_flag_P,
+                                vis2_P, vis2_error_P, vis2_flag_P,
+                                closure_P, closure_error_P, closure_flag_P,
+                                visphi_P, visphi_error_P, visphi_flag_P],
+                               self.bispec_ind)
 
         fitarg = np.array([u, v])
         if phasemaps:
@@ -3424,51 +6552,68 @@ class GravMNightFit(GravNight, GravPhaseMaps):
             width = (upper-lower)/2
             width[gprior] = 0.05
 
-            if nested:
-                pool = Pool(processes=nthreads)
+            if pool is None and nthreads > 1:
+                # pool only for this fit
+                with SamplerPool(nthreads) as pool:
+                    self._run_sampler(pos, nruns, nwalkers, ndim, nested,
+                                      lower, upper, gprior, mean, width,
+                                      pool)
+            else:
+                self._run_sampler(pos, nruns, nwalkers, ndim, nested,
+                                  lower, upper, gprior, mean, width, pool)
+            if save_mcmc is not None:
+                samples = self.sampler.chain
+                np.save(mcmcname, samples)
+                np.savetxt(f'{mcmcname}.txt', theta_names, fmt='%s')
+
+    def _run_sampler(self, pos, nruns, nwalkers, ndim, nested, lower, upper,
+                     gprior, mean, width, pool=None):
+        """
+        Runs the dynesty or emcee sampler of fit_stars, on the
+        SamplerPool if given
+        """
+        progress = self.logger.level <= logging.INFO
+        if nested:
+            if pool is None:
                 sampler = dynesty.NestedSampler(_lnlike_night,
                                                 _prior_transform,
                                                 ndim,
                                                 nlive=nwalkers,
-                                                pool=pool,
-                                                queue_size=nthreads,
-                                                logl_args=[fitdata, fitarg, fithelp_night],
+                                                logl_args=[self.fitdata,
+                                                           self.fitarg,
+                                                           self.fithelp_night],
                                                 ptform_args=[gprior, mean, width],
                                                 sample='rwalk')
-                sampler.run_nested(checkpoint_file='dynesty.save')
-                self.sampler = sampler
             else:
-                if nthreads == 1:
-                    self.sampler = emcee.EnsembleSampler(nwalkers, ndim,
-                                                         _lnprob_night,
-                                                         args=(fitdata, lower,
-                                                               upper, theta_names,
-                                                               fitarg, fithelp_night))
-                    if self.logger.level > logging.INFO:
-                        self.sampler.run_mcmc(pos, nruns, progress=False,
-                                              skip_initial_state_check=True)
-                    else:
-                        self.sampler.run_mcmc(pos, nruns, progress=True,
-                                              skip_initial_state_check=True)
-                else:
-                    with Pool(processes=nthreads) as pool:
-                        self.sampler = emcee.EnsembleSampler(nwalkers, ndim,
-                                                             _lnprob_night,
-                                                             args=(fitdata, lower,
-                                                                   upper, theta_names,
-                                                                   fitarg,
-                                                                   fithelp_night),
-                                                             pool=pool)
-                        if self.logger.level > logging.INFO:
-                            self.sampler.run_mcmc(pos, nruns, progress=False,
-                                                  skip_initial_state_check=True)
-                        else:
-                            self.sampler.run_mcmc(pos, nruns, progress=True,
-                                                  skip_initial_state_check=True)
-            if save_mcmc is not None:
-                samples = self.sampler.chain
-                np.save(mcmcname, samples)
-                np.savetxt(f'{mcmcname}.txt', theta_names, fmt='%s')
+                pool.set_args(self.fitdata, self.fitarg, self.fithelp_night)
+                sampler = dynesty.NestedSampler(pool.task(_lnlike_night),
+                                                _prior_transform,
+                                                ndim,
+                                                nlive=nwalkers,
+                                                pool=pool,
+                                                queue_size=pool.processes,
+                                                ptform_args=[gprior, mean, width],
+                                                sample='rwalk')
+            sampler.run_nested(checkpoint_file='dynesty.save')
+            self.sampler = sampler
+        elif pool is None:
+            self.sampler = emcee.EnsembleSampler(nwalkers, ndim,
+                                                 _lnprob_night,
+                                                 args=(self.fitdata, lower,
+                                                       upper, self.theta_names,
+                                                       self.fitarg,
+                                                       self.fithelp_night))
+            self.sampler.run_mcmc(pos, nruns, progress=progress,
+                                  skip_initial_state_check=True)
+        else:
+            # fit arguments are sent once per worker
+            pool.set_args(self.fitdata, lower, upper, self.theta_names,
+                          self.fitarg, self.fithelp_night)
+            self.sampler = emcee.EnsembleSampler(nwalkers, ndim,
+                                                 pool.task(_lnprob_night),
+                                                 pool=pool)
+            self.sampler.run_mcmc(pos, nruns, progress=progress,
+                                  skip_initial_state_check=True)
 
     def get_fit_result(self, plot=True, plot_corner=False, ret=False):
         if not self.no_fit:
@@ -3723,13 +6868,13 @@ class GravMNightFit(GravNight, GravPhaseMaps):
                            None, None, phasemaps, None, None, None,
                            None, None, None,
                            False, pm_sources,
-                           only_stars]
+                           only_stars, None, None]
             else:
                 fithelp = [nsource, fit_for, bispec_ind, fit_mode, wave, dlambda,
                            None, None, phasemaps, None, None, None,
                            None, None, None,
                            False, None,
-                           only_stars]
+                           only_stars, None, None]
             (visamp, visphi,
              closure) = _calc_vis_mstars(_theta, fitarg[:, ndx],
                                                          fithelp)
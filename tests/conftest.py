@@ -0,0 +1,34 @@
+import os
+import numba
+import pytest
+
+# the parallel kernels of the tests run in the same process as the
+# forked pools, the parent then hangs at exit with the TBB layer
+numba.config.THREADING_LAYER = 'workqueue'
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'Tutorial', 'data')
+
+
+@pytest.fixture(scope='session')
+def data_files():
+    """
+    The reduced files of the tutorial
+    """
+    return [os.path.join(DATA_DIR, name) for name in
+            ['GRAVI.2022-05-23T04:32:18.360_dualscivis_science_'
+             'dualsciviscalibrated.fits',
+             'GRAVI.2022-08-17T00:08:55.346_dualscivis_science_'
+             'dualsciviscalibrated.fits']]
+
+
+@pytest.fixture(scope='session', autouse=True)
+def phasemap_dir(tmp_path_factory):
+    """
+    Phasemap store of the tests, load_phasemaps creates the maps in
+    there when they are needed (never in the cache of the user)
+    """
+    path = tmp_path_factory.mktemp('phasemaps')
+    patch = pytest.MonkeyPatch()
+    patch.setenv('MYGRAVIPY_PHASEMAPS', str(path))
+    yield path
+    patch.undo()
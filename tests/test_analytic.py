@@ -0,0 +1,94 @@
+import itertools
+import warnings
+import numpy as np
+import pytest
+from scipy import integrate
+
+from mygravipy import GravMFit
+from mygravipy import gravmfit
+
+# range of the fit: alpha of the sources, s = B*skypos-opd [micron],
+# channels of the K band with the spacing of LOW to HIGH resolution
+ALPHA = [-8, -3, -1, 0, 0.5, 1, 3, 8]
+S = [0, 1e-4, 1e-2, 0.3, 1, 3, 10, 50, 200, -5, -50]
+LAMBDA0 = [1.98, 2.2, 2.42]
+DLAMBDA = [0.01, 0.05, 0.1]
+
+
+def _quad_intensity(s, alpha, lambda0, dlambda):
+    def integrand(wave, part):
+        vis = gravmfit._visibility_integrator(wave, s, alpha)
+        return vis.real if part == 'real' else vis.imag
+    res = [integrate.quad(integrand, lambda0-dlambda, lambda0+dlambda,
+                          args=(part,), limit=200, epsabs=0,
+                          epsrel=1e-12)[0]
+           for part in ['real', 'imag']]
+    return res[0] + 1j*res[1]
+
+
+def _mpmath_intensity(s, alpha, lambda0, dlambda):
+    """
+    mpmath version (_vis_intensity) with the call of _vis_intensity_fast
+    """
+    arrays = np.broadcast_arrays(s, alpha, lambda0, dlambda)
+    res = np.array([gravmfit._vis_intensity(*args)
+                    for args in zip(*[np.ravel(a) for a in arrays])])
+    return res.reshape(arrays[0].shape)
+
+
+@pytest.mark.parametrize('alpha', ALPHA)
+def test_kernel_quad(alpha):
+    # quad is the reference where mpmath loses precision
+    # (small s & large alpha, s = alpha = 0)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', integrate.IntegrationWarning)
+        for s, lambda0, dlambda in itertools.product(S, LAMBDA0, DLAMBDA):
+            norm = abs(gravmfit._vis_intensity_fast(0, alpha, lambda0,
+                                                    dlambda))
+            res = gravmfit._vis_intensity_fast(s, alpha, lambda0, dlambda)
+            ref = _quad_intensity(s, alpha, lambda0, dlambda)
+            assert abs(res - ref) < 1e-10*norm, (s, lambda0, dlambda)
+
+
+@pytest.mark.parametrize('alpha', ALPHA)
+def test_kernel_mpmath(alpha):
+    for s, lambda0, dlambda in itertools.product(S, LAMBDA0, DLAMBDA):
+        if abs(s) < 1:
+            continue
+        norm = abs(gravmfit._vis_intensity_fast(0, alpha, lambda0, dlambda))
+        res = gravmfit._vis_intensity_fast(s, alpha, lambda0, dlambda)
+        ref = gravmfit._vis_intensity(s, alpha, lambda0, dlambda)
+        assert abs(res - ref) < 1e-9*norm, (s, lambda0, dlambda)
+
+
+def test_kernel_broadcast():
+    s = np.array(S)[:, np.newaxis]
+    lambda0 = np.array(LAMBDA0)
+    res = gravmfit._vis_intensity_fast(s, 3., lambda0, 0.05)
+    assert res.shape == (len(S), len(LAMBDA0))
+    for idx, jdx in itertools.product(range(len(S)), range(len(LAMBDA0))):
+        assert res[idx, jdx] == gravmfit._vis_intensity_fast(
+            S[idx], 3., LAMBDA0[jdx], 0.05)
+
+
+@pytest.fixture(scope='module')
+def analytic_fit(data_files, tmp_path_factory):
+    phasemap_dir = tmp_path_factory.mktemp('no_phasemaps')
+    data = GravMFit(data_files[0], loglevel='WARNING')
+    ra_list, de_list, fr_list, initial = data.prep_fit(plot=False)
+    data.fit_stars(ra_list, de_list, fr_list, initial=initial,
+                   fit_mode='analytic', phasemaps=False, no_fit=True,
+                   plot_science=False, phasemap_dir=str(phasemap_dir))
+    # without phasemaps nothing is read or created
+    assert not hasattr(data, 'phasemap_sampler')
+    assert not any(phasemap_dir.iterdir())
+    return data.plotdata
+
+
+def test_chi2_mpmath(analytic_fit, monkeypatch):
+    chi2 = [gravmfit._lnlike_mstars(*plotdata)
+            for plotdata in analytic_fit]
+    monkeypatch.setattr(gravmfit, '_vis_intensity_fast', _mpmath_intensity)
+    chi2_mpmath = [gravmfit._lnlike_mstars(*plotdata)
+                   for plotdata in analytic_fit]
+    np.testing.assert_allclose(chi2, chi2_mpmath, rtol=1e-9)
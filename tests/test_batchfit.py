@@ -0,0 +1,85 @@
+import os
+import pandas as pd
+import pytest
+
+from mygravipy import batchfit
+from mygravipy.gravmfit import FitResultStore
+
+FIT_KWARGS = dict(phasemaps=False, fit_mode='analytic', nwalkers=40,
+                  nruns=10)
+
+
+@pytest.fixture
+def fit_dir(data_files, tmp_path, monkeypatch):
+    """
+    Directory with the first tutorial file, results in tmp_path
+    """
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / 'data'
+    path.mkdir()
+    os.symlink(data_files[0], path / os.path.basename(data_files[0]))
+    return path
+
+
+def test_batch_resume(fit_dir):
+    batch = batchfit.BatchFit(str(fit_dir), loglevel='WARNING', **FIT_KWARGS)
+    assert len(batch.files) == 1
+    assert not batch.has_result(batch.files[0])
+    summary = batch.run()
+    assert list(summary['status']) == ['done']
+    assert list(summary['attempts']) == [1]
+    assert batch.has_result(batch.files[0])
+    assert FitResultStore().load(batch.files[0], 'batch') is not None
+    # saved results are skipped, refit fits again
+    summary = batchfit.BatchFit(str(fit_dir), loglevel='WARNING',
+                                **FIT_KWARGS).run()
+    assert list(summary['status']) == ['exists']
+    summary = batchfit.BatchFit(str(fit_dir), loglevel='WARNING',
+                                refit=True, **FIT_KWARGS).run()
+    assert list(summary['status']) == ['done']
+
+
+def test_batch_failed(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'broken_dualsciviscalibrated.fits').write_text('no fits')
+    batch = batchfit.BatchFit(str(tmp_path), retries=2, loglevel='WARNING',
+                              **FIT_KWARGS)
+    summary = batch.run()
+    assert list(summary['status']) == ['failed']
+    assert list(summary['attempts']) == [3]
+    assert 'Traceback' in summary['error'][0]
+
+
+def test_batch_timeout(fit_dir):
+    batch = batchfit.BatchFit(str(fit_dir), timeout=0.2, retries=1,
+                              loglevel='WARNING', **FIT_KWARGS)
+    summary = batch.run()
+    assert list(summary['status']) == ['timeout']
+    assert list(summary['attempts']) == [2]
+    assert summary['time'][0] < 5
+    assert not batch.has_result(batch.files[0])
+
+
+def test_no_files(tmp_path):
+    with pytest.raises(ValueError):
+        batchfit.BatchFit(str(tmp_path))
+
+
+def test_main(fit_dir, tmp_path):
+    (fit_dir / 'broken_dualsciviscalibrated.fits').write_text('no fits')
+    summary_file = str(tmp_path / 'summary.csv')
+    argv = [str(fit_dir), '--nwalkers', '40', '--nruns', '10',
+            '--retries', '0', '--loglevel', 'WARNING',
+            '--summary', summary_file,
+            '-o', 'phasemaps=False', '-o', 'fit_mode=analytic']
+    # one failed file
+    assert batchfit.main(argv) == 1
+    summary = pd.read_csv(summary_file)
+    assert sorted(summary['status']) == ['done', 'failed']
+    os.remove(fit_dir / 'broken_dualsciviscalibrated.fits')
+    assert batchfit.main(argv) == 0
+    assert list(pd.read_csv(summary_file)['status']) == ['exists']
+    with pytest.raises(SystemExit):
+        batchfit.main([str(fit_dir), '-o', 'nruns'])
+    with pytest.raises(SystemExit):
+        batchfit.main([str(tmp_path / 'empty')])
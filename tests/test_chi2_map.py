@@ -0,0 +1,45 @@
+import logging
+import numpy as np
+
+from mygravipy import GravMFit
+from mygravipy import gravmfit
+
+
+def test_map_minima():
+    y, x = np.mgrid[:21, :21]
+    # decreasing to the left edge, local minimum at (10, 12)
+    chi2 = x + 10. - 5*np.exp(-((x - 12)**2 + (y - 10)**2)/4)
+    minima, at_edge = gravmfit._map_minima(chi2, 5)
+    assert at_edge
+    assert list(zip(*minima)) == [(10, 12)]
+    # only minima on the edge: those are returned
+    minima, at_edge = gravmfit._map_minima(x + 10., 5)
+    assert at_edge and np.all(minima[1] == 0)
+    # minimum inside
+    minima, at_edge = gravmfit._map_minima(np.hypot(x - 3, y - 4), 5)
+    assert not at_edge
+    assert list(zip(*minima)) == [(4, 3)]
+
+
+def test_chi2_map_edge(data_files, caplog):
+    data = GravMFit(data_files[0], loglevel='WARNING')
+    ra_list, de_list, fr_list, initial = data.prep_fit(plot=False)
+    size = 3
+    with caplog.at_level(logging.WARNING):
+        ra, de, maps = data.chi2_map(ra_list, de_list, fr_list,
+                                     initial=initial, size=size, step=1,
+                                     phasemaps=False)
+    for _map in maps:
+        chi2 = _map['chi2']
+        edge = np.ones(chi2.shape, dtype=bool)
+        edge[1:-1, 1:-1] = False
+        warned = ('Companion %i: chi2 is lowest at the edge'
+                  % (_map['companion'] + 1)) in caplog.text
+        assert warned == (chi2[edge].min() < chi2[~edge].min())
+        # the seeds are inside the map
+        comp = _map['companion']
+        for seed_ra, seed_dec, _ in _map['seeds']:
+            assert abs(seed_ra - ra_list[comp]) < size
+            assert abs(seed_dec - de_list[comp]) < size
+    # the second companion of the tutorial is further off
+    assert 'Companion 2: chi2 is lowest at the edge' in caplog.text
@@ -0,0 +1,174 @@
+import numpy as np
+import pytest
+
+from mygravipy import GravMFit
+from mygravipy import gravmfit
+
+SETUPS = {'nomaps': dict(phasemaps=False),
+          'phasemaps': dict(phasemaps=True),
+          'fit_phasemaps': dict(phasemaps=True, fit_phasemaps=True)}
+
+
+@pytest.fixture(scope='module', params=list(SETUPS))
+def fit_setup(request, data_files):
+    data = GravMFit(data_files[0], loglevel='WARNING')
+    ra_list, de_list, fr_list, initial = data.prep_fit(plot=False)
+    data.fit_stars(ra_list, de_list, fr_list, initial=initial, no_fit=True,
+                   plot_science=False, coh_loss=True,
+                   **SETUPS[request.param])
+    return data.plotdata[0]
+
+
+def test_likelihoods_equal(fit_setup):
+    theta, fitdata, fitarg, fithelp = fit_setup
+    rng = np.random.default_rng(1)
+    thetas = theta + 0.05*rng.standard_normal((7, len(theta)))
+    bound = np.full(len(theta), np.inf)
+
+    single = [gravmfit._lnprob_mstars(th, fitdata, -bound, bound, fitarg,
+                                      fithelp) for th in thetas]
+    batch = gravmfit._lnprob_mstars_batch(thetas, fitdata, -bound, bound,
+                                          fitarg, fithelp)
+    pack = gravmfit._pack_mstars(fitdata, fitarg, fithelp)
+    compiled = gravmfit._lnprob_mstars_numba(thetas, -bound, bound, pack)
+    parallel = gravmfit._lnprob_mstars_numba(thetas, -bound, bound, pack,
+                                             parallel=True)
+    assert np.all(np.isfinite(single))
+    np.testing.assert_allclose(batch, single, rtol=1e-12)
+    np.testing.assert_allclose(compiled, single, rtol=1e-12)
+    np.testing.assert_allclose(parallel, single, rtol=1e-12)
+    # the chi2 of _lnlike_mstars
+    np.testing.assert_allclose(
+        -0.5*gravmfit._lnlike_mstars(thetas[0], fitdata, fitarg, fithelp),
+        single[0], rtol=1e-12)
+
+
+def test_likelihood_bounds(fit_setup):
+    theta, fitdata, fitarg, fithelp = fit_setup
+    lower, upper = theta - 1, theta + 1
+    thetas = np.array([theta, theta + 2])
+    pack = gravmfit._pack_mstars(fitdata, fitarg, fithelp)
+    for lnprob in [gravmfit._lnprob_mstars_batch(thetas, fitdata, lower,
+                                                 upper, fitarg, fithelp),
+                   gravmfit._lnprob_mstars_numba(thetas, lower, upper, pack)]:
+        assert np.isfinite(lnprob[0]) and lnprob[1] == -np.inf
+
+
+def test_flux_norm_cache_batch():
+    wave = np.linspace(2.0, 2.4, 5)
+    dlambda = np.full((6, 5), 0.02)
+    cache = gravmfit.FluxNormCache(maxsize=8)
+    rng = np.random.default_rng(2)
+    # one fixed alpha (stars) and more new ones per call than maxsize
+    for _ in range(3):
+        alpha = np.concatenate(([-6.], rng.uniform(-5, 5, 20)))
+        res = cache(alpha, wave, dlambda, 'numeric')
+        np.testing.assert_array_equal(
+            res, gravmfit._ind_visibility_batch(
+                np.zeros((21, 6, 5)), alpha, wave, dlambda, 'numeric'))
+    assert cache.hits == 2
+
+
+def test_flux_norm_cache_fit(data_files):
+    # free alpha of SgrA*, more walkers per step than the cache size:
+    # the fixed alphas of the stars & the background are always hit
+    data = GravMFit(data_files[0], loglevel='WARNING')
+    ra_list, de_list, fr_list, _ = data.prep_fit(plot=False)
+    nwalkers, nruns = 600, 2
+    cache = gravmfit._flux_norm_cache
+    cache.clear()
+    data.fit_stars(ra_list, de_list, fr_list,
+                   initial=[-0.5, 3, -6, 0.1, 0, 0, 1, 1],
+                   fixed_BH_alpha=False, fit_mode='analytic',
+                   phasemaps=False, compiled=False, onlypol=0,
+                   nwalkers=nwalkers, nruns=nruns, plot_science=False)
+    # emcee evaluates half of the walkers per call
+    assert nwalkers//2 > cache.maxsize
+    assert cache.hits == 2*nwalkers*nruns
+
+
+def test_compacted_chi2(fit_setup):
+    theta, fitdata, fitarg, fithelp = fit_setup
+    data = [np.array(d) for d in fitdata]
+    (visamp, visamp_error, visamp_flag, vis2, vis2_error, vis2_flag,
+     closure, closure_error, closure_flag,
+     visphi, visphi_error, visphi_flag) = data
+    bispec_ind = np.asarray(fithelp[2])
+    # first baseline, its triangles and the last used channel flagged
+    chan = np.flatnonzero(~visamp_flag.all(axis=0))[-1]
+    for flag in [visamp_flag, vis2_flag, visphi_flag]:
+        flag[0] = True
+        flag[:, chan] = True
+    closure_flag[np.any(bispec_ind == 0, axis=1)] = True
+    closure_flag[:, chan] = True
+    # flagged points with invalid values do not enter
+    visamp[0, 0] = np.nan
+    visphi_error[0, 1] = 0
+
+    compact = gravmfit.PreparedData(data, bispec_ind)
+    assert 0 not in compact.bl
+    assert chan not in compact.chan_index
+
+    fulltheta = np.array(theta, dtype=float)
+    for ddx in range(len(fithelp[6])):
+        fulltheta = np.insert(fulltheta, fithelp[6][ddx], fithelp[7][ddx])
+    model_visamp, model_visphi, model_closure = gravmfit._calc_vis_mstars(
+        fulltheta, fitarg, fithelp)
+
+    def masked(res, error, flag):
+        return np.sum(np.where(flag, 0, res**2/np.where(flag, 1, error)**2))
+
+    def phase(model, data):
+        return np.degrees(np.abs(np.exp(1j*np.radians(model))
+                                 - np.exp(1j*np.radians(data))))
+
+    fit_for = fithelp[1]
+    chi2 = (fit_for[0]*masked(model_visamp - visamp, visamp_error,
+                              visamp_flag)
+            + fit_for[1]*masked(model_visamp**2 - vis2, vis2_error,
+                                vis2_flag)
+            + fit_for[2]*masked(phase(model_closure, closure),
+                                closure_error, closure_flag)
+            + fit_for[3]*masked(phase(model_visphi, visphi), visphi_error,
+                                visphi_flag))
+    np.testing.assert_allclose(
+        gravmfit._lnlike_mstars(theta, compact, fitarg, fithelp), chi2,
+        rtol=1e-12)
+
+
+def test_residuals_jacobian(fit_setup):
+    theta, fitdata, fitarg, fithelp = fit_setup
+    theta = np.array(theta, dtype=float)
+    res = gravmfit._residuals_mstars(theta, fitdata, fitarg, fithelp)
+    np.testing.assert_allclose(
+        np.sum(res**2),
+        gravmfit._lnlike_mstars(theta, fitdata, fitarg, fithelp),
+        rtol=1e-12)
+
+    jac = gravmfit._jacobian_mstars(theta, fitdata, fitarg, fithelp)
+    assert jac.shape == (len(res), len(theta))
+    # one sided differences of the single parameter set residuals
+    for idx in range(len(theta)):
+        h = 1e-7*max(abs(theta[idx]), 1)
+        step = np.copy(theta)
+        step[idx] += h
+        diff = (gravmfit._residuals_mstars(step, fitdata, fitarg, fithelp)
+                - res) / h
+        np.testing.assert_allclose(jac[:, idx], diff, rtol=0,
+                                   atol=1e-4*np.max(np.abs(diff)) + 1e-8)
+
+
+def test_least_squares_fit(data_files):
+    data = GravMFit(data_files[0], loglevel='WARNING')
+    ra_list, de_list, fr_list, initial = data.prep_fit(plot=False)
+    kwargs = dict(initial=initial, fit_mode='analytic', phasemaps=False,
+                  onlypol=0, plot_science=False)
+    data.fit_stars(ra_list, de_list, fr_list, no_fit=True, **kwargs)
+    chi2_in = gravmfit._lnlike_mstars(*data.plotdata[0])
+    data.fit_stars(ra_list, de_list, fr_list, minimizer='leastsq',
+                   minmethod='least_squares', **kwargs)
+    assert gravmfit._lnlike_mstars(*data.plotdata[0]) < 0.5*chi2_in
+    # uncertainties from the Jacobian for the free parameters
+    errors = data.fittab.iloc[3, 1:].to_numpy(dtype=float)
+    free = np.setdiff1d(np.arange(len(data.theta_allnames)), data.todel)
+    assert np.all(np.isfinite(errors[free])) and np.all(errors[free] > 0)
@@ -0,0 +1,88 @@
+import logging
+import emcee
+import numpy as np
+
+from mygravipy import GravMFit
+from mygravipy import gravmfit
+
+
+def _lnprob_gauss(theta):
+    return -0.5*np.sum(theta**2/np.array([1., 0.1])**2)
+
+
+def test_converge_gauss():
+    np.random.seed(1)
+    sampler = emcee.EnsembleSampler(16, 2, _lnprob_gauss)
+    pos = np.random.randn(16, 2)*0.1
+    gravmfit._sample_emcee(sampler, pos, 20000, converge=(50, 0.05, 100))
+    conv = gravmfit._emcee_convergence(sampler, 20000, ntau=50,
+                                       converge=True)
+    # stopped once converged, long before nruns
+    assert conv['converged']
+    assert conv['nsteps'] < 20000 and conv['nsteps'] % 100 == 0
+    assert conv['steps_saved'] == 20000 - conv['nsteps']
+    assert conv['burnin'] == int(2*conv['tau'])
+    assert conv['thin'] == max(1, int(conv['tau']/2))
+    # the samples after burn-in & thinning have the right width
+    flat = sampler.get_chain(discard=conv['burnin'], thin=conv['thin'],
+                             flat=True)
+    np.testing.assert_allclose(flat.std(axis=0), [1, 0.1], rtol=0.15)
+
+    # fixed length: the last steps are used, no convergence required
+    conv = gravmfit._emcee_convergence(sampler, conv['nsteps'], ntau=50)
+    assert conv['burnin'] == conv['nsteps'] - 200 and conv['thin'] == 1
+
+
+def test_convergence_warning(data_files, caplog):
+    data = GravMFit(data_files[0], loglevel='INFO')
+    ra_list, de_list, fr_list, initial = data.prep_fit(plot=False)
+    kwargs = dict(initial=initial, fit_mode='analytic', phasemaps=False,
+                  onlypol=0, nwalkers=40, nruns=20, plot_science=False)
+    with caplog.at_level(logging.INFO):
+        data.fit_stars(ra_list, de_list, fr_list, **kwargs)
+    # fixed length runs only report tau
+    assert 'MCMC: 20 steps' in caplog.text
+    assert 'MCMC not converged' not in caplog.text
+
+    caplog.clear()
+    with caplog.at_level(logging.INFO):
+        data.fit_stars(ra_list, de_list, fr_list, converge=True,
+                       converge_every=10, **kwargs)
+    warnings = [r.getMessage() for r in caplog.records
+                if r.levelno == logging.WARNING]
+    assert any(m.startswith('MCMC not converged: 20 steps < 50 tau')
+               for m in warnings)
+    converged = data.fittab['converged'].dropna()
+    assert len(converged) and not converged.astype(bool).any()
+
+
+def test_optimized_walkers(data_files):
+    data = GravMFit(data_files[0], loglevel='WARNING')
+    ra_list, de_list, fr_list, initial = data.prep_fit(plot=False)
+    kwargs = dict(initial=initial, fit_mode='analytic', phasemaps=False,
+                  onlypol=0, plot_science=False)
+    data.fit_stars(ra_list, de_list, fr_list, no_fit=True, **kwargs)
+    theta, fitdata, fitarg, fithelp = data.plotdata[0]
+    theta = np.array(theta, dtype=float)
+    chi2_in = gravmfit._lnlike_mstars(theta, fitdata, fitarg, fithelp)
+    lower, upper = theta - 5, theta + 5
+
+    np.random.seed(2)
+    pos, out = gravmfit._optimized_walkers(theta, 200, lower, upper, fitdata,
+                                           fitarg, fithelp, width=0.1)
+    assert out.success and 2*out.cost < 0.5*chi2_in
+    assert pos.shape == (200, len(theta))
+    assert np.all(pos > lower) and np.all(pos < upper)
+    # ball around the optimum, standard deviations limited to width,
+    # clipped at the boundaries
+    std = pos.std(axis=0)
+    assert np.all(std < 0.13)
+    free = out.active_mask == 0
+    assert np.all(np.abs(pos.mean(axis=0) - out.x)[free]
+                  < 4*std[free]/np.sqrt(200))
+
+    # MCMC from the optimum
+    np.random.seed(2)
+    data.fit_stars(ra_list, de_list, fr_list, optimize=True, nwalkers=40,
+                   nruns=20, **kwargs)
+    assert gravmfit._lnlike_mstars(*data.plotdata[0]) < 0.5*chi2_in
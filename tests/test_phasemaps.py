@@ -0,0 +1,272 @@
+import os
+import numpy as np
+import pytest
+from scipy import ndimage
+
+from mygravipy import gravmfit
+
+
+def small_phasemaps(tmp_path, wave=(2.0, 2.3)):
+    """
+    GravPhaseMaps of a made up setup with few channels and its store
+    """
+    maps = gravmfit.GravPhaseMaps(loglevel='WARNING')
+    maps.wlSC = np.array(wave)
+    maps.resolution = 'TEST'
+    maps.phasemap_dir = str(tmp_path)
+    store = gravmfit.PhasemapStore(str(tmp_path), loglevel='WARNING')
+    key = store.key(maps.tel, maps.resolution, maps.smoothkernel,
+                    maps.datayear, maps.wlSC)
+    return maps, store, key
+
+
+def test_store_save_load(tmp_path):
+    store = gravmfit.PhasemapStore(str(tmp_path / 'store'))
+    key = store.key('UT', 'LOW', 15, 2019, [2.0, 2.1])
+    assert not store.ready(key)
+    arrays = {'amp': np.random.random((2, 4, 3, 3)).astype(np.float32),
+              'pha': np.zeros((2, 4, 3, 3), dtype=np.float32)}
+    store.save(key, arrays, tel='UT')
+    assert store.ready(key)
+    assert store.manifest(key)['tel'] == 'UT'
+    loaded = store.load(key, mmap_mode='r')
+    for name, array in arrays.items():
+        np.testing.assert_array_equal(loaded[name], array)
+    # a new version without pha removes the old array
+    store.save(key, {'amp': arrays['amp']})
+    assert sorted(store.load(key)) == ['amp']
+    assert not os.path.exists(store.path(key, 'pha'))
+    # no temporary files are left
+    assert not [f for f in os.listdir(store.cache_dir)
+                if f.startswith('.tmp_')]
+
+
+def test_store_permissions(tmp_path):
+    store = gravmfit.PhasemapStore(str(tmp_path))
+    umask = os.umask(0o022)
+    try:
+        store.save('test', {'amp': np.zeros(3)})
+    finally:
+        os.umask(umask)
+    for path in [store.path('test'), store.path('test', 'amp')]:
+        assert os.stat(path).st_mode & 0o777 == 0o644
+
+
+def test_load_creates_missing_maps(tmp_path):
+    maps, store, key = small_phasemaps(tmp_path)
+    assert not store.ready(key)
+    maps.load_phasemaps(interp=True)
+    assert store.ready(key)
+    sampler = maps.phasemap_sampler
+    assert sampler.maps[0].shape == (2, 4, 201, 201)
+    # second load from the store, same maps
+    loaded = store.load(key)
+    np.testing.assert_array_equal(sampler.maps[0], loaded['amp'])
+    amp = loaded['amp']
+    assert np.all(amp >= 0) and np.nanmax(amp) <= 1 + 1e-6
+
+
+def test_resume_interrupted(tmp_path, monkeypatch):
+    wave = (2.0, 2.15, 2.3)
+    clean, clean_store, key = small_phasemaps(tmp_path / 'clean', wave)
+    clean.create_phasemaps(plot=False, phasemap_dir=str(tmp_path / 'clean'))
+
+    maps, store, key = small_phasemaps(tmp_path / 'resume', wave)
+    slab = gravmfit._phasemap_slab
+    calls = []
+
+    def interrupted(wdx, wl):
+        calls.append(wdx)
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+        return slab(wdx, wl)
+
+    monkeypatch.setattr(gravmfit, '_phasemap_slab', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        maps.create_phasemaps(plot=False, phasemap_dir=str(tmp_path / 'resume'))
+    assert not store.ready(key)
+
+    calls.clear()
+    monkeypatch.setattr(gravmfit, '_phasemap_slab',
+                        lambda wdx, wl: calls.append(wdx) or slab(wdx, wl))
+    maps.create_phasemaps(plot=False, phasemap_dir=str(tmp_path / 'resume'))
+    # only the missing wavelengths are computed
+    assert calls == [1, 2]
+    assert store.ready(key)
+    resumed = store.load(key)
+    for name, array in clean_store.load(key).items():
+        np.testing.assert_array_equal(resumed[name], array)
+
+
+def test_memmapped_normalised_maps(tmp_path):
+    maps, store, key = small_phasemaps(tmp_path)
+    maps.load_phasemaps(interp=True)
+    # loaded again from the store
+    maps.load_phasemaps(interp=True)
+    amp, pha, denom = maps.phasemap_sampler.maps
+    for name, array in zip(['amp', 'pha', 'denom'], [amp, pha, denom]):
+        # read-only memory maps of the store files, not copies
+        handle = gravmfit._memmap_handle(array)
+        assert handle is not None
+        assert handle[1] == store.path(key, name)
+        assert array.dtype == np.float32
+        assert not array.flags.writeable
+    # normalised to the maximum of each channel and telescope
+    np.testing.assert_allclose(amp.max(axis=(2, 3)), 1)
+    np.testing.assert_allclose(denom.max(axis=(2, 3)), 1)
+    assert np.abs(pha).max() <= 180
+
+
+def test_convert_complex_maps(tmp_path):
+    maps, store, key = small_phasemaps(tmp_path)
+    rng = np.random.default_rng(4)
+    shape = (2, 4, 201, 201)
+    pm = rng.normal(size=shape) + 1j*rng.normal(size=shape)
+    pm_denom = rng.uniform(0.1, 2, shape)
+    # complex maps of earlier versions in the store
+    store.save(key, {'pm': pm, 'pm_denom': pm_denom})
+    maps.load_phasemaps(interp=True)
+    assert sorted(store.manifest(key)['arrays']) == ['amp', 'denom', 'pha']
+    amp, pha, denom = maps.phasemap_sampler.maps
+    np.testing.assert_allclose(
+        amp, np.abs(pm)/np.abs(pm).max(axis=(2, 3), keepdims=True),
+        rtol=1e-6)
+    np.testing.assert_allclose(pha, np.angle(pm, deg=True), rtol=1e-6,
+                               atol=1e-4)
+    np.testing.assert_allclose(
+        denom, pm_denom/pm_denom.max(axis=(2, 3), keepdims=True), rtol=1e-6)
+
+
+def random_sampler(nwave=3, size=21, seed=1):
+    rng = np.random.default_rng(seed)
+    shape = (nwave, 4, size, size)
+    maps = [rng.random(shape).astype(np.float32),
+            rng.uniform(-180, 180, shape).astype(np.float32),
+            rng.random(shape).astype(np.float32)]
+    center = np.full((2, 4), (size-1)/2)
+    return gravmfit.PhasemapSampler(*maps, center=center), maps
+
+
+def test_sampler_bilinear():
+    sampler, maps = random_sampler()
+    rng = np.random.default_rng(2)
+    x = rng.uniform(0, 20, (50, 4))
+    y = rng.uniform(0, 20, (50, 4))
+    # corners and edges of the maps
+    x[:4] = [[0, 0, 20, 20]]
+    y[:4] = [[0, 20, 0, 20]]
+    res = sampler.sample(x, y)
+    assert res.shape == (50, 3, 4, 3)
+    for mdx, m in enumerate(maps):
+        for wdx, tel in np.ndindex(3, 4):
+            ref = ndimage.map_coordinates(m[wdx, tel].astype(float),
+                                          [x[:, tel], y[:, tel]], order=1)
+            np.testing.assert_allclose(res[:, mdx, tel, wdx], ref,
+                                       rtol=1e-12, atol=1e-12)
+    # only some channels
+    np.testing.assert_array_equal(sampler.sample(x, y, chan=[2, 0]),
+                                  res[..., [2, 0]])
+    with pytest.raises(ValueError):
+        sampler.sample(x + 1, y)
+    with pytest.raises(ValueError):
+        sampler.sample(np.full((1, 4), np.nan), y[:1])
+
+
+def test_sampler_positions():
+    sampler, maps = random_sampler()
+    ra, dec = np.array([3.1, -2.5]), np.array([-1.2, 4.4])
+    dra, ddec = np.array([0.5, -0.2, 0.1, 0.]), np.array([0., 0.3, -0.4, 1.])
+    northangle = np.array([0.3, 0.4, 0.5, 0.6])
+    x, y = sampler.positions(ra, dec, northangle, dra, ddec)
+    for pdx, tel in np.ndindex(2, 4):
+        pos = np.array([ra[pdx] + dra[tel], dec[pdx] + ddec[tel]])
+        rot = np.dot(gravmfit._rotation(northangle[tel]), pos)
+        assert np.isclose(x[pdx, tel], rot[1] + 10)
+        assert np.isclose(y[pdx, tel], rot[0] + 10)
+    # baselines from the telescopes
+    res = sampler(ra, dec, northangle, dra, ddec)
+    tel = sampler.sample(x, y)
+    assert res.shape == (2, 3, 6, 2, 3)
+    np.testing.assert_array_equal(res[:, :, :, 0], tel[:, :, sampler.tel1])
+    np.testing.assert_array_equal(res[:, :, :, 1], tel[:, :, sampler.tel2])
+
+
+def test_coupling_table(data_files, tmp_path):
+    data = gravmfit.GravMFit(data_files[0], loglevel='WARNING')
+    data.smoothkernel, data.datayear = 15, 2019
+    data.northangle = [0.3, 0.4, 0.5, 0.6]
+    data.dra = [0.5, -0.2, 0.1, 0.]
+    data.ddec = [0., 0.3, -0.4, 1.]
+    sampler, maps = random_sampler(nwave=len(data.wlSC), size=201)
+    boxes = [[-3, 3, -2, 2], [10, 20, -30, -22]]
+    table = data.coupling_table(sampler, boxes, str(tmp_path))
+    assert max(table.shape) < 60
+
+    rng = np.random.default_rng(3)
+    for ra_min, ra_max, dec_min, dec_max in boxes:
+        ra = rng.uniform(ra_min, ra_max, 20)
+        dec = rng.uniform(dec_min, dec_max, 20)
+        args = (ra, dec, data.northangle, data.dra, data.ddec)
+        np.testing.assert_allclose(table(*args), sampler(*args),
+                                   rtol=1e-9, atol=1e-9)
+    # saved in the cache and loaded in the next fit
+    cached = data.coupling_table(None, boxes, str(tmp_path))
+    assert gravmfit._memmap_handle(cached.maps[0]) is not None
+    np.testing.assert_array_equal(cached.center, table.center)
+    for cached_map, table_map in zip(cached.maps, table.maps):
+        np.testing.assert_array_equal(cached_map, table_map)
+    # other boundaries are a new table
+    data.coupling_table(sampler, [[-4, 4, -2, 2]], str(tmp_path))
+    assert len(list(tmp_path.glob('Coupling_*.json'))) == 2
+    with pytest.raises(ValueError):
+        data.coupling_table(sampler, [[-300, 3, -2, 2]])
+
+
+def test_resample_polynomial():
+    ref_wave = np.round(np.arange(1.95, 2.55, 0.01), 6)
+    rng = np.random.default_rng(5)
+    coef = rng.normal(size=(4, 4, 3, 3))
+
+    def cubic(wave):
+        wave = np.asarray(wave)[:, None, None, None] - 2.2
+        return sum(c*wave**k for k, c in enumerate(coef))
+
+    ref_pm = cubic(ref_wave) + 1j*cubic(ref_wave)[..., ::-1]
+    ref_denom = cubic(ref_wave)**2
+    # on the reference grid the maps are reproduced, between the nodes
+    # the order 4 interpolation is exact for cubic polynomials
+    pm, denom = gravmfit._resample_phasemaps(ref_wave, ref_pm, ref_denom,
+                                             ref_wave[[0, 17, -1]])
+    np.testing.assert_allclose(pm, ref_pm[[0, 17, -1]], atol=1e-12)
+    np.testing.assert_allclose(denom, ref_denom[[0, 17, -1]], atol=1e-12)
+    wave = [1.951, 2.0333, 2.2, 2.5391]
+    pm, denom = gravmfit._resample_phasemaps(ref_wave, ref_pm, ref_denom,
+                                             wave)
+    np.testing.assert_allclose(pm.real, cubic(wave), atol=1e-10)
+    np.testing.assert_allclose(pm.imag, cubic(wave)[..., ::-1], atol=1e-10)
+    with pytest.raises(ValueError):
+        gravmfit._resample_phasemaps(ref_wave, ref_pm, ref_denom, [2.6])
+
+
+def test_load_resampled_maps(tmp_path, monkeypatch):
+    wave = (2.013, 2.037)
+    ref, _, _ = small_phasemaps(tmp_path)
+    ref.create_reference_phasemaps(wave_range=(1.99, 2.06),
+                                   phasemap_dir=str(tmp_path))
+    direct, direct_store, _ = small_phasemaps(tmp_path / 'direct', wave)
+    direct.create_phasemaps(plot=False, phasemap_dir=str(tmp_path / 'direct'))
+
+    maps, store, key = small_phasemaps(tmp_path, wave)
+
+    def no_create(*args, **kwargs):
+        raise AssertionError('maps are created, not resampled')
+
+    monkeypatch.setattr(maps, 'create_phasemaps', no_create)
+    maps.load_phasemaps(interp=True)
+    # resampled maps are saved for the wavelengths of the file
+    assert store.ready(key)
+    assert sorted(store.manifest(key)['arrays']) == ['amp', 'denom', 'pha']
+    resampled = maps.phasemap_sampler.maps
+    created = direct_store.load(key)
+    np.testing.assert_allclose(resampled[0], created['amp'], atol=1e-2)
+    np.testing.assert_allclose(resampled[2], created['denom'], atol=1e-2)
@@ -0,0 +1,57 @@
+import os
+import numpy as np
+
+from mygravipy import GravMFit
+from mygravipy import gravmfit
+
+
+def _worker_sample(thetas, factor, sampler):
+    # maps of the pool sampler are attached once by the worker
+    attached = all(any(m is pm for pm in gravmfit._pool_maps.values())
+                   for m in sampler.maps)
+    return os.getpid(), attached, factor*sampler.sample(thetas, thetas)
+
+
+def test_pool_map():
+    rng = np.random.default_rng(1)
+    shape = (2, 4, 11, 11)
+    sampler = gravmfit.PhasemapSampler(
+        *[rng.random(shape).astype(np.float32) for _ in range(3)])
+    chunks = [rng.uniform(0, 10, (5, 4)) for _ in range(4)]
+    with gravmfit.SamplerPool(2, phasemaps=sampler) as pool:
+        pids = {p.pid for p in pool._pool._pool}
+        for factor in [1., 2.]:
+            # new arguments for each fit, same workers
+            pool.set_args(factor, sampler)
+            res = pool.map(pool.task(_worker_sample), chunks)
+            assert {r[0] for r in res} <= pids
+            assert all(r[1] for r in res)
+            for r, chunk in zip(res, chunks):
+                np.testing.assert_array_equal(
+                    r[2], factor*sampler.sample(chunk, chunk))
+        assert {p.pid for p in pool._pool._pool} == pids
+
+
+def test_pool_fits(data_files):
+    data = GravMFit(data_files[0], loglevel='WARNING')
+    ra_list, de_list, fr_list, initial = data.prep_fit(plot=False)
+    kwargs = dict(initial=initial, fit_mode='analytic', phasemaps=False,
+                  compiled=False, onlypol=0, nwalkers=40, nruns=3,
+                  plot_science=False)
+    np.random.seed(3)
+    data.fit_stars(ra_list, de_list, fr_list, **kwargs)
+    serial = data.fittab.iloc[:, 1:].to_numpy(dtype=float)
+
+    with gravmfit.SamplerPool(2) as pool:
+        data = GravMFit(data_files[0], loglevel='WARNING', pool=pool)
+        pids = {p.pid for p in pool._pool._pool}
+        for _ in range(2):
+            # the same chain as without the pool, for every fit
+            np.random.seed(3)
+            data.fit_stars(ra_list, de_list, fr_list, **kwargs)
+            np.testing.assert_allclose(
+                data.fittab.iloc[:, 1:].to_numpy(dtype=float), serial,
+                rtol=1e-10)
+            # the walkers were evaluated by the pool
+            assert pool._handle is not None
+        assert {p.pid for p in pool._pool._pool} == pids
@@ -0,0 +1,115 @@
+import multiprocessing
+import numpy as np
+import pandas as pd
+import pytest
+
+from mygravipy.gravmfit import FitResultStore
+
+KINDS = ['in', 'M.L.', 'M.P.', '$-\\sigma$', '$+\\sigma$']
+
+
+def make_fittab(params, offset=0., pols=(0, 1), dit=0):
+    """
+    fittab in the layout of fit_stars, one block of rows per polarisation
+    """
+    tabs = []
+    for pol in pols:
+        tab = pd.DataFrame({'column': ['%s P%i_%i' % (kind, pol, dit)
+                                       for kind in KINDS]})
+        for pdx, param in enumerate(params):
+            tab[param] = (offset + 10*pol + pdx
+                          + np.array([0., 0.1, 0.2, 0.01, 0.02]))
+        # chi2 of the four observables only
+        tab['chi2'] = [1., 2., 3., 4., np.nan]
+        tabs.append(tab)
+    return pd.concat(tabs, ignore_index=True)
+
+
+def test_save_load(tmp_path):
+    store = FitResultStore(str(tmp_path / 'results.db'))
+    assert store.lookup('file.fits', 'test') is None
+    assert store.load('file.fits', 'test') is None
+    fittab = make_fittab(['dRA1', 'dDEC1', 'fr2'])
+    fittab.loc[3, 'fr2'] = np.nan
+    store.save(fittab, '/some/path/file.fits', 'test',
+               date_obs='2022-05-23T04:32:18', target='GC',
+               config='abc')
+    entry = store.lookup('file.fits', 'test')
+    assert entry['target'] == 'GC' and entry['config'] == 'abc'
+    pd.testing.assert_frame_equal(store.load('file.fits', 'test'), fittab)
+
+    # new results with other parameters replace the old ones
+    fittab = make_fittab(['dRA1', 'alpha_BH'], pols=(0,))
+    store.save(fittab, 'file.fits', 'test')
+    pd.testing.assert_frame_equal(store.load('file.fits', 'test'), fittab)
+    assert len(store.query()) == 1
+
+
+def _save_many(args):
+    path, worker, nfits = args
+    store = FitResultStore(path, loglevel='WARNING')
+    for fdx in range(nfits):
+        store.save(make_fittab(['dRA1', 'dDEC1'], offset=100*worker + fdx),
+                   'file_%i_%i.fits' % (worker, fdx), 'test',
+                   date_obs='2022-05-%02iT00:00:00' % (fdx + 1))
+    return worker
+
+
+def test_concurrent_writers(tmp_path):
+    path = str(tmp_path / 'results.db')
+    nworkers, nfits = 4, 5
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(nworkers) as pool:
+        pool.map(_save_many, [(path, worker, nfits)
+                              for worker in range(nworkers)])
+    store = FitResultStore(path)
+    assert len(store.query(name='test')) == nworkers*nfits
+    for worker in range(nworkers):
+        for fdx in range(nfits):
+            pd.testing.assert_frame_equal(
+                store.load('file_%i_%i.fits' % (worker, fdx), 'test'),
+                make_fittab(['dRA1', 'dDEC1'], offset=100*worker + fdx))
+
+
+def test_timeseries(tmp_path):
+    store = FitResultStore(str(tmp_path / 'results.db'))
+    for day, target in [(3, 'GC'), (1, 'GC'), (2, 'other')]:
+        store.save(make_fittab(['dRA1', 'fr2'], offset=day),
+                   'file_%i.fits' % day, 'test', target=target,
+                   date_obs='2022-05-%02iT00:00:00' % day, mjd=59720. + day)
+    series = store.timeseries(['dRA1', 'dDEC1'], target='GC')
+    # sorted by date, one row per polarisation
+    assert list(series['file']) == ['file_1.fits']*2 + ['file_3.fits']*2
+    assert list(series['pol']) == [0, 1, 0, 1]
+    np.testing.assert_allclose(series['dRA1'], [1.2, 11.2, 3.2, 13.2])
+    np.testing.assert_allclose(series['dRA1_m'], [1.01, 11.01, 3.01, 13.01])
+    np.testing.assert_allclose(series['dRA1_p'], [1.02, 11.02, 3.02, 13.02])
+    # parameters which were not fitted
+    assert series['dDEC1'].isna().all()
+
+    series = store.timeseries('fr2', kind='M.L.', start='2022-05-02')
+    assert list(series['file']) == ['file_2.fits']*2 + ['file_3.fits']*2
+    np.testing.assert_allclose(series['fr2'], [3.1, 13.1, 4.1, 14.1])
+
+
+def test_fit_stars_results(data_files, tmp_path, monkeypatch):
+    from mygravipy import GravMFit
+    monkeypatch.chdir(tmp_path)
+    data = GravMFit(data_files[0], loglevel='WARNING')
+    ra_list, de_list, fr_list, initial = data.prep_fit(plot=False)
+    kwargs = dict(initial=initial, phasemaps=False, fit_mode='analytic',
+                  nwalkers=40, nruns=10, plot_science=False,
+                  save_result='test')
+    data.fit_stars(ra_list, de_list, fr_list, **kwargs)
+    fittab = data.fittab
+    store = FitResultStore()
+    assert store.path == str(tmp_path / 'fitresults' / 'fitresults.db')
+    entry = store.lookup(data_files[0], 'test')
+    assert entry['date_obs'] == data.date_obs
+    pd.testing.assert_frame_equal(store.load(data_files[0], 'test'),
+                                  fittab.astype({col: float for col in
+                                                 fittab.columns[1:]}))
+    # the saved results are used instead of a new fit
+    data.fit_stars(ra_list, de_list, fr_list, **kwargs)
+    pd.testing.assert_frame_equal(data.fittab,
+                                  store.load(data_files[0], 'test'))
@@ -0,0 +1,47 @@
+import numpy as np
+
+from mygravipy import gravmfit
+
+WAVE = np.linspace(2.0, 2.4, 5)
+# two different channel widths on the baselines
+DLAMBDA = np.repeat([[0.02]*5, [0.03]*5], 3, axis=0)
+TOL = 1e-4
+
+
+def direct(s, alpha, wave=WAVE, dlambda=DLAMBDA):
+    return gravmfit._ind_visibility_batch(s, alpha, wave, dlambda,
+                                          'numeric')
+
+
+def test_smearing_table():
+    table = gravmfit.SmearingTable(WAVE, DLAMBDA, s_max=20, tol=TOL,
+                                   loglevel='WARNING')
+    assert table.error <= TOL
+    rng = np.random.default_rng(3)
+    s = rng.uniform(-20, 20, (4, 6, 5))
+    alpha = np.array([-3., 0.5, 3., 9.])
+    norm = np.abs(direct(np.zeros_like(s), alpha))
+    err = np.abs(table(s, alpha) - direct(s, alpha)) / norm
+    assert err.max() <= 2*TOL
+
+    # outside of the table: direct integration
+    s_out = np.full((2, 6, 5), 30.)
+    alpha_out = np.array([1., 12.])
+    np.testing.assert_allclose(table(s_out, alpha_out),
+                               direct(s_out, alpha_out), rtol=1e-12)
+
+    # subsets of baselines and channels
+    bl = np.array([1, 4])
+    chan = np.array([0, 3])
+    np.testing.assert_array_equal(
+        table(s[:, bl][:, :, chan], alpha, bl=bl, chan=chan),
+        table(s, alpha)[:, bl][:, :, chan])
+
+
+def test_smearing_table_matches():
+    table = gravmfit.SmearingTable(WAVE, DLAMBDA, s_max=10, tol=1e-3,
+                                   loglevel='WARNING')
+    assert table.matches(WAVE, DLAMBDA, 5, 1e-3)
+    assert not table.matches(WAVE, DLAMBDA, 20, 1e-3)
+    assert not table.matches(WAVE, DLAMBDA, 5, 1e-4)
+    assert not table.matches(WAVE + 0.01, DLAMBDA, 5, 1e-3)